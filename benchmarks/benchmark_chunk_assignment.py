@@ -0,0 +1,129 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import importlib
+from collections import defaultdict
+
+# pubrunner.pubrun is also the name of a function exported by pubrunner, so get the module directly
+pubrunModule = importlib.import_module('pubrunner.pubrun')
+
+# Older per-file version of the chunk planner that was in pubrunner.pubrun
+def assignFilesForConversion_old(files, previousAssignmentFile, outDir, outPattern, maxChunkSize, pmcidsToLastUpdate=None):
+	if not pmcidsToLastUpdate is None:
+		print("Sorting files by PMC last update metadata")
+		filesWithUpdates = [ (pmcidsToLastUpdate[pubrunModule.getPMCIDFromFilename(f)],f) for f in files ]
+		atleastOneUpdate = any (lastupdate != '' for lastupdate,f in filesWithUpdates )
+		assert atleastOneUpdate, "No update dates associated with PMCIDs. Must have been a problem loading the file"
+		filesWithUpdates = sorted(filesWithUpdates)
+		files = [ f for lastupdate,f in filesWithUpdates ]
+
+	assignedChunks = {}
+	for outputFile,chunk in previousAssignmentFile.items():
+		assert isinstance(chunk,list)
+		for f in chunk:
+			assert not f in assignedChunks
+			assignedChunks[f] = outputFile
+
+	# We'll check if any previous input files have disappeared, and set that chunk to dirty (so it is reprocessed)
+	filesSet = set(files)
+	missingFiles = [ f for f in assignedChunks.keys() if not f in filesSet ]
+	dirtyOutputFiles = set( [ assignedChunks[f] for f in missingFiles ] )
+	for f in missingFiles:
+		del assignedChunks[f]
+
+	if len(assignedChunks) > 0:
+		# We're just take the last chunk alphabetically
+		currentChunk = sorted(assignedChunks.values())[-1]
+		currentChunkSize = len( [ f for f in assignedChunks.values() if f == currentChunk ] )
+	else:
+		currentChunk = None
+		currentChunkSize = 0
+
+	outputFileNamer = pubrunModule.OutputFileNamer(outDir,outPattern)
+
+	for f in files:
+		if not f in assignedChunks:
+			if currentChunk is None or currentChunkSize >= maxChunkSize:
+				currentChunk = outputFileNamer.next()
+				currentChunkSize = 0
+			
+			assignedChunks[f] = currentChunk
+			dirtyOutputFiles.add(currentChunk)
+			currentChunkSize += 1
+
+	# Remove any dirty files to force them to be recalculated
+	for dirtyOutputFile in dirtyOutputFiles:
+		if os.path.isfile(dirtyOutputFile):
+			os.unlink(dirtyOutputFile)
+			print("Removing:", dirtyOutputFile)
+
+	outputFilesWithChunks = defaultdict(list)
+	for f,outputFile in assignedChunks.items():
+		outputFilesWithChunks[outputFile].append(f)
+
+	return outputFilesWithChunks
+
+# Creates PMCOA-like file paths along with a previous chunk assignment that has some of them
+# (with a few of those files since removed) so that the planner has to extend the last chunk
+def createSyntheticRun(fileCount,chunkSize,newFraction,removedFraction,outDir,outPattern):
+	random.seed(1)
+	files = [ '/data/PMCOA/%s/PMC%08d.nxml' % (random.choice(['comm_use','non_comm_use']),i) for i in range(fileCount) ]
+
+	previousCount = int(fileCount * (1-newFraction))
+	previousFiles = files[:previousCount]
+	previousChunks = {}
+	for i in range(0,len(previousFiles),chunkSize):
+		outputFile = os.path.join(outDir,outPattern % (i // chunkSize))
+		previousChunks[outputFile] = previousFiles[i:i+chunkSize]
+
+	# Make the last chunk partially filled
+	lastChunk = max(previousChunks.keys())
+	previousChunks[lastChunk] = previousChunks[lastChunk][:chunkSize//2]
+
+	removed = set(random.sample(previousFiles, int(previousCount*removedFraction)))
+	files = [ f for f in files if not f in removed ]
+
+	return files,previousChunks
+
+# The output files from the previous run exist (which is what the chunk naming checks)
+def createPreviousOutputs(previousChunks):
+	for outputFile in previousChunks.keys():
+		open(outputFile,'w').close()
+
+def timeAssignment(func,files,previousChunks,outDir,outPattern,chunkSize):
+	createPreviousOutputs(previousChunks)
+	start = time.time()
+	chunks = func(files,previousChunks,outDir,outPattern,chunkSize)
+	return time.time() - start, chunks
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the assignment of input files to conversion chunks against the older version')
+	parser.add_argument('--fileCounts',type=str,default='1000000,5000000',help='Comma-delimited numbers of synthetic file paths')
+	parser.add_argument('--chunkSize',type=int,default=2000,help='Maximum number of files per chunk')
+	parser.add_argument('--newFraction',type=float,default=0.05,help='Fraction of files that were not in the previous assignment')
+	parser.add_argument('--removedFraction',type=float,default=0.001,help='Fraction of previously assigned files that have been removed')
+	args = parser.parse_args()
+
+	outDir = tempfile.mkdtemp()
+	outPattern = 'PMCOA.%08d.bioc'
+	try:
+		for fileCount in [ int(n) for n in args.fileCounts.split(',') ]:
+			files,previousChunks = createSyntheticRun(fileCount,args.chunkSize,args.newFraction,args.removedFraction,outDir,outPattern)
+
+			oldTime,oldChunks = timeAssignment(assignFilesForConversion_old,files,previousChunks,outDir,outPattern,args.chunkSize)
+			newTime,newChunks = timeAssignment(pubrunModule.assignFilesForConversion,files,previousChunks,outDir,outPattern,args.chunkSize)
+
+			assert oldChunks == newChunks, "Chunk assignments differ between the two versions"
+
+			print("%d files in %d chunks" % (len(files),len(newChunks)))
+			print("  Old:\t%.2fs" % oldTime)
+			print("  New:\t%.2fs" % newTime)
+			print("  Speedup:\t%.2fx" % (oldTime / newTime))
+	finally:
+		shutil.rmtree(outDir)
+
+if __name__ == '__main__':
+	main()
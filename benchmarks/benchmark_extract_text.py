@@ -0,0 +1,116 @@
+import argparse
+import os
+import time
+import xml.etree.cElementTree as etree
+from pubrunner.convert import extractTextFromElemList,ignoreList,separationList,cleanupText
+
+# Older recursive version of the text extraction that was in pubrunner.convert. It is quadratic in
+# the number of XML nodes
+def extractTextFromElem(elem):
+	# Extract any raw text directly in XML element or just after
+	head = ""
+	if elem.text:
+		head = elem.text
+	tail = ""
+	if elem.tail:
+		tail = elem.tail
+	
+	# Then get the text from all child XML nodes recursively
+	childText = []
+	for child in elem:
+		childText = childText + extractTextFromElem(child)
+		
+	# Check if the tag should be ignore (so don't use main contents)
+	if elem.tag in ignoreList:
+		return [tail.strip()]
+	# Add a zero delimiter if it should be separated
+	elif elem.tag in separationList:
+		return [0] + [head] + childText + [tail]
+	# Or just use the whole text
+	else:
+		return [head] + childText + [tail]
+	
+
+# Merge a list of extracted text blocks and deal with the zero delimiter
+def extractTextFromElemList_merge(list):
+	textList = []
+	current = ""
+	# Basically merge a list of text, except separate into a new list
+	# whenever a zero appears
+	for t in list:
+		if t == 0: # Zero delimiter so split
+			if len(current) > 0:
+				textList.append(current)
+				current = ""
+		else: # Just keep adding
+			current = current + " " + t
+			current = current.strip()
+	if len(current) > 0:
+		textList.append(current)
+	return textList
+	
+def extractTextFromElemList_old(elemList):
+	textList = []
+	# Extracts text and adds delimiters (so text is accidentally merged later)
+	if isinstance(elemList, list):
+		for e in elemList:
+			textList = textList + extractTextFromElem(e) + [0]
+	else:
+		textList = extractTextFromElem(elemList) + [0]
+
+	# Merge text blocks with awareness of zero delimiters
+	mergedList = extractTextFromElemList_merge(textList)
+	
+	# Remove any newlines (as they can be trusted to be syntactically important)
+	mergedList = [ text.replace('\n', ' ') for text in mergedList ]
+
+	# Remove no-break spaces
+	mergedList = [ cleanupText(text) for text in mergedList ]
+	
+	return mergedList
+
+# The same sections of a PMC article that are extracted by processPMCFile
+sectionPaths = ['./front/article-meta/title-group/article-title','./front/article-meta/abstract','./body','./back','./floats-group']
+
+def loadSections(nxmlFiles):
+	sections = []
+	for nxmlFile in nxmlFiles:
+		root = etree.parse(nxmlFile).getroot()
+		for path in sectionPaths:
+			elems = root.findall(path)
+			if len(elems) > 0:
+				sections.append(elems)
+	return sections
+
+def timeExtraction(func,sections,repeats):
+	start = time.time()
+	for _ in range(repeats):
+		passages = [ func(elems) for elems in sections ]
+	return time.time() - start, passages
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the text extraction from PMC XML files against the older recursive version')
+	parser.add_argument('--nxmlDir',required=True,type=str,help='Directory containing PMC nxml files')
+	parser.add_argument('--maxFiles',type=int,default=1000,help='Maximum number of files to use')
+	parser.add_argument('--repeats',type=int,default=3,help='Number of times to extract each file')
+	args = parser.parse_args()
+
+	nxmlFiles = [ os.path.join(root,f) for root,dirs,files in os.walk(args.nxmlDir) for f in files if f.endswith('.nxml') ]
+	nxmlFiles = sorted(nxmlFiles)[:args.maxFiles]
+	assert len(nxmlFiles) > 0, "No nxml files found in %s" % args.nxmlDir
+
+	sections = loadSections(nxmlFiles)
+	nodeCount = sum( 1 for elems in sections for e in elems for _ in e.iter() )
+	print("Loaded %d sections with %d XML nodes from %d files" % (len(sections),nodeCount,len(nxmlFiles)))
+
+	oldTime,oldPassages = timeExtraction(extractTextFromElemList_old,sections,args.repeats)
+	newTime,newPassages = timeExtraction(extractTextFromElemList,sections,args.repeats)
+
+	assert oldPassages == newPassages, "Extracted passages differ between the two versions"
+
+	print("Recursive (old):\t%.3fs" % oldTime)
+	print("Streaming (new):\t%.3fs" % newTime)
+	print("Speedup:\t%.2fx" % (oldTime / newTime))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import json
+import random
+import hashlib
+import shutil
+import tempfile
+import time
+import tracemalloc
+import pubrunner
+
+def md5(text):
+	return hashlib.md5(text.encode('utf8')).hexdigest()
+
+# Creates a set of Pubmed hash files where PMIDs are spread up to maxPmid and
+# some of them reappear in later files (with and without changes)
+def createSyntheticHashes(hashDir,fileCount,pmidsPerFile,maxPmid,updateFraction):
+	random.seed(1)
+	for i in range(fileCount):
+		pubmedXMLFile = 'pubmed19n%04d.xml' % (i+1)
+		if i > 0 and random.random() < updateFraction:
+			pmids = random.sample(range(1,maxPmid+1), pmidsPerFile // 2) + random.sample(range(1,(i*maxPmid)//fileCount+1), pmidsPerFile // 2)
+		else:
+			pmids = random.sample(range(1,maxPmid+1), pmidsPerFile)
+
+		hashes = {}
+		for pmid in set(pmids):
+			version = random.randint(0,1)
+			hashes[str(pmid)] = { field:md5('%s %d %d' % (field,pmid,version)) for field in ['year','title','abstract','journal','journalISO'] }
+
+		with open(os.path.join(hashDir,pubmedXMLFile+'.hashes'),'w') as f:
+			json.dump({pubmedXMLFile:hashes},f)
+
+# The per-PMID lists that the list-based version of gatherPMIDs allocated
+def listLayoutPeak(maxPmid):
+	tracemalloc.start()
+	firstFile = [ None for _ in range(maxPmid+1) ]
+	versionCounts = [ 0 for _ in range(maxPmid+1) ]
+	pmidToFilename = list(firstFile)
+	_,peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak
+
+def main():
+	parser = argparse.ArgumentParser(description='Measure the peak memory used by gatherPMIDs on synthetic Pubmed hashes')
+	parser.add_argument('--fileCount',type=int,default=20,help='Number of Pubmed hash files')
+	parser.add_argument('--pmidsPerFile',type=int,default=30000,help='Number of PMIDs in each file')
+	parser.add_argument('--maxPmid',type=int,default=35000000,help='Largest PMID (which sets the size of the per-PMID arrays)')
+	parser.add_argument('--updateFraction',type=float,default=0.5,help='Fraction of files that update earlier PMIDs')
+	args = parser.parse_args()
+
+	tempDir = tempfile.mkdtemp()
+	try:
+		hashDir = os.path.join(tempDir,'hashes')
+		pmidDir = os.path.join(tempDir,'pmids')
+		os.makedirs(hashDir)
+		createSyntheticHashes(hashDir,args.fileCount,args.pmidsPerFile,args.maxPmid,args.updateFraction)
+
+		tracemalloc.start()
+		start = time.time()
+		pubrunner.gatherPMIDs(hashDir,pmidDir)
+		duration = time.time() - start
+		_,peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+	finally:
+		shutil.rmtree(tempDir)
+
+	print("gatherPMIDs peak memory:\t%.1fMB (%.1fs)" % (peak/(1024.0*1024.0),duration))
+	print("List-based per-PMID layout:\t%.1fMB" % (listLayoutPeak(args.maxPmid)/(1024.0*1024.0)))
+
+if __name__ == '__main__':
+	main()
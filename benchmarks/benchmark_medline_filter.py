@@ -0,0 +1,66 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import pubrunner
+from pubrunner.convert import pubmedxml2biocDocuments
+from pubrunner.pmidlist import writePMIDList,PMIDFilter
+
+# Writes a PMID list with a random sample of the PMIDs in the Pubmed files, as for a baseline file where
+# the rest of its citations have been superseded by update files
+def createPMIDList(pubmedFiles,keepFraction,pmidFile):
+	pmids = [ int(doc['pmid']) for pubmedFile in pubmedFiles for doc in pubrunner.processMedlineFile(pubmedFile) ]
+	random.seed(1)
+	keep = sorted(random.sample(pmids, int(len(pmids)*keepFraction)))
+	writePMIDList(pmidFile,keep)
+	return len(pmids),len(keep)
+
+def describeDocument(doc):
+	return doc.id, doc.infons, [ (passage.infons,passage.offset,passage.text) for passage in doc.passages ]
+
+# How the documents were filtered before, after every citation was converted
+def filterAfterConversion(pubmedFile,parser,processes,idFilter):
+	return [ doc for doc in pubmedxml2biocDocuments(pubmedFile,parser,processes) if doc.id in idFilter ]
+
+def filterBeforeConversion(pubmedFile,parser,processes,idFilter):
+	return [ doc for doc in pubmedxml2biocDocuments(pubmedFile,parser,processes,idFilter.__contains__) if doc.id in idFilter ]
+
+def timeConversion(func,pubmedFiles,parser,processes,pmidFile):
+	start = time.time()
+	docs = []
+	with PMIDFilter(pmidFile) as idFilter:
+		for pubmedFile in pubmedFiles:
+			docs += func(pubmedFile,parser,processes,idFilter)
+	return time.time() - start, docs
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark converting a heavily superseded Pubmed file with the PMID filter applied before conversion against filtering the converted documents')
+	parser.add_argument('--pubmedXMLFiles',required=True,type=str,help='Comma-delimited Pubmed XML files (e.g. from the baseline)')
+	parser.add_argument('--keepFraction',type=float,default=0.2,help='Fraction of the citations that are still current')
+	parser.add_argument('--parser',type=str,default='etree',help='XML parser to use (etree/lxml)')
+	parser.add_argument('--processes',type=int,default=1,help='Number of processes to convert each file with')
+	args = parser.parse_args()
+
+	pubmedFiles = args.pubmedXMLFiles.split(',')
+
+	tempDir = tempfile.mkdtemp()
+	try:
+		pmidFile = os.path.join(tempDir,'current.pmids')
+		totalCount,keepCount = createPMIDList(pubmedFiles,args.keepFraction,pmidFile)
+
+		afterTime,afterDocs = timeConversion(filterAfterConversion,pubmedFiles,args.parser,args.processes,pmidFile)
+		beforeTime,beforeDocs = timeConversion(filterBeforeConversion,pubmedFiles,args.parser,args.processes,pmidFile)
+
+		assert [ describeDocument(doc) for doc in afterDocs ] == [ describeDocument(doc) for doc in beforeDocs ], "Documents differ between the two versions"
+
+		print("%d of %d citations kept from %d files" % (keepCount,totalCount,len(pubmedFiles)))
+		print("  Filter after conversion:\t%.2fs" % afterTime)
+		print("  Filter before conversion:\t%.2fs" % beforeTime)
+		print("  Speedup:\t%.2fx" % (afterTime / beforeTime))
+	finally:
+		shutil.rmtree(tempDir)
+
+if __name__ == '__main__':
+	main()
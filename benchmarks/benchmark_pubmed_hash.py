@@ -0,0 +1,49 @@
+import argparse
+import time
+import pubrunner
+from pubrunner.pubmed_hash import hashFields,md5digest,hashMedlineFile
+
+# How the hashes were calculated before, from the fully converted documents
+def hashFromConvertedDocuments(pubmedFile,parser):
+	allHashes = {}
+	for doc in pubrunner.processMedlineFile(pubmedFile,parser):
+		hashes = {}
+		hashes['year'] = md5digest(doc['pubYear'])
+		hashes['title'] = md5digest(doc['title'])
+		hashes['abstract'] = md5digest(doc['abstract'])
+		hashes['journal'] = md5digest(doc['journal'])
+		hashes['journalISO'] = md5digest(doc['journalISO'])
+		allHashes[int(doc['pmid'])] = hashes
+	return allHashes
+
+def hashOnly(pubmedFile,parser):
+	return { pmid:hashes for pmid,hashes in hashMedlineFile(pubmedFile,parser) }
+
+def timeHashing(func,pubmedFiles,parser):
+	start = time.time()
+	allHashes = {}
+	for pubmedFile in pubmedFiles:
+		allHashes[pubmedFile] = func(pubmedFile,parser)
+	return time.time() - start, allHashes
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark hashing Pubmed files with the hash-only extractor against hashing the fully converted documents')
+	parser.add_argument('--pubmedXMLFiles',required=True,type=str,help='Comma-delimited Pubmed XML files (e.g. from the baseline)')
+	parser.add_argument('--parser',type=str,default='etree',help='XML parser to use (etree/lxml)')
+	args = parser.parse_args()
+
+	pubmedFiles = args.pubmedXMLFiles.split(',')
+
+	convertTime,convertHashes = timeHashing(hashFromConvertedDocuments,pubmedFiles,args.parser)
+	hashTime,hashOnlyHashes = timeHashing(hashOnly,pubmedFiles,args.parser)
+
+	assert convertHashes == hashOnlyHashes, "Hashes differ between the two versions"
+
+	docCount = sum( len(hashes) for hashes in hashOnlyHashes.values() )
+	print("%d documents in %d files (hashing %s)" % (docCount,len(pubmedFiles),",".join(hashFields)))
+	print("  Converted documents:\t%.2fs" % convertTime)
+	print("  Hash-only:\t%.2fs" % hashTime)
+	print("  Fraction of conversion time:\t%.2f" % (hashTime / convertTime))
+
+if __name__ == '__main__':
+	main()
@@ -33,6 +33,7 @@ outDir = os.environ.get("OUTDIR")
 inFormat = os.environ.get("INFORMAT")
 outFormat = os.environ.get("OUTFORMAT")
 pmidChunkDir = os.environ.get("PMIDCHUNKDIR")
+jobMemory = int(os.environ.get("JOBMEMORY","1000"))
 
 chunkFiles = list(os.listdir(chunkDir))
 inputFiles = [ os.path.join(chunkDir,f) for f in chunkFiles ]
@@ -53,6 +54,9 @@ if pmidChunkDir:
 			pmidChunkFile=os.path.join(pmidChunkDir,'{filename}')
 		output: 
 			os.path.join(outDir,'{filename}')
+		threads: 1
+		resources:
+			mem_mb=jobMemory
 		run: 
 			pubrunner.convertFilesFromFilelist(input.chunkFile,inFormat,output[0],outFormat,input.pmidChunkFile)
 else:
@@ -61,6 +65,9 @@ else:
 			os.path.join(chunkDir,'{filename}')
 		output: 
 			os.path.join(outDir,'{filename}')
+		threads: 1
+		resources:
+			mem_mb=jobMemory
 		run: 
 			pubrunner.convertFilesFromFilelist(input[0],inFormat,output[0],outFormat)
 
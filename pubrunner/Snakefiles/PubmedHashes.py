@@ -1,30 +1,12 @@
 import sys
 import os
-import shutil
+import json
 import pubrunner
-
-# https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
-def chunks(l, n):
-	"""Yield successive n-sized chunks from l."""
-	for i in range(0, len(l), n):
-		yield l[i:i + n]
-
-def findFiles(dirName):
-	allFiles = []
-	for root, dirs, files in os.walk(dirName):
-		allFiles += [ os.path.join(root,f) for f in files ]
-	
-	# We're going to extract the last set of digits from each filename and sort by that
-	nums = [ re.findall('[0-9]+',f) for f in allFiles ]
-	nums = [ 0 if num == [] else int(num[-1]) for num in nums ]
-	sortedByNum = sorted(list(zip(nums,allFiles)))
-	sortedFilepaths = [ filepath for num,filepath in sortedByNum ]
-	
-	return sortedFilepaths
+import shutil
 
 snakemakeExec = shutil.which('snakemake')
 
-requiredEnvironmentalVariables = ["INDIR","OUTDIR"]
+requiredEnvironmentalVariables = ["BATCHDIR"]
 missingVariables = []
 for v in requiredEnvironmentalVariables:
 	if os.environ.get(v) is None:
@@ -35,36 +17,34 @@ if not missingVariables == []:
 	print("This Snakefile uses environmental variables as input parameters")
 	print()
 	print("Example usage:")
-	print("  INDIR=PUBMED OUTDIR=PUBMED.hashes snakemake -s %s" % __file__)
+	print("  BATCHDIR=PUBMED.hashes.BATCHES [HASHPROCESSES=4] snakemake -s %s" % __file__)
 	print()
-	print("  INDIR is the input directory of the Pubmed resource")
-	print("  OUTDIR is the output directory for the hash data")
+	print("  BATCHDIR is a directory of JSON files, each with a list of Pubmed files and the hash file to create for each")
+	print("  HASHPROCESSES is the number of processes each batch is hashed with")
 	sys.exit(1)
 
-inDir = os.environ.get("INDIR")
-outDir = os.environ.get("OUTDIR")
-chunkSize = 5
+batchDir = os.environ.get("BATCHDIR")
+hashProcesses = int(os.environ.get("HASHPROCESSES","1"))
+jobMemory = int(os.environ.get("JOBMEMORY","1000"))
 
-inAndOut = []
-for f in findFiles(inDir):
-	if f.endswith('.xml'):
-		outFile = f.replace(inDir,outDir) + '.hashes'
-		if not os.path.isdir(os.path.dirname(outFile)):
-			os.makedirs(os.path.dirname(outFile))
-		inAndOut.append((f,outFile))
-
-allOutFiles = [ outFile for inFile,outFile in inAndOut ]
+# The batches only contain Pubmed files that are out of date, so a batch is done once its marker file exists
+batchNames = [ f[:-len('.json')] for f in sorted(os.listdir(batchDir)) if f.endswith('.json') ]
+doneFiles = [ os.path.join(batchDir,b + '.done') for b in batchNames ]
 
 localrules: all
 
 rule all:
-	input: allOutFiles
-
-for chunk in chunks(inAndOut,chunkSize):
-	rule:
-		input: [ inFile for inFile,outFile in chunk ]
-		output: [ outFile for inFile,outFile in chunk ]
-		run:
-			for inFile,outFile in zip(input,output):
-				pubrunner.pubmed_hash(inFile,outFile)
-
+	input: doneFiles
+
+rule hash_batch:
+	input:
+		os.path.join(batchDir,'{batch}.json')
+	output:
+		touch(os.path.join(batchDir,'{batch}.done'))
+	threads: hashProcesses
+	resources:
+		mem_mb=lambda wildcards, threads: jobMemory * threads
+	run:
+		with open(input[0]) as f:
+			batch = json.load(f)
+		pubrunner.hashPubmedFiles([ inFile for inFile,outFile in batch ],[ outFile for inFile,outFile in batch ],threads)
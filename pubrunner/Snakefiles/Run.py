@@ -176,6 +176,7 @@ if not missingVariables == []:
 
 unprocessedCommand = os.environ.get("COMMAND")
 dataDir = os.environ.get("DATADIR")
+jobMemory = int(os.environ.get("JOBMEMORY","1000"))
 
 if not os.path.isdir(dataDir):
 	os.makedirs(dataDir)
@@ -204,6 +205,9 @@ if len(expectedOutputFiles) > 0:
 	rule Main_Command:
 		input: **inputVariables
 		output:	**outputVariables
+		threads: 1
+		resources:
+			mem_mb=jobMemory
 		shell: command
 	
 # If we can't determine the output files, we will not have a main dependency rule and exclude the output file list from this rule which will then force snakemake to run this
@@ -211,6 +215,9 @@ elif inputPercentWildcard == False and outputPercentWildcard == False:
 	rule Main_Command_But_Unknown_Output_Files:
 		input: **inputVariables
 		output:	**outputVariables
+		threads: 1
+		resources:
+			mem_mb=jobMemory
 		shell: command
 	
 
@@ -0,0 +1,135 @@
+import os
+import io
+import gzip
+import json
+import tarfile
+import collections
+
+# A file inside a tar archive is referred to with a virtual path: the archive path, this separator, then the member name
+memberSeparator = '::'
+
+def isArchiveMember(path):
+	return memberSeparator in path
+
+def splitMemberPath(path):
+	tarPath,memberName = path.split(memberSeparator,1)
+	return tarPath,memberName
+
+def joinMemberPath(tarPath,memberName):
+	return tarPath + memberSeparator + memberName
+
+# The member index for an archive is kept next to the resource directory (so that it isn't treated as part of the resource)
+def getIndexFile(tarPath):
+	tarPath = os.path.realpath(tarPath)
+	return os.path.join(os.path.dirname(tarPath) + '.index', os.path.basename(tarPath) + '.json')
+
+# Reads through an (uncompressed) tar archive once and records the name, data offset, size and mtime of each file in it
+def buildArchiveIndex(tarPath,fileSuffixFilter=None):
+	members = []
+	with tarfile.open(tarPath, 'r:') as tar:
+		for member in tar:
+			if not member.isfile():
+				continue
+			if not fileSuffixFilter is None and not member.name.endswith(fileSuffixFilter):
+				continue
+			members.append([member.name, member.offset_data, member.size, member.mtime])
+
+	stat = os.stat(tarPath)
+	index = {'archiveSize':stat.st_size, 'archiveModified':stat.st_mtime, 'filter':fileSuffixFilter, 'members':members}
+
+	indexFile = getIndexFile(tarPath)
+	if not os.path.isdir(os.path.dirname(indexFile)):
+		os.makedirs(os.path.dirname(indexFile))
+	tempFile = indexFile + '.tmp'
+	with open(tempFile,'w') as f:
+		json.dump(index,f)
+	os.replace(tempFile,indexFile)
+
+	return index
+
+def hasArchiveIndex(tarPath):
+	return os.path.isfile(getIndexFile(tarPath))
+
+# The indexes of recently used archives are kept loaded, as the files in a chunk can come from several
+# archives (e.g. the PMCOA ones) in turn
+maxLoadedIndexes = 16
+loadedIndexes = collections.OrderedDict()
+def loadArchiveIndex(tarPath):
+	indexFile = getIndexFile(tarPath)
+	stat = os.stat(tarPath)
+	key = (indexFile,stat.st_size,stat.st_mtime)
+	if key in loadedIndexes:
+		loadedIndexes.move_to_end(key)
+	else:
+		index,fileSuffixFilter = None,None
+		if os.path.isfile(indexFile):
+			with open(indexFile) as f:
+				index = json.load(f)
+			# An archive that has changed is indexed again (with the same filter as before)
+			if index['archiveSize'] != stat.st_size or index['archiveModified'] != stat.st_mtime:
+				index,fileSuffixFilter = None,index['filter']
+		if index is None:
+			index = buildArchiveIndex(tarPath,fileSuffixFilter)
+		index['lookup'] = { name:(offset,size,mtime) for name,offset,size,mtime in index['members'] }
+
+		# Drop an index for an earlier version of the archive and then the least recently used ones
+		for loadedKey in [ loadedKey for loadedKey in loadedIndexes if loadedKey[0] == indexFile ]:
+			del loadedIndexes[loadedKey]
+		loadedIndexes[key] = index
+		while len(loadedIndexes) > maxLoadedIndexes:
+			loadedIndexes.popitem(last=False)
+	return loadedIndexes[key]
+
+# Gets the virtual paths for all the files (that matched the filter when the index was built) in an archive
+def listArchiveMembers(tarPath):
+	index = loadArchiveIndex(tarPath)
+	return [ joinMemberPath(tarPath,name) for name,_,_,_ in index['members'] ]
+
+def getmtime(path):
+	if isArchiveMember(path):
+		tarPath,memberName = splitMemberPath(path)
+		return loadArchiveIndex(tarPath)['lookup'][memberName][2]
+	else:
+		return os.path.getmtime(path)
+
+def getsize(path):
+	if isArchiveMember(path):
+		tarPath,memberName = splitMemberPath(path)
+		return loadArchiveIndex(tarPath)['lookup'][memberName][1]
+	else:
+		return os.path.getsize(path)
+
+# Reads the data of one file inside a tar archive directly from the archive
+class ArchiveMemberReader(io.RawIOBase):
+	def __init__(self,tarPath,offset,size):
+		self.f = open(tarPath,'rb')
+		self.f.seek(offset)
+		self.remaining = size
+
+	def readable(self):
+		return True
+
+	def readinto(self,b):
+		count = self.f.readinto(memoryview(b)[:min(len(b),self.remaining)])
+		self.remaining -= count
+		return count
+
+	def close(self):
+		if not self.closed:
+			self.f.close()
+		super().close()
+
+# Opens a plain file, a gzipped file or a file inside a tar archive (using a virtual path) for reading
+def openInput(path,binary=True):
+	if isArchiveMember(path):
+		tarPath,memberName = splitMemberPath(path)
+		offset,size,_ = loadArchiveIndex(tarPath)['lookup'][memberName]
+		handle = io.BufferedReader(ArchiveMemberReader(tarPath,offset,size))
+		return handle if binary else io.TextIOWrapper(handle)
+	elif path.endswith('.gz'):
+		return gzip.open(path, 'rb' if binary else 'rt')
+	else:
+		return open(path, 'rb' if binary else 'r')
+
+def isPlainFile(path):
+	return not isArchiveMember(path) and not path.endswith('.gz')
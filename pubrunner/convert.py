@@ -1,16 +1,29 @@
 import argparse
+import os
 import xml.etree.cElementTree as etree
 import codecs
 from six.moves.html_parser import HTMLParser
 import re
-import tempfile
 import bioc
 import pymarc
-import shutil
 import six
 import unicodedata
 import calendar
 import json
+import gzip
+import jsonlines
+import xml.sax
+import xml.sax.handler
+import itertools
+import mmap
+import multiprocessing
+from pubrunner.archive import openInput,isPlainFile
+from pubrunner.pmidlist import openIDFilter,closeIDFilter
+
+try:
+	import lxml.etree as lxmletree
+except ImportError:
+	lxmletree = None
 
 # Remove empty brackets (that could happen if the contents have been removed already
 # e.g. for citation ( [3] [4] ) -> ( ) -> nothing
@@ -28,20 +41,44 @@ def removeWeirdBracketsFromOldTitles(titleText):
 		titleText = titleText[1:-2] + '.'
 	return titleText
 
+# Translation table for str.translate that removes "control-like" characters (Unicode category C*)
+# and changes any separator characters (Z*, including the line/paragraph separators) to a space.
+# Each character's category is only looked up once and then stored in the table
+class UnicodeCleanupTable(dict):
+	def __missing__(self, codepoint):
+		category = unicodedata.category(chr(codepoint))[0]
+		if category == "C":
+			replacement = None
+		elif category == "Z":
+			replacement = ord(" ")
+		else:
+			replacement = codepoint
+		self[codepoint] = replacement
+		return replacement
+
+unicodeCleanupTable = UnicodeCleanupTable()
+for codepoint in range(256):
+	unicodeCleanupTable[codepoint]
+
+# Only match where something would change (a lone comma or period is left as is)
+repeatedCommasRegex = re.compile(r',(\s*,)+')
+commasBeforePeriodRegex = re.compile(r'(,\s*)+\.')
+
 def cleanupText(text):
-	# Remove some "control-like" characters (left/right separator)
-	text = text.replace(u'\u2028',' ').replace(u'\u2029',' ')
-	text = "".join(ch for ch in text if unicodedata.category(ch)[0]!="C")
-	text = "".join(ch if unicodedata.category(ch)[0]!="Z" else " " for ch in text)
+	# Remove some "control-like" characters and change separators (e.g. no-break spaces) to spaces
+	text = text.translate(unicodeCleanupTable)
 
 	# Remove repeated commands and commas next to periods
-	text = re.sub(',(\s*,)*',',',text)
-	text = re.sub('(,\s*)*\.','.',text)
+	text = repeatedCommasRegex.sub(',',text)
+	text = commasBeforePeriodRegex.sub('.',text)
 	return text.strip()
 
 # Unescape HTML special characters e.g. &gt; is changed to >
 htmlParser = HTMLParser()
 def htmlUnescape(text):
+	# Nothing can be escaped without an ampersand
+	if not '&' in text:
+		return text
 	return htmlParser.unescape(text)
 
 # XML elements to ignore the contents of
@@ -49,62 +86,66 @@ ignoreList = ['table', 'table-wrap', 'xref', 'disp-formula', 'inline-formula', '
 
 # XML elements to separate text between
 separationList = ['title', 'p', 'sec', 'break', 'def-item', 'list-item', 'caption']
-def extractTextFromElem(elem):
-	# Extract any raw text directly in XML element or just after
-	head = ""
-	if elem.text:
-		head = elem.text
-	tail = ""
-	if elem.tail:
-		tail = elem.tail
-	
-	# Then get the text from all child XML nodes recursively
-	childText = []
-	for child in elem:
-		childText = childText + extractTextFromElem(child)
-		
-	# Check if the tag should be ignore (so don't use main contents)
-	if elem.tag in ignoreList:
-		return [tail.strip()]
-	# Add a zero delimiter if it should be separated
-	elif elem.tag in separationList:
-		return [0] + [head] + childText + [tail]
-	# Or just use the whole text
-	else:
-		return [head] + childText + [tail]
-	
 
-# Merge a list of extracted text blocks and deal with the zero delimiter
-def extractTextFromElemList_merge(list):
-	textList = []
-	current = ""
-	# Basically merge a list of text, except separate into a new list
-	# whenever a zero appears
-	for t in list:
-		if t == 0: # Zero delimiter so split
-			if len(current) > 0:
-				textList.append(current)
-				current = ""
-		else: # Just keep adding
-			current = current + " " + t
-			current = current.strip()
-	if len(current) > 0:
-		textList.append(current)
-	return textList
-	
+ignoreSet = set(ignoreList)
+separationSet = set(separationList)
+
+# Marker written into the text buffer wherever passages should be split
+textSeparator = None
+
+# Walks the XML element tree once (without recursion) in document order and appends
+# the text blocks to a shared output buffer with separators where passages should split
+def streamTextFromElem(elem,out):
+	stack = [(elem,False)]
+	while stack:
+		current,isClosing = stack.pop()
+		if isClosing:
+			# All the children are done so add the raw text just after the element
+			out.append(current.tail if current.tail else "")
+		elif current.tag in ignoreSet:
+			# Don't use the main contents, only the text after it
+			out.append(current.tail.strip() if current.tail else "")
+		else:
+			if current.tag in separationSet:
+				out.append(textSeparator)
+			out.append(current.text if current.text else "")
+
+			# Children are popped off the stack in order, before the closing tail text
+			stack.append((current,True))
+			stack.extend( (child,False) for child in reversed(current) )
+
+# Merges the text blocks in the buffer into passages, splitting at the separators.
+# Gives the same result as repeatedly joining with a space and stripping, but in linear time
+def mergeTextBuffer(buffer):
+	passages = []
+	current = []
+	for t in buffer:
+		if t is textSeparator:
+			if current:
+				passages.append(" ".join(current))
+				current = []
+		else:
+			# Whitespace inside the passage is kept, but not at either end
+			t = t.rstrip() if current else t.strip()
+			if t:
+				current.append(t)
+	if current:
+		passages.append(" ".join(current))
+	return passages
+
 # Main function that extracts text from XML element or list of XML elements
 def extractTextFromElemList(elemList):
-	textList = []
-	# Extracts text and adds delimiters (so text is accidentally merged later)
-	if isinstance(elemList, list):
-		for e in elemList:
-			textList = textList + extractTextFromElem(e) + [0]
-	else:
-		textList = extractTextFromElem(elemList) + [0]
+	if not isinstance(elemList, list):
+		elemList = [elemList]
+
+	# Extracts text and adds separators (so text isn't accidentally merged later)
+	buffer = []
+	for e in elemList:
+		streamTextFromElem(e,buffer)
+		buffer.append(textSeparator)
+
+	mergedList = mergeTextBuffer(buffer)
 
-	# Merge text blocks with awareness of zero delimiters
-	mergedList = extractTextFromElemList_merge(textList)
-	
 	# Remove any newlines (as they can be trusted to be syntactically important)
 	mergedList = [ text.replace('\n', ' ') for text in mergedList ]
 
@@ -172,14 +213,17 @@ def getMetaInfoForPMCArticle(articleElem):
 
 	return pmidText,pmcidText,doiText,pubYear,pubMonth,pubDay,journalText,journalISOText
 
-def getJournalDateForMedlineFile(elem,pmid):
-	yearRegex = re.compile(r'(18|19|20)\d\d')
+# Month names and abbreviations (and their number) that can appear in Medline dates
+medlineMonthNames = [ m for m in (list(calendar.month_name) + list(calendar.month_abbr)) if m != '' ]
+medlineMonthMapping = {}
+for i,m in enumerate(calendar.month_name):
+	medlineMonthMapping[m] = i
+for i,m in enumerate(calendar.month_abbr):
+	medlineMonthMapping[m] = i
 
-	monthMapping = {}
-	for i,m in enumerate(calendar.month_name):
-		monthMapping[m] = i
-	for i,m in enumerate(calendar.month_abbr):
-		monthMapping[m] = i
+medlineYearRegex = re.compile(r'(18|19|20)\d\d')
+
+def getJournalDateForMedlineFile(elem,pmid):
 
 	# Try to extract the publication date
 	pubDateField = elem.find('./MedlineCitation/Article/Journal/JournalIssue/PubDate')
@@ -194,10 +238,10 @@ def getJournalDateForMedlineFile(elem,pmid):
 
 	pubYear,pubMonth,pubDay = None,None,None
 	if not medlineDateField is None:
-		regexSearch = re.search(yearRegex,medlineDateField.text)
+		regexSearch = re.search(medlineYearRegex,medlineDateField.text)
 		if regexSearch:
 			pubYear = regexSearch.group()
-		monthSearch = [ c for c in (list(calendar.month_name) + list(calendar.month_abbr)) if c != '' and c in medlineDateField.text ]
+		monthSearch = [ c for c in medlineMonthNames if c in medlineDateField.text ]
 		if len(monthSearch) > 0:
 			pubMonth = monthSearch[0]
 	else:
@@ -214,8 +258,8 @@ def getJournalDateForMedlineFile(elem,pmid):
 			pubYear = None
 
 	if not pubMonth is None:
-		if pubMonth in monthMapping:
-			pubMonth = monthMapping[pubMonth]
+		if pubMonth in medlineMonthMapping:
+			pubMonth = medlineMonthMapping[pubMonth]
 		pubMonth = int(pubMonth)
 	if not pubDay is None:
 		pubDay = int(pubDay)
@@ -253,199 +297,364 @@ def getPubmedEntryDate(elem,pmid):
 
 	return pubYear,pubMonth,pubDay
 
-def processMedlineFile(pubmedFile):
-	for event, elem in etree.iterparse(pubmedFile, events=('start', 'end', 'start-ns', 'end-ns')):
-		if (event=='end' and elem.tag=='PubmedArticle'): #MedlineCitation'):
-			# Try to extract the pmidID
-			pmidField = elem.find('./MedlineCitation/PMID')
-			assert not pmidField is None
-			pmid = pmidField.text
-
-			journalYear,journalMonth,journalDay = getJournalDateForMedlineFile(elem,pmid)
-			entryYear,entryMonth,entryDay = getPubmedEntryDate(elem,pmid)
-
-			jComparison = tuple ( 9999 if d is None else d for d in [ journalYear,journalMonth,journalDay ] )
-			eComparison = tuple ( 9999 if d is None else d for d in [ entryYear,entryMonth,entryDay ] )
-			if jComparison < eComparison: # The PubMed entry has been delayed for some reason so let's try the journal data
-				pubYear,pubMonth,pubDay = journalYear,journalMonth,journalDay
-			else:
-				pubYear,pubMonth,pubDay = entryYear,entryMonth,entryDay
-
-			# Extract the authors
-			authorElems = elem.findall('./MedlineCitation/Article/AuthorList/Author')
-			authors = []
-			for authorElem in authorElems:
-				forename = authorElem.find('./ForeName')
-				lastname = authorElem.find('./LastName')
-				collectivename = authorElem.find('./CollectiveName')
-
-				name = None
-				if forename is not None and lastname is not None and forename.text is not None and lastname.text is not None:
-					name = "%s %s" % (forename.text, lastname.text)
-				elif lastname is not None and lastname.text is not None:
-					name = lastname.text
-				elif forename is not None and forename.text is not None:
-					name = forename.text
-				elif collectivename is not None and collectivename.text is not None:
-					name = collectivename.text
-				else:
-					raise RuntimeError("Unable to find authors in Pubmed citation (PMID=%s)" % pmid)
-				authors.append(name)
-
-			chemicals = []
-			chemicalElems = elem.findall('./MedlineCitation/ChemicalList/Chemical/NameOfSubstance')
-			for chemicalElem in chemicalElems:
-				chemID = chemicalElem.attrib['UI']
-				name = chemicalElem.text
-				#chemicals.append((chemID,name))
-				chemicals.append("%s|%s" % (chemID,name))
-			chemicalsTxt = "\t".join(chemicals)
-
-			meshHeadings = []
-			meshElems = elem.findall('./MedlineCitation/MeshHeadingList/MeshHeading')
-			for meshElem in meshElems:
-				descriptorElem = meshElem.find('./DescriptorName')
-				meshID = descriptorElem.attrib['UI']
-				majorTopicYN = descriptorElem.attrib['MajorTopicYN']
-				name = descriptorElem.text
-				#meshHeading = {'Descriptor':name,'MajorTopicYN':majorTopicYN,'ID':meshID,'Qualifiers':[]}
-				meshHeading = "Qualifier|%s|%s|%s" % (meshID,majorTopicYN,name)
-
-				qualifierElems = meshElem.findall('./QualifierName')
-				for qualifierElem in qualifierElems:
-					meshID = qualifierElem.attrib['UI']
-					majorTopicYN = qualifierElem.attrib['MajorTopicYN']
-					name = qualifierElem.text
-					qualifier = {'Descriptor':name,'MajorTopicYN':majorTopicYN,'ID':meshID}
-					#meshHeading['Qualifiers'].append(qualifier)
-					meshHeading += "%%Descriptor|%s|%s|%s" % (meshID,majorTopicYN,name)
-
-				meshHeadings.append(meshHeading)
-			meshHeadingsTxt = "\t".join(meshHeadings)
-					
-			# Extract the title of paper
-			title = elem.findall('./MedlineCitation/Article/ArticleTitle')
-			titleText = extractTextFromElemList(title)
-			titleText = [ removeWeirdBracketsFromOldTitles(t) for t in titleText ]
-			titleText = [ t for t in titleText if len(t) > 0 ]
-			titleText = [ htmlUnescape(t) for t in titleText ]
-			titleText = [ removeBracketsWithoutWords(t) for t in titleText ]
-			
-			# Extract the abstract from the paper
-			abstract = elem.findall('./MedlineCitation/Article/Abstract/AbstractText')
-			abstractText = extractTextFromElemList(abstract)
-			abstractText = [ t for t in abstractText if len(t) > 0 ]
-			abstractText = [ htmlUnescape(t) for t in abstractText ]
-			abstractText = [ removeBracketsWithoutWords(t) for t in abstractText ]
-			
-			journalTitleFields = elem.findall('./MedlineCitation/Article/Journal/Title')
-			journalTitleISOFields = elem.findall('./MedlineCitation/Article/Journal/ISOAbbreviation')
-			journalTitle = " ".join(extractTextFromElemList(journalTitleFields))
-			journalISOTitle = " ".join(extractTextFromElemList(journalTitleISOFields))
-
-			document = {}
-			document["pmid"] = pmid
-			document["pubYear"] = pubYear
-			document["pubMonth"] = pubMonth
-			document["pubDay"] = pubDay
-			document["title"] = titleText
-			document["abstract"] = abstractText
-			document["journal"] = journalTitle
-			document["journalISO"] = journalISOTitle
-			document["authors"] = authors
-			document["chemicals"] = chemicalsTxt
-			document["meshHeadings"] = meshHeadingsTxt
-
-			yield document
-		
+acceptedParsers = ['etree','lxml']
+
+# Parsing errors that can be raised by either XML parser
+xmlParseErrors = (etree.ParseError,) if lxmletree is None else (etree.ParseError,lxmletree.XMLSyntaxError)
+
+# Iterates through an XML file and yields each complete element with the given tag (e.g. PubmedArticle).
+# The default parser is ElementTree. The lxml parser only reports the end of the wanted elements
+# and also removes earlier siblings and ancestors so memory use stays flat for large files
+def iterparseElements(source,tag,parser='etree'):
+	if parser == 'lxml':
+		if lxmletree is None:
+			raise RuntimeError("The lxml parser was selected but the lxml package is not installed")
+
+		for event, elem in lxmletree.iterparse(source, events=('end',), tag=tag, remove_comments=True, remove_pis=True, huge_tree=True):
+			yield elem
+
+			# Important: clear the current element (and everything before it) from memory
+			elem.clear(keep_tail=True)
+			for ancestor in itertools.chain([elem], elem.iterancestors()):
+				while ancestor.getprevious() is not None:
+					del ancestor.getparent()[0]
+	elif parser == 'etree':
+		for event, elem in etree.iterparse(source, events=('start', 'end', 'start-ns', 'end-ns')):
+			if (event=='end' and elem.tag==tag):
+				yield elem
+
+				# Important: clear the current element from memory to keep memory usage low
+				elem.clear()
+	else:
+		raise RuntimeError("Unknown XML parser: %s" % parser)
 
-			# Important: clear the current element from memory to keep memory usage low
-			elem.clear()
+def getMedlinePMID(elem):
+	pmidField = elem.find('./MedlineCitation/PMID')
+	assert not pmidField is None
+	return pmidField.text
 
-def processPMCFile(pmcFile):
-	with open(pmcFile, 'r') as openfile:
+def getMedlinePubDate(elem,pmid):
+	journalYear,journalMonth,journalDay = getJournalDateForMedlineFile(elem,pmid)
+	entryYear,entryMonth,entryDay = getPubmedEntryDate(elem,pmid)
 
-		# Skip to the article element in the file
-		for event, elem in etree.iterparse(openfile, events=('start', 'end', 'start-ns', 'end-ns')):
-			if (event=='end' and elem.tag=='article'):
-			
-				pmidText,pmcidText,doiText,pubYear,pubMonth,pubDay,journal,journalISO = getMetaInfoForPMCArticle(elem)
+	jComparison = tuple ( 9999 if d is None else d for d in [ journalYear,journalMonth,journalDay ] )
+	eComparison = tuple ( 9999 if d is None else d for d in [ entryYear,entryMonth,entryDay ] )
+	if jComparison < eComparison: # The PubMed entry has been delayed for some reason so let's try the journal data
+		return journalYear,journalMonth,journalDay
+	else:
+		return entryYear,entryMonth,entryDay
+
+def getMedlineTitle(elem):
+	title = elem.findall('./MedlineCitation/Article/ArticleTitle')
+	titleText = extractTextFromElemList(title)
+	titleText = [ removeWeirdBracketsFromOldTitles(t) for t in titleText ]
+	titleText = [ t for t in titleText if len(t) > 0 ]
+	titleText = [ htmlUnescape(t) for t in titleText ]
+	titleText = [ removeBracketsWithoutWords(t) for t in titleText ]
+	return titleText
 
-				# We're going to process the main article along with any subarticles
-				# And if any of the subarticles have distinguishing IDs (e.g. PMID), then
-				# that'll be used, otherwise the parent article IDs will be used
-				subarticles = [elem] + elem.findall('./sub-article')
+def getMedlineAbstract(elem):
+	abstract = elem.findall('./MedlineCitation/Article/Abstract/AbstractText')
+	abstractText = extractTextFromElemList(abstract)
+	abstractText = [ t for t in abstractText if len(t) > 0 ]
+	abstractText = [ htmlUnescape(t) for t in abstractText ]
+	abstractText = [ removeBracketsWithoutWords(t) for t in abstractText ]
+	return abstractText
+
+def getMedlineJournals(elem):
+	journalTitleFields = elem.findall('./MedlineCitation/Article/Journal/Title')
+	journalTitleISOFields = elem.findall('./MedlineCitation/Article/Journal/ISOAbbreviation')
+	journalTitle = " ".join(extractTextFromElemList(journalTitleFields))
+	journalISOTitle = " ".join(extractTextFromElemList(journalTitleISOFields))
+	return journalTitle,journalISOTitle
+
+def processMedlineArticle(elem):
+	# Try to extract the pmidID
+	pmid = getMedlinePMID(elem)
+
+	pubYear,pubMonth,pubDay = getMedlinePubDate(elem,pmid)
+
+	# Extract the authors
+	authorElems = elem.findall('./MedlineCitation/Article/AuthorList/Author')
+	authors = []
+	for authorElem in authorElems:
+		forename = authorElem.find('./ForeName')
+		lastname = authorElem.find('./LastName')
+		collectivename = authorElem.find('./CollectiveName')
+
+		name = None
+		if forename is not None and lastname is not None and forename.text is not None and lastname.text is not None:
+			name = "%s %s" % (forename.text, lastname.text)
+		elif lastname is not None and lastname.text is not None:
+			name = lastname.text
+		elif forename is not None and forename.text is not None:
+			name = forename.text
+		elif collectivename is not None and collectivename.text is not None:
+			name = collectivename.text
+		else:
+			raise RuntimeError("Unable to find authors in Pubmed citation (PMID=%s)" % pmid)
+		authors.append(name)
+
+	chemicals = []
+	chemicalElems = elem.findall('./MedlineCitation/ChemicalList/Chemical/NameOfSubstance')
+	for chemicalElem in chemicalElems:
+		chemID = chemicalElem.attrib['UI']
+		name = chemicalElem.text
+		#chemicals.append((chemID,name))
+		chemicals.append("%s|%s" % (chemID,name))
+	chemicalsTxt = "\t".join(chemicals)
+
+	meshHeadings = []
+	meshElems = elem.findall('./MedlineCitation/MeshHeadingList/MeshHeading')
+	for meshElem in meshElems:
+		descriptorElem = meshElem.find('./DescriptorName')
+		meshID = descriptorElem.attrib['UI']
+		majorTopicYN = descriptorElem.attrib['MajorTopicYN']
+		name = descriptorElem.text
+		#meshHeading = {'Descriptor':name,'MajorTopicYN':majorTopicYN,'ID':meshID,'Qualifiers':[]}
+		meshHeading = "Qualifier|%s|%s|%s" % (meshID,majorTopicYN,name)
+
+		qualifierElems = meshElem.findall('./QualifierName')
+		for qualifierElem in qualifierElems:
+			meshID = qualifierElem.attrib['UI']
+			majorTopicYN = qualifierElem.attrib['MajorTopicYN']
+			name = qualifierElem.text
+			qualifier = {'Descriptor':name,'MajorTopicYN':majorTopicYN,'ID':meshID}
+			#meshHeading['Qualifiers'].append(qualifier)
+			meshHeading += "%%Descriptor|%s|%s|%s" % (meshID,majorTopicYN,name)
+
+		meshHeadings.append(meshHeading)
+	meshHeadingsTxt = "\t".join(meshHeadings)
+			
+	# Extract the title and abstract of the paper
+	titleText = getMedlineTitle(elem)
+	abstractText = getMedlineAbstract(elem)
+	journalTitle,journalISOTitle = getMedlineJournals(elem)
+
+	document = {}
+	document["pmid"] = pmid
+	document["pubYear"] = pubYear
+	document["pubMonth"] = pubMonth
+	document["pubDay"] = pubDay
+	document["title"] = titleText
+	document["abstract"] = abstractText
+	document["journal"] = journalTitle
+	document["journalISO"] = journalISOTitle
+	document["authors"] = authors
+	document["chemicals"] = chemicalsTxt
+	document["meshHeadings"] = meshHeadingsTxt
+
+	return document
+
+# The Pubmed file can be plain XML, gzipped XML or a file inside an indexed tar archive. If a PMID filter
+# (a function given the PMID text) is provided, citations that it rejects are skipped before anything
+# other than their PMID is extracted
+def processMedlineFile(pubmedFile,parser='etree',pmidFilter=None):
+	with openInput(pubmedFile) as openfile:
+		for elem in iterparseElements(openfile,'PubmedArticle',parser):
+			if pmidFilter is not None and not pmidFilter(getMedlinePMID(elem)):
+				continue
+			yield processMedlineArticle(elem)
+
+# Finds the first element with the given tag between start and end in raw XML bytes and gives its start
+# and end offsets (or None if there isn't a complete one). Any < in the text of a Pubmed file is escaped
+# so this can only match actual elements, and none of the elements that are searched for can be nested
+# in one with the same tag
+def findRawElementStart(data,tag,start=0,end=None):
+	if end is None:
+		end = len(data)
+	openTag = b'<' + tag
+	while True:
+		elemStart = data.find(openTag,start,end)
+		if elemStart == -1:
+			return None
+		# Check that this isn't a longer tag (e.g. ArticleTitle when looking for Article)
+		nextChar = data[elemStart+len(openTag):elemStart+len(openTag)+1]
+		if nextChar in (b'>',b' ',b'\t',b'\r',b'\n'):
+			return elemStart
+		start = elemStart + len(openTag)
+
+def findRawElement(data,tag,start=0,end=None):
+	if end is None:
+		end = len(data)
+	elemStart = findRawElementStart(data,tag,start,end)
+	if elemStart is None:
+		return None
+	closeTag = b'</' + tag + b'>'
+	elemEnd = data.find(closeTag,elemStart,end)
+	if elemEnd == -1:
+		return None
+	return elemStart,elemEnd+len(closeTag)
+
+# Finds the start and end offsets of each complete PubmedArticle element in raw Pubmed XML (without parsing it)
+def findPubmedArticles(data,start=0):
+	while True:
+		article = findRawElement(data,b'PubmedArticle',start)
+		if article is None:
+			return
+		yield article
+		start = article[1]
+
+# Same as findPubmedArticles but for a stream (e.g. a gzipped file) that is read in blocks so that it
+# doesn't all need to be in memory. Gives each PubmedArticle as the block of data that it is in along
+# with its start and end offsets in that block
+def findPubmedArticlesInStream(f,blockSize=16*1024*1024):
+	tail = b''
+	while True:
+		block = f.read(blockSize)
+		data = tail + block
+		consumed = 0
+		for start,end in findPubmedArticles(data):
+			yield data,start,end
+			consumed = end
+
+		if len(block) == 0:
+			return
+
+		# Keep the start of an incomplete PubmedArticle (or what may be the start of its tag) for the next block
+		incompleteStart = findRawElementStart(data,b'PubmedArticle',consumed)
+		if incompleteStart is None:
+			incompleteStart = max(consumed,len(data)-len(b'<PubmedArticle'))
+		tail = data[incompleteStart:]
+
+# The PMID of the citation in raw PubmedArticle XML, which is the first element in its MedlineCitation
+def getRawPubmedArticlePMID(data,start,end):
+	pmid = findRawElement(data,b'PMID',start,end)
+	assert not pmid is None
+	pmidStart = data.find(b'>',pmid[0],pmid[1]) + 1
+	return data[pmidStart:pmid[1]-len(b'</PMID>')].decode('utf8').strip()
+
+# Gets a function that parses a single XML element from its raw bytes with the selected parser
+def getFragmentParser(parser):
+	if parser == 'lxml':
+		if lxmletree is None:
+			raise RuntimeError("The lxml parser was selected but the lxml package is not installed")
+		lxmlParser = lxmletree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+		return lambda data : lxmletree.fromstring(data, lxmlParser)
+	elif parser == 'etree':
+		return etree.fromstring
+	else:
+		raise RuntimeError("Unknown XML parser: %s" % parser)
+
+# Finds the start and end byte offsets of each PubmedArticle element in a Pubmed XML file. With a PMID
+# filter, only the citations that it accepts are included
+def findPubmedArticleRanges(pubmedFile,pmidFilter=None):
+	with open(pubmedFile,'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return []
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			ranges = list(findPubmedArticles(mm))
+			if pmidFilter is not None:
+				ranges = [ (start,end) for start,end in ranges if pmidFilter(getRawPubmedArticlePMID(mm,start,end)) ]
+			return ranges
+
+# Worker for processMedlineFileInParallel that parses a batch of PubmedArticle elements
+# (given as byte ranges of the file) and builds their documents
+def processMedlineArticleRanges(task):
+	pubmedFile,ranges,parser = task
+	parseFragment = getFragmentParser(parser)
+
+	documents = []
+	with open(pubmedFile,'rb') as f:
+		for start,end in ranges:
+			f.seek(start)
+			elem = parseFragment(f.read(end-start))
+			documents.append(processMedlineArticle(elem))
+	return documents
+
+# Same output as processMedlineFile but the citations are split into batches that are
+# processed by a pool of worker processes. The documents are still yielded in the original order
+def processMedlineFileInParallel(pubmedFile,processes,parser='etree',batchSize=200,pmidFilter=None):
+	ranges = findPubmedArticleRanges(pubmedFile,pmidFilter)
+	tasks = [ (pubmedFile,ranges[i:i+batchSize],parser) for i in range(0,len(ranges),batchSize) ]
+
+	with multiprocessing.Pool(processes) as pool:
+		for documents in pool.imap(processMedlineArticleRanges, tasks):
+			for document in documents:
+				yield document
+
+def processPMCArticle(elem):
+	pmidText,pmcidText,doiText,pubYear,pubMonth,pubDay,journal,journalISO = getMetaInfoForPMCArticle(elem)
+
+	# We're going to process the main article along with any subarticles
+	# And if any of the subarticles have distinguishing IDs (e.g. PMID), then
+	# that'll be used, otherwise the parent article IDs will be used
+	subarticles = [elem] + elem.findall('./sub-article')
+	
+	for articleElem in subarticles:
+		if articleElem == elem:
+			# This is the main parent article. Just use its IDs
+			subPmidText,subPmcidText,subDoiText,subPubYear,subPubMonth,subPubDay,subJournal,subJournalISO = pmidText,pmcidText,doiText,pubYear,pubMonth,pubDay,journal,journalISO
+		else:
+			# Check if this subarticle has any distinguishing IDs and use them instead
+			subPmidText,subPmcidText,subDoiText,subPubYear,subPubMonth,subPubDay,subJournal,subJournalISO = getMetaInfoForPMCArticle(articleElem)
+			if subPmidText=='' and subPmcidText == '' and subDoiText == '':
+				subPmidText,subPmcidText,subDoiText = pmidText,pmcidText,doiText
+			if subPubYear == None:
+				subPubYear = pubYear
+				subPubMonth = pubMonth
+				subPubDay = pubDay
+			if subJournal == None:
+				subJournal = journal
+				subJournalISO = journalISO
 				
-				for articleElem in subarticles:
-					if articleElem == elem:
-						# This is the main parent article. Just use its IDs
-						subPmidText,subPmcidText,subDoiText,subPubYear,subPubMonth,subPubDay,subJournal,subJournalISO = pmidText,pmcidText,doiText,pubYear,pubMonth,pubDay,journal,journalISO
-					else:
-						# Check if this subarticle has any distinguishing IDs and use them instead
-						subPmidText,subPmcidText,subDoiText,subPubYear,subPubMonth,subPubDay,subJournal,subJournalISO = getMetaInfoForPMCArticle(articleElem)
-						if subPmidText=='' and subPmcidText == '' and subDoiText == '':
-							subPmidText,subPmcidText,subDoiText = pmidText,pmcidText,doiText
-						if subPubYear == None:
-							subPubYear = pubYear
-							subPubMonth = pubMonth
-							subPubDay = pubDay
-						if subJournal == None:
-							subJournal = journal
-							subJournalISO = journalISO
-							
-					# Extract the title of paper
-					title = articleElem.findall('./front/article-meta/title-group/article-title') + articleElem.findall('./front-stub/title-group/article-title')
-					assert len(title) <= 1
-					titleText = extractTextFromElemList(title)
-					titleText = [ removeWeirdBracketsFromOldTitles(t) for t in titleText ]
-					
-					# Get the subtitle (if it's there)
-					subtitle = articleElem.findall('./front/article-meta/title-group/subtitle') + articleElem.findall('./front-stub/title-group/subtitle')
-					subtitleText = extractTextFromElemList(subtitle)
-					subtitleText = [ removeWeirdBracketsFromOldTitles(t) for t in subtitleText ]
-					
-					# Extract the abstract from the paper
-					abstract = articleElem.findall('./front/article-meta/abstract') + articleElem.findall('./front-stub/abstract')
-					abstractText = extractTextFromElemList(abstract)
+		# Extract the title of paper
+		title = articleElem.findall('./front/article-meta/title-group/article-title') + articleElem.findall('./front-stub/title-group/article-title')
+		assert len(title) <= 1
+		titleText = extractTextFromElemList(title)
+		titleText = [ removeWeirdBracketsFromOldTitles(t) for t in titleText ]
+		
+		# Get the subtitle (if it's there)
+		subtitle = articleElem.findall('./front/article-meta/title-group/subtitle') + articleElem.findall('./front-stub/title-group/subtitle')
+		subtitleText = extractTextFromElemList(subtitle)
+		subtitleText = [ removeWeirdBracketsFromOldTitles(t) for t in subtitleText ]
+		
+		# Extract the abstract from the paper
+		abstract = articleElem.findall('./front/article-meta/abstract') + articleElem.findall('./front-stub/abstract')
+		abstractText = extractTextFromElemList(abstract)
 
-					
-					# Extract the full text from the paper as well as supplementaries and floating blocks of text
-					articleText = extractTextFromElemList(articleElem.findall('./body'))
-					backText = extractTextFromElemList(articleElem.findall('./back'))
-					floatingText = extractTextFromElemList(articleElem.findall('./floats-group'))
-					
-					document = {'pmid':subPmidText, 'pmcid':subPmcidText, 'doi':subDoiText, 'pubYear':subPubYear, 'pubMonth':subPubMonth, 'pubDay':subPubDay, 'journal':subJournal, 'journalISO':subJournalISO}
-
-					textSources = {}
-					textSources['title'] = titleText
-					textSources['subtitle'] = subtitleText
-					textSources['abstract'] = abstractText
-					textSources['article'] = articleText
-					textSources['back'] = backText
-					textSources['floating'] = floatingText
-
-					for k in textSources.keys():
-						tmp = textSources[k]
-						tmp = [ t for t in tmp if len(t) > 0 ]
-						tmp = [ htmlUnescape(t) for t in tmp ]
-						tmp = [ removeBracketsWithoutWords(t) for t in tmp ]
-						textSources[k] = tmp
-
-					document['textSources'] = textSources
-					yield document
-			
-				# Less important here (compared to abstracts) as each article file is not too big
-				elem.clear()
+		
+		# Extract the full text from the paper as well as supplementaries and floating blocks of text
+		articleText = extractTextFromElemList(articleElem.findall('./body'))
+		backText = extractTextFromElemList(articleElem.findall('./back'))
+		floatingText = extractTextFromElemList(articleElem.findall('./floats-group'))
+		
+		document = {'pmid':subPmidText, 'pmcid':subPmcidText, 'doi':subDoiText, 'pubYear':subPubYear, 'pubMonth':subPubMonth, 'pubDay':subPubDay, 'journal':subJournal, 'journalISO':subJournalISO}
+
+		textSources = {}
+		textSources['title'] = titleText
+		textSources['subtitle'] = subtitleText
+		textSources['abstract'] = abstractText
+		textSources['article'] = articleText
+		textSources['back'] = backText
+		textSources['floating'] = floatingText
+
+		for k in textSources.keys():
+			tmp = textSources[k]
+			tmp = [ t for t in tmp if len(t) > 0 ]
+			tmp = [ htmlUnescape(t) for t in tmp ]
+			tmp = [ removeBracketsWithoutWords(t) for t in tmp ]
+			textSources[k] = tmp
+
+		document['textSources'] = textSources
+		yield document
+
+def processPMCFile(pmcFile,parser='etree'):
+	# lxml needs the raw bytes and deals with the encoding itself
+	with openInput(pmcFile, binary=(parser == 'lxml')) as openfile:
+		for elem in iterparseElements(openfile,'article',parser):
+			for document in processPMCArticle(elem):
+				yield document
 
 def trimSentenceLengths(text):
 	MAXLENGTH = 90000
 	return ".".join( line[:MAXLENGTH] for line in text.split('.') )
 
-def writeMarcXMLRecordToBiocFile(record,biocWriter):
+def marcXMLRecordToBioc(record):
 	metadata = record['008'].value()
 	language = metadata[35:38]
 	if language != 'eng':
-		return
+		return None
 
 	recordid = record['001'].value()
 
@@ -471,9 +680,9 @@ def writeMarcXMLRecordToBiocFile(record,biocWriter):
 			offset += len(textSource)
 			biocDoc.add_passage(passage)
 
-	biocWriter.write_document(biocDoc)
+	return biocDoc
 
-def uimaxmi2bioc(xmiFilename, biocFilename):
+def uimaxmi2biocDocuments(xmiFilename):
 	tree = etree.parse(xmiFilename)
 	root = tree.getroot()
 
@@ -483,113 +692,278 @@ def uimaxmi2bioc(xmiFilename, biocFilename):
 	contentNode = root.find('{http:///uima/cas.ecore}Sofa')
 	content = contentNode.attrib['sofaString']
 
-	with bioc.BioCXMLDocumentWriter(biocFilename) as writer:
-		biocDoc = bioc.BioCDocument()
-		biocDoc.id = None
-		biocDoc.infons['title'] = documentTitle
+	biocDoc = bioc.BioCDocument()
+	biocDoc.id = None
+	biocDoc.infons['title'] = documentTitle
 
-		passage = bioc.BioCPassage()
-		passage.infons['section'] = 'article'
-		passage.text = content
-		passage.offset = 0
-		biocDoc.add_passage(passage)
+	passage = bioc.BioCPassage()
+	passage.infons['section'] = 'article'
+	passage.text = content
+	passage.offset = 0
+	biocDoc.add_passage(passage)
 
-		writer.write_document(biocDoc)
+	yield biocDoc
 
+def pubmedxml2biocDocuments(pubmedxmlFilename, parser='etree', processes=1, pmidFilter=None):
+	# The parallel version needs to seek around the file so compressed files are processed serially
+	if processes > 1 and isPlainFile(pubmedxmlFilename):
+		pmDocs = processMedlineFileInParallel(pubmedxmlFilename,processes,parser,pmidFilter=pmidFilter)
+	else:
+		pmDocs = processMedlineFile(pubmedxmlFilename,parser,pmidFilter)
 
-def pubmedxml2bioc(pubmedxmlFilename, biocFilename):
-	with bioc.BioCXMLDocumentWriter(biocFilename) as writer:
-		for pmDoc in processMedlineFile(pubmedxmlFilename):
+	for pmDoc in pmDocs:
+		biocDoc = bioc.BioCDocument()
+		biocDoc.id = pmDoc["pmid"]
+		biocDoc.infons['title'] = " ".join(pmDoc["title"])
+		biocDoc.infons['pmid'] = pmDoc["pmid"]
+		biocDoc.infons['year'] = pmDoc["pubYear"]
+		biocDoc.infons['month'] = pmDoc["pubMonth"]
+		biocDoc.infons['day'] = pmDoc["pubDay"]
+		biocDoc.infons['journal'] = pmDoc["journal"]
+		biocDoc.infons['journalISO'] = pmDoc["journalISO"]
+		biocDoc.infons['authors'] = ", ".join(pmDoc["authors"])
+		biocDoc.infons['chemicals'] = pmDoc['chemicals']
+		biocDoc.infons['meshHeadings'] = pmDoc['meshHeadings']
+
+		offset = 0
+		for section in ["title","abstract"]:
+			for textSource in pmDoc[section]:
+				textSource = trimSentenceLengths(textSource)
+				passage = bioc.BioCPassage()
+				passage.infons['section'] = section
+				passage.text = textSource
+				passage.offset = offset
+				offset += len(textSource)
+				biocDoc.add_passage(passage)
+
+		yield biocDoc
+
+
+allowedSubsections = {"abbreviations","additional information","analysis","author contributions","authors' contributions","authors’ contributions","background","case report","competing interests","conclusion","conclusions","conflict of interest","conflicts of interest","consent","data analysis","data collection","discussion","ethics statement","funding","introduction","limitations","material and methods","materials","materials and methods","measures","method","methods","participants","patients and methods","pre-publication history","related literature","results","results and discussion","statistical analyses","statistical analysis","statistical methods","statistics","study design","summary","supplementary data","supplementary information","supplementary material","supporting information"}
+def pmcxml2biocDocuments(pmcxmlFilename, parser='etree'):
+	try:
+		for pmcDoc in processPMCFile(pmcxmlFilename,parser):
 			biocDoc = bioc.BioCDocument()
-			biocDoc.id = pmDoc["pmid"]
-			biocDoc.infons['title'] = " ".join(pmDoc["title"])
-			biocDoc.infons['pmid'] = pmDoc["pmid"]
-			biocDoc.infons['year'] = pmDoc["pubYear"]
-			biocDoc.infons['month'] = pmDoc["pubMonth"]
-			biocDoc.infons['day'] = pmDoc["pubDay"]
-			biocDoc.infons['journal'] = pmDoc["journal"]
-			biocDoc.infons['journalISO'] = pmDoc["journalISO"]
-			biocDoc.infons['authors'] = ", ".join(pmDoc["authors"])
-			biocDoc.infons['chemicals'] = pmDoc['chemicals']
-			biocDoc.infons['meshHeadings'] = pmDoc['meshHeadings']
-	
+			biocDoc.id = pmcDoc["pmid"]
+			biocDoc.infons['title'] = " ".join(pmcDoc["textSources"]["title"])
+			biocDoc.infons['pmid'] = pmcDoc["pmid"]
+			biocDoc.infons['pmcid'] = pmcDoc["pmcid"]
+			biocDoc.infons['doi'] = pmcDoc["doi"]
+			biocDoc.infons['year'] = pmcDoc["pubYear"]
+			biocDoc.infons['month'] = pmcDoc["pubMonth"]
+			biocDoc.infons['day'] = pmcDoc["pubDay"]
+			biocDoc.infons['journal'] = pmcDoc["journal"]
+			biocDoc.infons['journalISO'] = pmcDoc["journalISO"]
+
 			offset = 0
-			for section in ["title","abstract"]:
-				for textSource in pmDoc[section]:
+			for groupName,textSourceGroup in pmcDoc["textSources"].items():
+				subsection = None
+				for textSource in textSourceGroup:
 					textSource = trimSentenceLengths(textSource)
 					passage = bioc.BioCPassage()
-					passage.infons['section'] = section
+
+					subsectionCheck = textSource.lower().strip('01234567890. ')
+					if subsectionCheck in allowedSubsections:
+						subsection = subsectionCheck
+
+					passage.infons['section'] = groupName
+					passage.infons['subsection'] = subsection
 					passage.text = textSource
 					passage.offset = offset
 					offset += len(textSource)
 					biocDoc.add_passage(passage)
 
-			writer.write_document(biocDoc)
-
-
-allowedSubsections = {"abbreviations","additional information","analysis","author contributions","authors' contributions","authors’ contributions","background","case report","competing interests","conclusion","conclusions","conflict of interest","conflicts of interest","consent","data analysis","data collection","discussion","ethics statement","funding","introduction","limitations","material and methods","materials","materials and methods","measures","method","methods","participants","patients and methods","pre-publication history","related literature","results","results and discussion","statistical analyses","statistical analysis","statistical methods","statistics","study design","summary","supplementary data","supplementary information","supplementary material","supporting information"}
-def pmcxml2bioc(pmcxmlFilename, biocFilename):
-	try:
-		with bioc.BioCXMLDocumentWriter(biocFilename) as writer:
-			for pmcDoc in processPMCFile(pmcxmlFilename):
-				biocDoc = bioc.BioCDocument()
-				biocDoc.id = pmcDoc["pmid"]
-				biocDoc.infons['title'] = " ".join(pmcDoc["textSources"]["title"])
-				biocDoc.infons['pmid'] = pmcDoc["pmid"]
-				biocDoc.infons['pmcid'] = pmcDoc["pmcid"]
-				biocDoc.infons['doi'] = pmcDoc["doi"]
-				biocDoc.infons['year'] = pmcDoc["pubYear"]
-				biocDoc.infons['month'] = pmcDoc["pubMonth"]
-				biocDoc.infons['day'] = pmcDoc["pubDay"]
-				biocDoc.infons['journal'] = pmcDoc["journal"]
-				biocDoc.infons['journalISO'] = pmcDoc["journalISO"]
-
-				offset = 0
-				for groupName,textSourceGroup in pmcDoc["textSources"].items():
-					subsection = None
-					for textSource in textSourceGroup:
-						textSource = trimSentenceLengths(textSource)
-						passage = bioc.BioCPassage()
-
-						subsectionCheck = textSource.lower().strip('01234567890. ')
-						if subsectionCheck in allowedSubsections:
-							subsection = subsectionCheck
-
-						passage.infons['section'] = groupName
-						passage.infons['subsection'] = subsection
-						passage.text = textSource
-						passage.offset = offset
-						offset += len(textSource)
-						biocDoc.add_passage(passage)
-
-				writer.write_document(biocDoc)
-	except etree.ParseError:
+			yield biocDoc
+	except xmlParseErrors:
 		raise RuntimeError("Parsing error in PMC xml file: %s" % pmcxmlFilename)	
 
-def mergeBioc(biocFilename, outBiocWriter,idFilter):
+def marcxml2biocDocuments(marcxmlFilename):
+	# Feed the MARC XML to the SAX parser in blocks so records can be passed on as soon as they are parsed
+	handler = pymarc.XmlHandler()
+	saxParser = xml.sax.make_parser()
+	saxParser.setContentHandler(handler)
+	saxParser.setFeature(xml.sax.handler.feature_namespaces, 1)
+
+	with open(marcxmlFilename,'rb') as inF:
+		for block in iter(lambda : inF.read(1024*1024), b''):
+			saxParser.feed(block)
+			records,handler.records = handler.records,[]
+			for record in records:
+				biocDoc = marcXMLRecordToBioc(record)
+				if biocDoc is not None:
+					yield biocDoc
+
+	saxParser.close()
+	for record in handler.records:
+		biocDoc = marcXMLRecordToBioc(record)
+		if biocDoc is not None:
+			yield biocDoc
+
+def bioc2biocDocuments(biocFilename):
 	with open(biocFilename,'rb') as f:
 		parser = bioc.BioCXMLDocumentReader(f)
 		for biocDoc in parser:
-			if idFilter is None or biocDoc.id in idFilter:
-				outBiocWriter.write_document(biocDoc)
+			yield biocDoc
 
-def bioc2txt(biocFilename, txtHandle,idFilter):
-	with open(biocFilename,'rb') as f:
-		parser = bioc.BioCXMLDocumentReader(f)
-		for biocDoc in parser:
-			if idFilter is None or biocDoc.id in idFilter:
-				for passage in biocDoc.passages:
-					txtHandle.write(passage.text)
-					txtHandle.write("\n\n")
+def writeBiocDocuments(biocDocs, biocFilename):
+	with bioc.BioCXMLDocumentWriter(biocFilename) as writer:
+		for biocDoc in biocDocs:
+			writer.write_document(biocDoc)
 
-def marcxml2bioc(marcxmlFilename,biocFilename):
-	with open(marcxmlFilename,'rb') as inF, bioc.BioCXMLDocumentWriter(biocFilename) as writer:
-		def marcxml2bioc_helper(record):
-			writeMarcXMLRecordToBiocFile(record,writer)
+def uimaxmi2bioc(xmiFilename, biocFilename):
+	writeBiocDocuments(uimaxmi2biocDocuments(xmiFilename), biocFilename)
 
-		pymarc.map_xml(marcxml2bioc_helper,inF)
+def pubmedxml2bioc(pubmedxmlFilename, biocFilename, parser='etree', processes=1):
+	writeBiocDocuments(pubmedxml2biocDocuments(pubmedxmlFilename,parser,processes), biocFilename)
 
-def convertFilesFromFilelist(listFile,inFormat,outFile,outFormat,idFilterListfile=None):
+def pmcxml2bioc(pmcxmlFilename, biocFilename, parser='etree'):
+	writeBiocDocuments(pmcxml2biocDocuments(pmcxmlFilename,parser), biocFilename)
+
+def marcxml2bioc(marcxmlFilename,biocFilename):
+	writeBiocDocuments(marcxml2biocDocuments(marcxmlFilename), biocFilename)
+
+# Reads documents from any of the accepted input formats as BioC documents, one at a time. The PMID
+# filter lets Pubmed citations be skipped early, but documents of other formats are not filtered
+def readDocuments(inFile,inFormat,parser='etree',processes=1,pmidFilter=None):
+	if inFormat == 'bioc':
+		return bioc2biocDocuments(inFile)
+	elif inFormat == 'pubmedxml':
+		return pubmedxml2biocDocuments(inFile,parser,processes,pmidFilter)
+	elif inFormat == 'marcxml':
+		return marcxml2biocDocuments(inFile)
+	elif inFormat == 'pmcxml':
+		return pmcxml2biocDocuments(inFile,parser)
+	elif inFormat == 'uimaxmi':
+		return uimaxmi2biocDocuments(inFile)
+	else:
+		raise RuntimeError("Unknown input format: %s" % inFormat)
+
+# Gets an integer value (e.g. the year) from a document infon, which may have been read back in as text
+def infonAsInt(value):
+	if isinstance(value,int):
+		return value
+	elif isinstance(value,six.string_types) and value.strip().isdigit():
+		return int(value)
+	else:
+		return None
+
+class BioCOutputWriter:
+	extension = 'bioc'
+
+	def __init__(self,outFile):
+		self.writer = bioc.BioCXMLDocumentWriter(outFile)
+
+	def write_document(self,biocDoc):
+		self.writer.write_document(biocDoc)
+
+	def close(self):
+		self.writer.close()
+
+class TxtOutputWriter:
+	extension = 'txt'
+
+	def __init__(self,outFile):
+		self.handle = codecs.open(outFile,'w','utf-8')
+
+	def write_document(self,biocDoc):
+		for passage in biocDoc.passages:
+			self.handle.write(passage.text)
+			self.handle.write("\n\n")
+
+	def close(self):
+		self.handle.close()
+
+# Gzip-compressed JSON Lines with one document (with its infons and passages) per line
+class JSONLOutputWriter:
+	extension = 'jsonl.gz'
+
+	def __init__(self,outFile):
+		self.handle = gzip.open(outFile,'wt',encoding='utf-8')
+		self.writer = jsonlines.Writer(self.handle, compact=True)
+
+	def write_document(self,biocDoc):
+		infons = dict(biocDoc.infons)
+		for key in ['year','month','day']:
+			if key in infons:
+				infons[key] = infonAsInt(infons[key])
+
+		passages = [ {'offset':passage.offset, 'infons':dict(passage.infons), 'text':passage.text} for passage in biocDoc.passages ]
+		self.writer.write({'id':biocDoc.id, 'infons':infons, 'passages':passages})
+
+	def close(self):
+		self.writer.close()
+		self.handle.close()
+
+# Parquet file with one passage per row and the main document metadata in typed columns.
+# Rows are collected and written as a row group every batchSize passages so memory use is bounded
+class ParquetOutputWriter:
+	extension = 'parquet'
+
+	def __init__(self,outFile,batchSize=10000):
+		try:
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise RuntimeError("The parquet output format needs the pyarrow package to be installed")
+
+		self.pyarrow = pyarrow
+		self.schema = pyarrow.schema([
+			('id', pyarrow.string()),
+			('pmid', pyarrow.int64()),
+			('pmcid', pyarrow.string()),
+			('year', pyarrow.int32()),
+			('journal', pyarrow.string()),
+			('meshHeadings', pyarrow.string()),
+			('section', pyarrow.string()),
+			('subsection', pyarrow.string()),
+			('offset', pyarrow.int64()),
+			('text', pyarrow.string())
+		])
+		self.writer = pyarrow.parquet.ParquetWriter(outFile, self.schema)
+		self.batchSize = batchSize
+		self.batch = { name:[] for name in self.schema.names }
+
+	def write_document(self,biocDoc):
+		for passage in biocDoc.passages:
+			self.batch['id'].append(biocDoc.id)
+			self.batch['pmid'].append(infonAsInt(biocDoc.infons.get('pmid')))
+			self.batch['pmcid'].append(biocDoc.infons.get('pmcid'))
+			self.batch['year'].append(infonAsInt(biocDoc.infons.get('year')))
+			self.batch['journal'].append(biocDoc.infons.get('journal'))
+			self.batch['meshHeadings'].append(biocDoc.infons.get('meshHeadings'))
+			self.batch['section'].append(passage.infons.get('section'))
+			self.batch['subsection'].append(passage.infons.get('subsection'))
+			self.batch['offset'].append(infonAsInt(passage.offset))
+			self.batch['text'].append(passage.text)
+
+		if len(self.batch['text']) >= self.batchSize:
+			self.writeBatch()
+
+	def writeBatch(self):
+		if len(self.batch['text']) > 0:
+			table = self.pyarrow.Table.from_pydict(self.batch, schema=self.schema)
+			self.writer.write_table(table)
+			self.batch = { name:[] for name in self.schema.names }
+
+	def close(self):
+		self.writeBatch()
+		self.writer.close()
+
+# Output formats and the classes that write them. Each class takes the output filename and
+# has a write_document(biocDoc) and close() method, and an extension for naming output files
+outputWriters = {}
+outputWriters['bioc'] = BioCOutputWriter
+outputWriters['txt'] = TxtOutputWriter
+outputWriters['jsonl'] = JSONLOutputWriter
+outputWriters['parquet'] = ParquetOutputWriter
+acceptedOutFormats = list(outputWriters.keys())
+
+def registerOutputWriter(outFormat,writerClass):
+	outputWriters[outFormat] = writerClass
+	if not outFormat in acceptedOutFormats:
+		acceptedOutFormats.append(outFormat)
+
+def convertFilesFromFilelist(listFile,inFormat,outFile,outFormat,idFilterListfile=None,parser='etree',processes=1):
 	with open(listFile) as f:
 		inFiles = json.load(f)
 
@@ -598,50 +972,34 @@ def convertFilesFromFilelist(listFile,inFormat,outFile,outFormat,idFilterListfil
 		with open(idFilterListfile) as f:
 			idFilterfiles = json.load(f)
 
-	convertFiles(inFiles,inFormat,outFile,outFormat,idFilterfiles)
+	convertFiles(inFiles,inFormat,outFile,outFormat,idFilterfiles,parser,processes)
 
 acceptedInFormats = ['bioc','pubmedxml','marcxml','pmcxml','uimaxmi']
-acceptedOutFormats = ['bioc','txt']
-def convertFiles(inFiles,inFormat,outFile,outFormat,idFilterfiles=None):
-	outBiocHandle,outTxtHandle = None,None
+def convertFiles(inFiles,inFormat,outFile,outFormat,idFilterfiles=None,parser='etree',processes=1):
+	assert parser in acceptedParsers, "%s is not an accepted XML parser. Options are: %s" % (parser, "/".join(acceptedParsers))
 
-	if outFormat == 'bioc':
-		outBiocHandle = bioc.BioCXMLDocumentWriter(outFile)
-	elif outFormat == 'txt':
-		outTxtHandle = codecs.open(outFile,'w','utf-8')
+	if not outFormat in outputWriters:
+		raise RuntimeError("Unknown output format: %s" % outFormat)
+	outWriter = outputWriters[outFormat](outFile)
 
 	if idFilterfiles is None:
 		idFilterfiles = [ None for _ in inFiles ]
 
 	print("Converting %d files to %s" % (len(inFiles),outFile))
 	for inFile,idFilterfile in zip(inFiles,idFilterfiles):
-		if idFilterfile is None:
-			idFilter = None
-		else:
-			with open(idFilterfile) as f:
-				idFilter = set([ line.strip() for line in f ])
-
-
-		with tempfile.NamedTemporaryFile() as temp:
-			if inFormat == 'bioc':
-				shutil.copyfile(inFile,temp.name)
-			elif inFormat == 'pubmedxml':
-				pubmedxml2bioc(inFile,temp.name)
-			elif inFormat == 'marcxml':
-				marcxml2bioc(inFile,temp.name)
-			elif inFormat == 'pmcxml':
-				pmcxml2bioc(inFile,temp.name)
-			elif inFormat == 'uimaxmi':
-				uimaxmi2bioc(inFile,temp.name)
-			else:
-				raise RuntimeError("Unknown input format: %s" % inFormat)
-
-			if outFormat == 'bioc':
-				mergeBioc(temp.name,outBiocHandle,idFilter)
-			elif outFormat == 'txt':
-				bioc2txt(temp.name,outTxtHandle,idFilter)
-			else:
-				raise RuntimeError("Unknown output format: %s" % outFormat)
+		idFilter = None if idFilterfile is None else openIDFilter(idFilterfile)
+
+		# Documents are passed straight from the input reader to the output writer. Pubmed citations
+		# that aren't in the filter are skipped before they are converted
+		pmidFilter = None if idFilter is None else idFilter.__contains__
+		for biocDoc in readDocuments(inFile,inFormat,parser,processes,pmidFilter):
+			if idFilter is None or biocDoc.id in idFilter:
+				outWriter.write_document(biocDoc)
+
+		if idFilter is not None:
+			closeIDFilter(idFilter)
+
+	outWriter.close()
 	print("Output to %s complete" % outFile)
 
 def main():
@@ -651,6 +1009,8 @@ def main():
 	parser.add_argument('--idFilters',type=str,help="Optional set of ID files to filter the documents by")
 	parser.add_argument('--o',type=str,required=True,help="Where to store resulting converted docs")
 	parser.add_argument('--oFormat',type=str,required=True,help="Format for output corpus. Options: %s" % "/".join(acceptedOutFormats))
+	parser.add_argument('--processes',type=int,default=1,help="Number of processes to use when converting each Pubmed XML file")
+	parser.add_argument('--parser',type=str,default='etree',help="XML parser to use for PubMed and PMC XML. Options: %s" % "/".join(acceptedParsers))
 
 	args = parser.parse_args()
 
@@ -667,5 +1027,7 @@ def main():
 	else:
 		idFilterfiles = None
 
-	convertFiles(inFiles,inFormat,args.o,outFormat,idFilterfiles)
+	assert args.parser in acceptedParsers, "%s is not an accepted XML parser. Options are: %s" % (args.parser, "/".join(acceptedParsers))
+
+	convertFiles(inFiles,inFormat,args.o,outFormat,idFilterfiles,args.parser,args.processes)
 
@@ -0,0 +1,109 @@
+import pubrunner
+import os
+import json
+import time
+import multiprocessing
+from pubrunner.snakemake import getLocalResources
+
+# Runs the conversion and Pubmed hashing jobs in a process pool inside PubRunner (instead of launching
+# Snakemake with the Convert.py and PubmedHashes.py Snakefiles). Jobs are only run if their output is
+# missing or older than one of their inputs, same as Snakemake does. Each job writes to temporary
+# files that are only renamed to its outputs once it completes, so an interrupted or failed job
+# never leaves a partial output that looks newer than its inputs
+
+# The built-in executor is used unless a cluster is configured or the local settings ask for Snakemake
+def useBuiltinExecutor(useCluster=True):
+	globalSettings = pubrunner.getGlobalSettings()
+	if useCluster and "cluster" in globalSettings:
+		return False
+
+	localSettings = globalSettings["local"] if "local" in globalSettings and globalSettings["local"] else {}
+	executor = localSettings["executor"] if "executor" in localSettings else "builtin"
+	assert executor in ["builtin","snakemake"], "The local executor must be builtin or snakemake. Got: %s" % executor
+	return executor == "builtin"
+
+def isOutdated(inputFiles,outputFile):
+	if not os.path.isfile(outputFile):
+		return True
+	outputTimestamp = os.path.getmtime(outputFile)
+	return any( os.path.getmtime(inputFile) > outputTimestamp for inputFile in inputFiles )
+
+# Number of jobs to run at once given the local cores and memory
+def getProcessCount(jobCount):
+	cores,memory,jobMemory = getLocalResources(pubrunner.getGlobalSettings())
+	processes = cores if memory is None else min(cores, memory // jobMemory)
+	return max(1, min(processes, jobCount))
+
+# Hidden and in the same directory as the output so that it can be renamed into place
+def getTempOutputFile(outputFile):
+	outDir,outName = os.path.split(outputFile)
+	return os.path.join(outDir,'.%s.tmp' % outName)
+
+def removeTempOutputFiles(outputFiles):
+	for outputFile in outputFiles:
+		tempFile = getTempOutputFile(outputFile)
+		if os.path.isfile(tempFile):
+			os.unlink(tempFile)
+
+# The arguments of a job write to the temporary files of its outputs
+def runJob(job):
+	func,args,outputFiles = job
+	try:
+		func(*args)
+		for outputFile in outputFiles:
+			os.replace(getTempOutputFile(outputFile),outputFile)
+	except:
+		removeTempOutputFiles(outputFiles)
+		raise
+	return outputFiles
+
+def runJobs(name,jobs):
+	if len(jobs) == 0:
+		print("No %s jobs needed" % name)
+		return
+
+	processes = getProcessCount(len(jobs))
+	print("Running %d %s jobs using %d processes" % (len(jobs),name,processes))
+
+	start = time.time()
+	if processes == 1:
+		for i,job in enumerate(jobs):
+			runJob(job)
+			print("  %d of %d %s jobs done" % (i+1,len(jobs),name))
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			for i,_ in enumerate(pool.imap_unordered(runJob,jobs)):
+				print("  %d of %d %s jobs done" % (i+1,len(jobs),name))
+			pool.close()
+		except:
+			# Jobs stopped partway (e.g. by Ctrl-C) leave their temporary outputs behind
+			pool.terminate()
+			pool.join()
+			for func,args,outputFiles in jobs:
+				removeTempOutputFiles(outputFiles)
+			raise
+		pool.join()
+
+	print("Finished %d %s jobs in %.1fs" % (len(jobs),name,time.time()-start))
+
+# Same jobs as the Convert.py Snakefile
+def runConversions(chunkDir,outDir,inFormat,outFormat,pmidChunkDir=None):
+	jobs = []
+	for chunkName in sorted(os.listdir(chunkDir)):
+		chunkFile = os.path.join(chunkDir,chunkName)
+		outFile = os.path.join(outDir,chunkName)
+		if pmidChunkDir:
+			pmidChunkFile = os.path.join(pmidChunkDir,chunkName)
+			if isOutdated([chunkFile,pmidChunkFile],outFile):
+				jobs.append((pubrunner.convertFilesFromFilelist,(chunkFile,inFormat,getTempOutputFile(outFile),outFormat,pmidChunkFile),[outFile]))
+		else:
+			if isOutdated([chunkFile],outFile):
+				jobs.append((pubrunner.convertFilesFromFilelist,(chunkFile,inFormat,getTempOutputFile(outFile),outFormat),[outFile]))
+
+	runJobs('conversion',jobs)
+
+# Same jobs as the PubmedHashes.py Snakefile, though each Pubmed file is its own job instead of being batched
+def runPubmedHashes(inAndOut):
+	jobs = [ (pubrunner.hashPubmedFiles,([inFile],[getTempOutputFile(outFile)]),[outFile]) for inFile,outFile in inAndOut ]
+	runJobs('Pubmed hashing',jobs)
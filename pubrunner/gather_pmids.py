@@ -1,273 +1,350 @@
 import argparse
 import os
 import json
-from collections import defaultdict,Counter
+from collections import OrderedDict,namedtuple
 import pubrunner
-#import numpy as np
-import sys
-from sys import getsizeof
-
-from sys import getsizeof, stderr
-from itertools import chain
-from collections import deque
-try:
-	from reprlib import repr
-except ImportError:
-	pass
-
-def total_size(o, handlers={}, verbose=False):
-	""" Returns the approximate memory footprint an object and all of its contents.
-
-	Automatically finds the contents of the following builtin containers and
-	their subclasses:  tuple, list, deque, dict, set and frozenset.
-	To search other containers, add handlers to iterate over their contents:
-
-		handlers = {SomeContainerClass: iter,
-					OtherContainerClass: OtherContainerClass.get_elements}
-
-	"""
-	dict_handler = lambda d: chain.from_iterable(d.items())
-	all_handlers = {tuple: iter,
-					list: iter,
-					deque: iter,
-					dict: dict_handler,
-					set: iter,
-					frozenset: iter,
-				   }
-	all_handlers.update(handlers)	 # user handlers take precedence
-	seen = set()					  # track which object id's have already been seen
-	default_size = getsizeof(0)	   # estimate sizeof object without __sizeof__
-
-	def sizeof(o):
-		if id(o) in seen:	   # do not double count the same object
-			return 0
-		seen.add(id(o))
-		s = getsizeof(o, default_size)
-
-		if verbose:
-			print(s, type(o), repr(o), file=stderr)
-
-		for typ, handler in all_handlers.items():
-			if isinstance(o, typ):
-				s += sum(map(sizeof, handler(o)))
-				break
-		return s
-
-	return sizeof(o)
-
-
-def memReport(variables):
-	print('-'*30)
-	for var,obj in variables.items():
-		if not var.startswith('_'):
-			print("%s\t%.1fMB" % (var,total_size(obj) / (1024.0*1024.0)))
-			#print("%s\t%.1fB" % (var,getsizeof(obj)))
-	print('-'*30)
-
-def gatherPMIDs(inHashDir,outPMIDDir,whichHashes=None,pmidExclusions=None):
-	# Check the age of inHashDir files and outPMIDDir files and check if anything is actually needed
-	if os.path.isdir(outPMIDDir):
-		inHashDir_modifieds = [ os.path.getmtime(os.path.join(root,f)) for root, dir, files in os.walk(inHashDir) for f in files ]
-		outPMIDDir_modifieds = [ os.path.getmtime(os.path.join(root,f)) for root, dir, files in os.walk(inHashDir) for f in files ]
-	#	print("max(inHashDir_modifieds)",max(inHashDir_modifieds))
-	#	print("max(outPMIDDir_modifieds)",max(outPMIDDir_modifieds))
-		if max(inHashDir_modifieds) < max(outPMIDDir_modifieds):
-			print("No PMID update necessary")
-			return
-
-	files = sorted([ os.path.join(inHashDir,f) for f in os.listdir(inHashDir) ])
-	pmidToFilename = {}
-
-	pubmedXMLFiles = ['/projects/jlever/pubrunner_data/resources/PUBMED/pubmed19n1000.xml']
-
-	#memReport(locals())
-
-	#for pmid in range(29661075):
-	#	pmidToFilename[pmid] = '/projects/jlever/pubrunner_data/resources/PUBMED/pubmed19n1000.xml'
-
-	if True:
-		maxPmidInt = -1
-		for filename in files:
-			
-			#continue
-			with open(filename) as f:
-				hashes = json.load(f)
-				keys = list(hashes.keys())
-				assert len(keys) == 1
-				pubmedXMLFile = keys[0]
-				pubmedXMLFiles.append(pubmedXMLFile)
-
-			tempMaxPmid = max( map(int,hashes[pubmedXMLFile].keys()) )
-			maxPmidInt = max(maxPmidInt,tempMaxPmid)
-
-		#print('maxPmidInt:',maxPmidInt)
-
-		pubmedXMLFiles = []
-		#firstFile = {}
-		firstFile = [ None for _ in range(maxPmidInt+1) ]
-		versionCounts = [ 0 for _ in range(maxPmidInt+1) ]
-		#versionCounts = np.zeros((maxPmidInt+1),dtype=int)
-
-		for filename in files:
-			
-			#continue
-			with open(filename) as f:
-				hashes = json.load(f)
-				keys = list(hashes.keys())
-				assert len(keys) == 1
-				pubmedXMLFile = keys[0]
-				pubmedXMLFiles.append(pubmedXMLFile)
-
-
-			for pmid in hashes[pubmedXMLFile].keys():
-				pmidInt = int(pmid)
-				#if not pmidInt in firstFile:
-				if firstFile[pmidInt] is None:
-					firstFile[pmidInt] = pubmedXMLFile
+from pubrunner.pubmed_hash import loadHashColumns,getHashManifestDigest
+from pubrunner.pmidlist import writePMIDList,loadPMIDList
+import array
+import bisect
+import re
+import time
+import hashlib
+
+# Marks a PMID that isn't found in any of the Pubmed files
+NOFILE = 0xFFFF
+
+# Size in bytes of the hash digests stored for each PMID version
+DIGESTSIZE = 16
+
+# Reduces the hash columns (either all of them or the selected ones) to one fixed-width digest
+# per PMID, so that they can be stored compactly and compared to other versions of the PMID
+def hashColumnsToDigests(columns,count,whichHashes):
+	fields = sorted(columns.keys()) if whichHashes is None else whichHashes
+	for field in fields:
+		if not field in columns:
+			raise RuntimeError("The selected hash (%s) from the 'usePubmedHashes' option has not been found in the hash files." % field)
+
+	if len(fields) == 1:
+		return columns[fields[0]]
+
+	selected = [ columns[field] for field in fields ]
+	return b"".join( hashlib.md5(b"".join( column[i*DIGESTSIZE:(i+1)*DIGESTSIZE] for column in selected )).digest() for i in range(count) )
+
+# Loads a hash file (in either the binary or the older JSON format)
+def loadHashFile(filename):
+	hashColumns = loadHashColumns(filename)
+	keys = list(hashColumns.keys())
+	assert len(keys) == 1
+	pubmedXMLFile = keys[0]
+	pmids,columns = hashColumns[pubmedXMLFile]
+	return pubmedXMLFile, pmids, columns
+
+# The compact version of a hash file: the Pubmed file it came from, a sorted array of its
+# PMIDs and a parallel bytes array of the hash digests (DIGESTSIZE bytes per PMID)
+IngestedHashes = namedtuple('IngestedHashes', ['pubmedXMLFile','pmids','digests'])
+ingestedVersion = 2
+
+def getIngestedFilename(hashFile,whichHashes,cacheDir):
+	hashesKey = 'all' if whichHashes is None else hashlib.md5(",".join(whichHashes).encode('utf8')).hexdigest()[:8]
+	return os.path.join(cacheDir, "%s.%s.ingested" % (os.path.basename(hashFile),hashesKey))
+
+def saveIngestedHashes(ingestedFile,ingested,hashFile):
+	hashFileStat = os.stat(hashFile)
+	header = {'version':ingestedVersion, 'pubmedXMLFile':ingested.pubmedXMLFile, 'count':len(ingested.pmids), 'hashFileSize':hashFileStat.st_size, 'hashFileModified':hashFileStat.st_mtime}
+
+	tempFile = ingestedFile + '.tmp'
+	with open(tempFile,'wb') as f:
+		f.write(json.dumps(header).encode('utf8') + b'\n')
+		ingested.pmids.tofile(f)
+		f.write(ingested.digests)
+	os.replace(tempFile,ingestedFile)
+
+def loadIngestedHashes(ingestedFile,hashFile=None):
+	with open(ingestedFile,'rb') as f:
+		header = json.loads(f.readline().decode('utf8'))
+
+		# Check that the hash file hasn't changed since this was created
+		if hashFile is not None:
+			hashFileStat = os.stat(hashFile)
+			if header.get('version') != ingestedVersion:
+				return None
+			if header['hashFileSize'] != hashFileStat.st_size or header['hashFileModified'] != hashFileStat.st_mtime:
+				return None
+
+		pmids = array.array('I')
+		pmids.fromfile(f, header['count'])
+		digests = f.read(DIGESTSIZE*header['count'])
+	return IngestedHashes(header['pubmedXMLFile'],pmids,digests)
+
+# Decodes a hash file (once) into the compact form and caches it on disk so that later runs
+# (and the later phases of gatherPMIDs) only need to read the compact version
+def ingestHashFile(hashFile,whichHashes,cacheDir):
+	ingestedFile = getIngestedFilename(hashFile,whichHashes,cacheDir)
+	if os.path.isfile(ingestedFile):
+		ingested = loadIngestedHashes(ingestedFile,hashFile)
+		if ingested is not None:
+			return ingestedFile,ingested
+
+	pubmedXMLFile,pmids,columns = loadHashFile(hashFile)
+	digests = hashColumnsToDigests(columns,len(pmids),whichHashes)
+	ingested = IngestedHashes(pubmedXMLFile,pmids,digests)
+
+	saveIngestedHashes(ingestedFile,ingested,hashFile)
+	return ingestedFile,ingested
+
+# Phase 1: Ingests all the hash files and gets the list of Pubmed files and the largest PMID
+def ingestHashFiles(hashFiles,whichHashes,cacheDir):
+	if not os.path.isdir(cacheDir):
+		os.makedirs(cacheDir)
+
+	ingestedFiles,pubmedXMLFiles = [],[]
+	maxPmidInt = -1
+	for hashFile in hashFiles:
+		ingestedFile,ingested = ingestHashFile(hashFile,whichHashes,cacheDir)
+		ingestedFiles.append(ingestedFile)
+		pubmedXMLFiles.append(ingested.pubmedXMLFile)
+		if len(ingested.pmids) > 0:
+			maxPmidInt = max(maxPmidInt,ingested.pmids[-1])
+
+	return ingestedFiles,pubmedXMLFiles,maxPmidInt
+
+# Phase 2: Finds the index of the first Pubmed file that each PMID appears in and the number of
+# files it appears in (which saturates at 255 as it only matters if it is more than one)
+def countPMIDVersions(ingestedFiles,maxPmidInt):
+	firstFile = array.array('H', [NOFILE]) * (maxPmidInt+1)
+	versionCounts = array.array('B', bytes(maxPmidInt+1))
+	for fileIndex,ingestedFile in enumerate(ingestedFiles):
+		ingested = loadIngestedHashes(ingestedFile)
+		for pmidInt in ingested.pmids:
+			if firstFile[pmidInt] == NOFILE:
+				firstFile[pmidInt] = fileIndex
+			if versionCounts[pmidInt] < 255:
 				versionCounts[pmidInt] += 1
 
-
-		#pmidToFilename = { pmid:firstFile[pmid] for pmid,count in versionCounts.items() if count == 1 }
-		#pmidToFilename = { pmid:'/projects/jlever/pubrunner_data/resources/PUBMED/pubmed19n1000.xml' for pmid,count in versionCounts.items() if count == 1 }
-		#pmidToFilename = { pmid:'/projects/jlever/pubrunner_data/resources/PUBMED/pubmed19n1000.xml' for pmid,count in enumerate(versionCounts) if count == 1 }
-
-		pmidToFilename = list(firstFile)
-
-		#pmidsToSkip = set(pmid for pmid,count in enumerate(versionCounts) if count == 1)
-		#versionCounts = None
-
-		
-		#print('hashes',getsizeof(hashes))
-		#print('pubmedXMLFiles',getsizeof(pubmedXMLFiles))
-		#print('firstFile',getsizeof(firstFile))
-		#print('versionCounts',getsizeof(versionCounts))
-		#print('pmidsToSkip',getsizeof(pmidsToSkip))
-
-
-		if True:
-
-			runningHashes = {} #defaultdict(lambda : None)
-			for filename in reversed(files):
-				with open(filename) as f:
-					hashes = json.load(f)
-					keys = list(hashes.keys())
-					assert len(keys) == 1
-					pubmedXMLFile = keys[0]
-
-				for pmid in hashes[pubmedXMLFile].keys():
-					pmidInt = int(pmid)
-					#if pmidInt in pmidsToSkip:
-
-					# Only one version of this PMID so don't need to track changes
-					if versionCounts[pmidInt] == 1:
-						continue
-					#if not pmid.startswith(pmidPrefix):
-					#	continue
-
-					if whichHashes is None:
-						hashVal = hashes[pubmedXMLFile][pmid]
-					else:
-						try:
-							hashVal = [ hashes[pubmedXMLFile][pmid][h] for h in whichHashes ]
-						except KeyError as e:
-							raise RuntimeError("The selected hash (%s) from the 'usePubmedHashes' option has not been found in the hash files." % (str(e)))
-
-					#if pmidInt == 1:
-					#	print(pmidInt, filename, firstFile[pmidInt], pubmedXMLFile, pmidInt in runningHashes)
-
-					# Check this version against a newer version
-					# If this older version is different, leave the pmidToFilename as the newer version and stop looking for this pmid
-					if pmidInt in runningHashes and runningHashes[pmidInt] != hashVal:
-						#pmidsToSkip.add(pmidInt)
-						versionCounts[pmidInt] = 1
-						del runningHashes[pmidInt]
-					else: # No newer version to compare against, so set the hash and pmidToFilename to this version
-						runningHashes[pmidInt] = hashVal
-						pmidToFilename[pmidInt] = pubmedXMLFile
-
-					if firstFile[pmidInt] == pubmedXMLFile and pmidInt in runningHashes:
-						del runningHashes[pmidInt]
-			
-
-	#for pmidPrefix in map(str,range(1,10)):
-	if False:
-		pmidHashes = defaultdict(list)
-		for filename in sorted(files):
-			
-			#continue
-			with open(filename) as f:
-				hashes = json.load(f)
-				keys = list(hashes.keys())
-				assert len(keys) == 1
-				pubmedXMLFile = keys[0]
-				#pubmedXMLFiles.append(pubmedXMLFile)
-
-			for pmid in hashes[pubmedXMLFile].keys():
-				#if not pmid.startswith(pmidPrefix):
-				#	continue
-
-				if whichHashes is None:
-					hashVal = hashes[pubmedXMLFile][pmid]
-				else:
-					try:
-						hashVal = [ hashes[pubmedXMLFile][pmid][h] for h in whichHashes ]
-					except KeyError as e:
-						raise RuntimeError("The selected hash (%s) from the 'usePubmedHashes' option has not been found in the hash files." % (str(e)))
-
-				pmidInt = int(pmid)
-				if pmidHashes[pmidInt] != hashVal:
-					pmidHashes[pmidInt] = hashVal
-					pmidToFilename[pmidInt] = pubmedXMLFile
-		pmidHashes = None
-
-	#pmidToFilename = {}
-	#for pmid in range(29661075):
-	#	pmidToFilename[pmid] = '/projects/jlever/pubrunner_data/resources/PUBMED/pubmed19n1000.xml'
-
-	#sys.exit(0)
-
-	filenameToPMIDs = defaultdict(list)
-	#filenameToPMIDs = [ [] for _ in pubmedXMLFiles ]
-	#for pmid,filename in pmidToFilename.items():
-	#	filenameToPMIDs[filename].append(pmid)
-	for pmid,filename in enumerate(pmidToFilename):
-		if filename is not None:
-			filenameToPMIDs[filename].append(pmid)
-
+	return firstFile,versionCounts
+
+# Phase 3: Works backwards through the files to find which file each PMID should be processed from.
+# This is the oldest file that has the same hashes as the latest version of the PMID
+def chooseLatestVersions(ingestedFiles,firstFile,versionCounts):
+	pmidToFileIndex = array.array('H', firstFile)
+
+	# Only PMIDs with multiple versions need their hashes tracked. They are stored in a sorted
+	# array (searched with bisect) with a parallel bytes array of their hash digests
+	multiVersionPmids = array.array('I', ( m.start() for m in re.finditer(rb'[\x02-\xff]', versionCounts) ))
+	runningHashes = bytearray(DIGESTSIZE * len(multiVersionPmids))
+	hasRunningHash = bytearray(len(multiVersionPmids))
+
+	for fileIndex in reversed(range(len(ingestedFiles))):
+		ingested = loadIngestedHashes(ingestedFiles[fileIndex])
+
+		for i,pmidInt in enumerate(ingested.pmids):
+			# Only one version of this PMID so don't need to track changes
+			if versionCounts[pmidInt] == 1:
+				continue
+
+			hashVal = ingested.digests[i*DIGESTSIZE:(i+1)*DIGESTSIZE]
+
+			slot = bisect.bisect_left(multiVersionPmids,pmidInt)
+			slotStart = slot*DIGESTSIZE
+
+			# Check this version against a newer version
+			# If this older version is different, leave the pmidToFileIndex as the newer version and stop looking for this pmid
+			if hasRunningHash[slot] and runningHashes[slotStart:slotStart+DIGESTSIZE] != hashVal:
+				versionCounts[pmidInt] = 1
+				hasRunningHash[slot] = 0
+			else: # No newer version to compare against, so set the hash and pmidToFileIndex to this version
+				runningHashes[slotStart:slotStart+DIGESTSIZE] = hashVal
+				hasRunningHash[slot] = 1
+				pmidToFileIndex[pmidInt] = fileIndex
+
+			if firstFile[pmidInt] == fileIndex:
+				hasRunningHash[slot] = 0
+
+	return pmidToFileIndex
+
+# Phase 4: Groups the PMIDs by file (only looking at PMIDs that appear in at least one file)
+def groupPMIDsByFile(pmidToFileIndex,versionCounts,fileCount):
+	filenameToPMIDs = [ array.array('I') for _ in range(fileCount) ]
+	for m in re.finditer(rb'[^\x00]', versionCounts):
+		pmid = m.start()
+		filenameToPMIDs[pmidToFileIndex[pmid]].append(pmid)
+	return filenameToPMIDs
+
+# Removes the excluded PMIDs (e.g. ones that will come from PMC instead) so they aren't grouped into any file
+def excludePMIDs(versionCounts,pmidExclusions):
+	for pmid in pmidExclusions:
+		if pmid < len(versionCounts):
+			versionCounts[pmid] = 0
+
+# The snapshot records the count and digest of the PMIDs in each PMID list from the last run, so that
+# unchanged lists can be found without reading them back
+pmidSnapshotVersion = 1
+
+def getPMIDSnapshotFile(outPMIDDir):
+	return outPMIDDir.rstrip('/') + '.snapshot.json'
+
+def loadPMIDSnapshot(snapshotFile):
+	if not os.path.isfile(snapshotFile):
+		return {}
+	try:
+		with open(snapshotFile) as f:
+			snapshot = json.load(f)
+	except ValueError:
+		return {}
+	if snapshot.get('version') != pmidSnapshotVersion:
+		return {}
+	return snapshot['files']
+
+def savePMIDSnapshot(snapshotFile,files):
+	tempFile = snapshotFile + '.tmp'
+	with open(tempFile,'w') as f:
+		json.dump({'version':pmidSnapshotVersion, 'files':files},f)
+	os.replace(tempFile,snapshotFile)
+
+def summarizePMIDs(pmids):
+	return [ len(pmids), hashlib.md5(pmids.tobytes()).hexdigest() ]
+
+# Phase 5: Writes out a binary PMID list for each Pubmed file. Only the lists that differ from the last
+# run are written (so an unchanged file keeps its timestamp and isn't converted again). Returns the
+# number of lists written
+def writePMIDLists(outPMIDDir,pubmedXMLFiles,filenameToPMIDs):
 	if not os.path.isdir(outPMIDDir):
 		os.makedirs(outPMIDDir)
 
-	for filename in pubmedXMLFiles:
+	snapshotFile = getPMIDSnapshotFile(outPMIDDir)
+	previousSnapshot = loadPMIDSnapshot(snapshotFile)
+
+	snapshot = {}
+	written = 0
+	for fileIndex,filename in enumerate(pubmedXMLFiles):
 		basename = os.path.basename(filename)
 		outName = os.path.join(outPMIDDir,basename+'.pmids')
 
-		#pmids = [ pmid for pmid,f in enumerate(pmidToFilename) if f == filename ]
-		pmids = filenameToPMIDs[filename]
+		pmids = filenameToPMIDs[fileIndex]
+		snapshot[basename] = summarizePMIDs(pmids)
+
+		if os.path.isfile(outName):
+			if basename in previousSnapshot:
+				if previousSnapshot[basename] == snapshot[basename]:
+					continue
+			elif loadPMIDList(outName) == pmids:
+				# Written before there was a snapshot
+				continue
+
+		writePMIDList(outName,pmids)
+		written += 1
+
+	savePMIDSnapshot(snapshotFile,snapshot)
+	print("  %d of %d PMID lists changed" % (written,len(pubmedXMLFiles)))
+	return written
+
+# The stamp records what the PMID lists were last generated from: the digest of the hash directory's
+# manifest (or of its listing if it doesn't have one), which hashes were used and the excluded PMIDs
+def getStampFile(outPMIDDir):
+	return outPMIDDir.rstrip('/') + '.stamp.json'
+
+def getHashDirDigest(inHashDir):
+	manifestDigest = getHashManifestDigest(inHashDir)
+	if manifestDigest is not None:
+		return manifestDigest
+
+	listing = sorted( (entry.name,entry.stat().st_size,entry.stat().st_mtime) for entry in os.scandir(inHashDir) )
+	return 'listing:' + hashlib.sha256(json.dumps(listing).encode('utf8')).hexdigest()
+
+def getExclusionsDigest(pmidExclusions):
+	if pmidExclusions is None:
+		return None
+	return hashlib.sha256(array.array('I', sorted(pmidExclusions)).tobytes()).hexdigest()
+
+def makeStamp(inHashDir,whichHashes,pmidExclusions):
+	return {'hashes':getHashDirDigest(inHashDir), 'whichHashes':whichHashes, 'exclusions':getExclusionsDigest(pmidExclusions)}
+
+def loadStamp(stampFile):
+	if not os.path.isfile(stampFile):
+		return None
+	try:
+		with open(stampFile) as f:
+			return json.load(f)
+	except ValueError:
+		return None
+
+def saveStamp(stampFile,stamp):
+	tempFile = stampFile + '.tmp'
+	with open(tempFile,'w') as f:
+		json.dump(stamp,f)
+	os.replace(tempFile,stampFile)
+
+# Times each phase of gatherPMIDs
+class PhaseTimer:
+	def __init__(self):
+		self.timings = OrderedDict()
+		self.phase,self.start = None,None
+
+	def next(self,phase):
+		self.stop()
+		self.phase,self.start = phase,time.time()
+
+	def stop(self):
+		if self.phase is not None:
+			self.timings[self.phase] = time.time() - self.start
+			print("  %s: %.1fs" % (self.phase,self.timings[self.phase]))
+		self.phase,self.start = None,None
+
+# All the per-PMID information is kept in arrays indexed by PMID (instead of Python lists
+# and dictionaries) so that a full Pubmed run stays at a few hundred MB. Each hash file is
+# only decoded once, and cached in cacheDir (default: next to outPMIDDir) for future runs.
+# Returns the time taken by each phase
+def gatherPMIDs(inHashDir,outPMIDDir,whichHashes=None,pmidExclusions=None,cacheDir=None):
+	# Nothing needs doing if the hashes, the choice of hashes and the exclusions are all the same as last time
+	stampFile = getStampFile(outPMIDDir)
+	stamp = makeStamp(inHashDir,whichHashes,pmidExclusions)
+	if os.path.isdir(outPMIDDir) and loadStamp(stampFile) == stamp:
+		print("No PMID update necessary")
+		return
+
+	if cacheDir is None:
+		cacheDir = outPMIDDir.rstrip('/') + '.ingested'
+
+	hashFiles = sorted([ os.path.join(inHashDir,f) for f in os.listdir(inHashDir) ])
+	assert len(hashFiles) < NOFILE, "Too many Pubmed hash files (%d) to track" % len(hashFiles)
+
+	timer = PhaseTimer()
+
+	timer.next('Ingesting hash files')
+	ingestedFiles,pubmedXMLFiles,maxPmidInt = ingestHashFiles(hashFiles,whichHashes,cacheDir)
+
+	timer.next('Counting PMID versions')
+	firstFile,versionCounts = countPMIDVersions(ingestedFiles,maxPmidInt)
+
+	timer.next('Choosing latest PMID versions')
+	pmidToFileIndex = chooseLatestVersions(ingestedFiles,firstFile,versionCounts)
+	firstFile = None
+
+	if not pmidExclusions is None:
+		timer.next('Excluding PMIDs')
+		excludePMIDs(versionCounts,pmidExclusions)
+
+	timer.next('Grouping PMIDs by file')
+	filenameToPMIDs = groupPMIDsByFile(pmidToFileIndex,versionCounts,len(pubmedXMLFiles))
+	pmidToFileIndex,versionCounts = None,None
 
-		if not pmidExclusions is None:
-			pmids = [ pmid for pmid in pmids if not pmid in pmidExclusions ]
-		
-		fileAlreadyExists = os.path.isfile(outName)
-		if fileAlreadyExists:
-			timestamp = os.path.getmtime(outName)
-			beforeHash = pubrunner.calcSHA256(outName)
+	timer.next('Writing PMID lists')
+	writePMIDLists(outPMIDDir,pubmedXMLFiles,filenameToPMIDs)
 
-		with open(outName,'w') as f:
-			for pmid in pmids:
-				f.write("%d\n" % pmid)
+	timer.stop()
+
+	saveStamp(stampFile,stamp)
 
-		if fileAlreadyExists:
-			afterHash = pubrunner.calcSHA256(outName)
-			if beforeHash == afterHash: # File hasn't changed so move the modified date back
-				os.utime(outName,(timestamp,timestamp))
 
-	#memReport(locals())
+	return timer.timings
 
 def main():
 	parser = argparse.ArgumentParser('Use a set of Pubmed hashes to generate the list of PMIDs that should be processed for each file')
 	parser.add_argument('--hashDir',required=True,type=str,help='Directory containing hash JSON files')
 	parser.add_argument('--whichHashes',type=str,help='Comma-delimited list of which hashes to use')
 	parser.add_argument('--outDir',required=True,type=str,help='Directory to output PMID lists')
+	parser.add_argument('--cacheDir',type=str,help='Directory to cache the decoded hash files in (default: next to outDir)')
 	args = parser.parse_args()
 
 	if args.whichHashes:
@@ -275,7 +352,7 @@ def main():
 	else:
 		whichHashes = None
 
-	gatherPMIDs(args.hashDir,args.outDir,whichHashes)
+	gatherPMIDs(args.hashDir,args.outDir,whichHashes,cacheDir=args.cacheDir)
 
 
 
@@ -4,7 +4,6 @@ import os
 import git
 import shutil
 import yaml
-import wget
 import gzip
 import hashlib
 import six
@@ -16,9 +15,76 @@ import requests
 import datetime
 import time
 import re
+import queue
+import threading
+import concurrent.futures
+import sqlite3
+import mmap
+import multiprocessing
+from contextlib import closing
+from pubrunner.archive import buildArchiveIndex,hasArchiveIndex
+import pubrunner.executor
+from pubrunner.snakemake import getLocalResources
+from pubrunner.pubmed_hash import planPubmedHashes,saveHashManifest
+
+# Digests of files that have already been hashed, keyed on (path, size, mtime, inode). Set to None to disable
+sha256CachePath = os.path.join(os.path.expanduser("~"),'.pubrunner.sha256cache')
+
+# Files modified this recently aren't added to the cache, as a quick rewrite could leave the size and mtime the same
+sha256CacheRacyWindow = 2
+
+def openSHA256Cache():
+	db = sqlite3.connect(sha256CachePath, timeout=30)
+	db.execute("CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, sha256 TEXT)")
+	return db
+
+def getCachedSHA256(path,stat):
+	try:
+		with closing(openSHA256Cache()) as db:
+			row = db.execute("SELECT sha256 FROM digests WHERE path=? AND size=? AND mtime=? AND inode=?", (path,stat.st_size,stat.st_mtime_ns,stat.st_ino)).fetchone()
+		return row[0] if row else None
+	except sqlite3.Error:
+		return None
+
+def setCachedSHA256(path,stat,digest):
+	try:
+		with closing(openSHA256Cache()) as db, db:
+			db.execute("INSERT OR REPLACE INTO digests VALUES (?,?,?,?,?)", (path,stat.st_size,stat.st_mtime_ns,stat.st_ino,digest))
+	except sqlite3.Error:
+		pass
+
+# Feeds a file into a hash object in fixed-size blocks (or through a memory map)
+def updateHashFromFile(hasher,filename,bufferSize=1024*1024,useMmap=False):
+	with open(filename,'rb') as f:
+		if useMmap and os.fstat(f.fileno()).st_size > 0:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				hasher.update(data)
+		else:
+			buffer = bytearray(bufferSize)
+			view = memoryview(buffer)
+			while True:
+				length = f.readinto(buffer)
+				if length == 0:
+					break
+				hasher.update(view[:length])
+	return hasher
+
+def calcSHA256(filename,useCache=True,useMmap=False):
+	path = os.path.abspath(filename)
+	stat = os.stat(path)
+
+	useCache = useCache and sha256CachePath is not None
+	if useCache:
+		digest = getCachedSHA256(path,stat)
+		if digest is not None:
+			return digest
+
+	digest = updateHashFromFile(hashlib.sha256(),path,useMmap=useMmap).hexdigest()
+
+	if useCache and stat.st_mtime < time.time() - sha256CacheRacyWindow and os.stat(path).st_mtime_ns == stat.st_mtime_ns:
+		setCachedSHA256(path,stat,digest)
 
-def calcSHA256(filename):
-	return hashlib.sha256(open(filename, 'rb').read()).hexdigest()
+	return digest
 
 def checkFileSuffixFilter(filename,fileSuffixFilter):
 	if fileSuffixFilter is None:
@@ -30,111 +96,209 @@ def checkFileSuffixFilter(filename,fileSuffixFilter):
 	else:
 	 	return False
 
-def download(url,out,fileSuffixFilter=None):
+def download(url,out,fileSuffixFilter=None,ftpConnections=4):
 	if url.startswith('ftp'):
 		url = url.replace("ftp://","")
 		hostname = url.split('/')[0]
 		path = "/".join(url.split('/')[1:])
 		#with ftputil.FTPHost(hostname, 'anonymous', 'secret') as host:
-		downloadFTP(path,out,hostname,fileSuffixFilter)
+		downloadFTP(path,out,hostname,fileSuffixFilter,connections=ftpConnections)
 	elif url.startswith('http'):
 		downloadHTTP(url,out,fileSuffixFilter)
 	else:
 		raise RuntimeError("Unsure how to download file. Expecting URL to start with ftp or http. Got: %s" % url)
 
-def downloadFTP(path,out,hostname,fileSuffixFilter=None,tries=10):
-	assert os.path.isdir(out)
+# A bounded pool of FTP connections to a single host that can be shared between threads. Connections
+# are opened when first needed and a connection that hit an error is thrown away (instead of reused)
+class FTPConnectionPool:
+	def __init__(self,hostname,size):
+		self.hostname = hostname
+		self.size = size
+		self.idle = queue.LifoQueue()
+		self.slots = threading.BoundedSemaphore(size)
+
+	def acquire(self):
+		self.slots.acquire()
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			pass
 
-	print('downloadFTP(path=%s,out=%s,hostname=%s)' % (path,out,hostname))
-	host = ftputil.FTPHost(hostname, 'anonymous', 'secret')
+		try:
+			return ftputil.FTPHost(self.hostname, 'anonymous', 'secret')
+		except:
+			self.slots.release()
+			raise
 
-	if host.path.isdir(path):
-		root = path
-	else:
-	 	root = None
-	
-	toProcess = [path]
+	def release(self,host):
+		self.idle.put(host)
+		self.slots.release()
+
+	def discard(self,host):
+		try:
+			if not host.closed:
+				host.close()
+		except ftputil.error.FTPError:
+			pass
+		self.slots.release()
 
-	while len(toProcess) > 0:
-		path = toProcess.pop(0)
+	def close(self):
+		while not self.idle.empty():
+			host = self.idle.get_nowait()
+			if not host.closed:
+				host.close()
 
-		success = False
+	# Runs func with a connection from the pool, retrying (with a new connection and exponential backoff) on FTP errors
+	def run(self,func,path,tries=10):
 		for tryNo in range(tries):
 			try:
-				if host.path.isfile(path):
-					print("FILE", path)
-
-					remoteTimestamp = host.path.getmtime(path)
-					
-					doDownload = True
-					if not checkFileSuffixFilter(path,fileSuffixFilter):
-						#print("SKIPPING FOR SUFFIX")
-						doDownload = False
-
-
-					#print("root", root)
-					#print("path", path)
-					#print("out", out)
-					if root:
-						assert path.startswith(root)
-						withoutRoot = path[len(root):].lstrip('/')
-						outFile = os.path.join(out,withoutRoot)
-						#print("withoutRoot",withoutRoot)
-						#print("outFile",outFile)
-					else:
-						outFile = os.path.join(out,host.path.basename(path))
-					#print("outFile", outFile)
-
-					if os.path.isfile(outFile):
-						localTimestamp = os.path.getmtime(outFile)
-						if not remoteTimestamp > localTimestamp:
-							doDownload = False
+				host = self.acquire()
+			except ftputil.error.FTPOSError as e:
+				errinfo = str(e.errno) + ' ' + str(e.strerror)
+				print("Try %d for %s/%s : Unable to connect (%s)" % (tryNo+1,self.hostname,path,errinfo))
+				time.sleep(min(2**(tryNo+1),60))
+				continue
 
-					if outFile.endswith('.gz'):
-						outUnzipped = outFile[:-3]
-						if os.path.isfile(outUnzipped):
-							localTimestamp = os.path.getmtime(outUnzipped)
-							if not remoteTimestamp > localTimestamp:
-								doDownload = False
-
-					# Check whatever subdirectory exists, and make it if needed
-					dirName = os.path.dirname(outFile)
-					if not os.path.isdir(dirName):
-						os.makedirs(dirName)
-
-					if doDownload:
-						print("  Downloading %s" % path)
-						print("path=%s, outFile=%s" % (path,outFile))
-						host.download(path,outFile)
-						os.utime(out,(remoteTimestamp,remoteTimestamp))
-					else:
-						print("  Skipping %s" % path)
-				elif host.path.isdir(path):
-					print("DIR", path)
-					children = [ host.path.join(path,child) for child in host.listdir(path) ]
-
-					toProcess += children
-				else:
-					raise RuntimeError("Path (%s) is not a file or directory" % path)
-				success = True
-				break
+			try:
+				result = func(host)
+				self.release(host)
+				return result
 			except ftputil.error.FTPOSError as e:
 				errinfo = str(e.errno) + ' ' + str(e.strerror)
-				print("Try %d for %s/%s : Received FTPOSError(%s)" % (tryNo+1,hostname,path,errinfo))
-				time.sleep((tryNo+1)*2)
-				if not host.closed:
-					host.close()
-				host = ftputil.FTPHost(hostname, 'anonymous', 'secret')
+				print("Try %d for %s/%s : Received FTPOSError(%s)" % (tryNo+1,self.hostname,path,errinfo))
+				self.discard(host)
+				time.sleep(min(2**(tryNo+1),60))
+			except:
+				self.discard(host)
+				raise
+
+		raise RuntimeError("Unable to download %s" % path)
+
+# Lists a remote directory and gets the timestamps of the files in it (which ftputil caches from the listing)
+def listFTPDirectory(host,path):
+	dirs,files = [],[]
+	for child in host.listdir(path):
+		childPath = host.path.join(path,child)
+		if host.path.isdir(childPath):
+			dirs.append(childPath)
+		elif host.path.isfile(childPath):
+			files.append((childPath,host.path.getmtime(childPath)))
+		else:
+			raise RuntimeError("Path (%s) is not a file or directory" % childPath)
+	return dirs,files
+
+def getFTPOutFile(path,out,root):
+	if root:
+		assert path.startswith(root)
+		withoutRoot = path[len(root):].lstrip('/')
+		return os.path.join(out,withoutRoot)
+	else:
+		return os.path.join(out,path.split('/')[-1])
+
+def needsFTPDownload(path,outFile,remoteTimestamp,fileSuffixFilter):
+	if not checkFileSuffixFilter(path,fileSuffixFilter):
+		return False
+
+	if os.path.isfile(outFile):
+		localTimestamp = os.path.getmtime(outFile)
+		if not remoteTimestamp > localTimestamp:
+			return False
+
+	if outFile.endswith('.gz'):
+		outUnzipped = outFile[:-3]
+		if os.path.isfile(outUnzipped):
+			localTimestamp = os.path.getmtime(outUnzipped)
+			if not remoteTimestamp > localTimestamp:
+				return False
+
+	return True
+
+# Downloads to a temporary file that is renamed into place when complete (so that an interrupted download isn't mistaken
+# for a complete one). Like the HTTP partial downloads, it is kept next to the output directory instead of in the resource
+def downloadFTPFile(host,path,outFile,remoteTimestamp,out):
+	print("  Downloading %s" % path)
+	out = os.path.abspath(out)
+	tempFile = os.path.join(out + '.ftpinfo', os.path.relpath(os.path.abspath(outFile),out) + '.part')
+	if not os.path.isdir(os.path.dirname(tempFile)):
+		os.makedirs(os.path.dirname(tempFile), exist_ok=True)
+	host.download(path,tempFile)
+	os.replace(tempFile,outFile)
+	os.utime(outFile,(remoteTimestamp,remoteTimestamp))
+	return os.path.getsize(outFile)
+
+# Mirrors a remote FTP file or directory tree into out. Directories are listed and files are downloaded
+# concurrently using a pool of up to 'connections' FTP connections
+def downloadFTP(path,out,hostname,fileSuffixFilter=None,tries=10,connections=4):
+	assert os.path.isdir(out)
+	assert connections > 0
+
+	print('downloadFTP(path=%s,out=%s,hostname=%s,connections=%d)' % (path,out,hostname,connections))
+	start = time.time()
+
+	pool = FTPConnectionPool(hostname,connections)
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=connections)
+
+	downloadedCount,downloadedBytes,skippedCount = 0,0,0
+	listings,downloads = set(),set()
+	try:
+		def getRoot(host):
+			if host.path.isdir(path):
+				return True
+			elif host.path.isfile(path):
+				return False
+			else:
+				raise RuntimeError("Path (%s) is not a file or directory" % path)
 
-				toProcess.insert(0, path)
+		if pool.run(getRoot,path,tries):
+			root = path
+			listings.add(executor.submit(pool.run, lambda host: listFTPDirectory(host,path), path, tries))
+			filesToCheck = []
+		else:
+			root = None
+			filesToCheck = [ (path,pool.run(lambda host: host.path.getmtime(path),path,tries)) ]
 
+		while True:
+			for filePath,remoteTimestamp in filesToCheck:
+				outFile = getFTPOutFile(filePath,out,root)
 
+				# Check whatever subdirectory exists, and make it if needed
+				dirName = os.path.dirname(outFile)
+				if not os.path.isdir(dirName):
+					os.makedirs(dirName)
 
-		if not success:
-			raise RuntimeError("Unable to download %s" % path)
+				if needsFTPDownload(filePath,outFile,remoteTimestamp,fileSuffixFilter):
+					task = lambda host,filePath=filePath,outFile=outFile,remoteTimestamp=remoteTimestamp: downloadFTPFile(host,filePath,outFile,remoteTimestamp,out)
+					downloads.add(executor.submit(pool.run, task, filePath, tries))
+				else:
+					print("  Skipping %s" % filePath)
+					skippedCount += 1
+			filesToCheck = []
 
-	if not host.closed:
-		host.close()
+			if len(listings) == 0 and len(downloads) == 0:
+				break
+
+			done,_ = concurrent.futures.wait(listings | downloads, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				if future in listings:
+					listings.remove(future)
+					dirs,files = future.result()
+					for dirPath in dirs:
+						listings.add(executor.submit(pool.run, lambda host,dirPath=dirPath: listFTPDirectory(host,dirPath), dirPath, tries))
+					filesToCheck += files
+				else:
+					downloads.remove(future)
+					downloadedBytes += future.result()
+					downloadedCount += 1
+	finally:
+		# If stopping early (e.g. after an error), cancel whatever hasn't started yet and wait for the rest
+		for future in listings | downloads:
+			future.cancel()
+		executor.shutdown(wait=True)
+		pool.close()
+
+	elapsed = time.time() - start
+	megabytes = downloadedBytes / (1024*1024)
+	print("Downloaded %d files (%.1f MB) in %.1fs (%.2f MB/s), skipped %d files" % (downloadedCount,megabytes,elapsed,megabytes/max(elapsed,0.001),skippedCount))
 
 def downloadFTP_old(path,out,hostname,fileSuffixFilter=None,tries=10):
 	host = ftputil.FTPHost(hostname, 'anonymous', 'secret')
@@ -199,7 +363,44 @@ def downloadFTP_old(path,out,hostname,fileSuffixFilter=None,tries=10):
 	if not success:
 		raise RuntimeError("Unable to download %s" % path)
 
-def downloadHTTP(url,out,fileSuffixFilter=None):
+# Information about a downloaded file (the validators from the server and the SHA-256 of the content)
+# is kept in a sidecar file so that later downloads can make conditional or range requests. These and
+# any partial downloads are kept next to the output directory (so they don't get mixed up with the resource)
+def getHTTPStateFiles(outFile):
+	outFile = os.path.abspath(outFile)
+	stateDir = os.path.dirname(outFile) + '.httpinfo'
+	if not os.path.isdir(stateDir):
+		os.makedirs(stateDir)
+	basename = os.path.basename(outFile)
+	infoFile = os.path.join(stateDir, basename + '.json')
+	partFile = os.path.join(stateDir, basename + '.part')
+	partInfoFile = partFile + '.json'
+	return infoFile,partFile,partInfoFile
+
+def loadHTTPInfo(infoFile):
+	if not os.path.isfile(infoFile):
+		return {}
+	with open(infoFile) as f:
+		return json.load(f)
+
+def saveHTTPInfo(infoFile,info):
+	tempFile = infoFile + '.tmp'
+	with open(tempFile,'w') as f:
+		json.dump(info,f)
+	os.replace(tempFile,infoFile)
+
+def removeHTTPPartFiles(partFile,partInfoFile):
+	for filename in [partFile,partInfoFile]:
+		if os.path.isfile(filename):
+			os.unlink(filename)
+
+def getHTTPValidators(response):
+	return {'etag':response.headers.get('ETag'), 'lastModified':response.headers.get('Last-Modified')}
+
+# Downloads a file over HTTP. An existing file is only fetched again if the server says it has changed
+# (using ETag/If-Modified-Since) and an interrupted download is resumed from the partial file (using Range).
+# The SHA-256 of the content is calculated as it is streamed to disk
+def downloadHTTP(url,out,fileSuffixFilter=None,chunkSize=1024*1024,timeout=60):
 	print("downloadHTTP(url=%s, out=%s)" % (url, out))
 
 	if os.path.isdir(out):
@@ -211,18 +412,74 @@ def downloadHTTP(url,out,fileSuffixFilter=None):
 	if not checkFileSuffixFilter(url,fileSuffixFilter):
 		return
 
+	infoFile,partFile,partInfoFile = getHTTPStateFiles(outFile)
+
 	fileAlreadyExists = os.path.isfile(outFile)
+	info = loadHTTPInfo(infoFile) if fileAlreadyExists else {}
+	if info.get('url') != url:
+		info = {}
+
+	conditionalHeaders = {}
+	if info.get('etag'):
+		conditionalHeaders['If-None-Match'] = info['etag']
+	if info.get('lastModified'):
+		conditionalHeaders['If-Modified-Since'] = info['lastModified']
+
+	# Resume a partial download, as long as the file on the server is the same one that it came from. If the
+	# server won't resume from it (e.g. the partial file is already complete), it is thrown away and the
+	# whole file is downloaded again
+	for _ in range(2):
+		headers = dict(conditionalHeaders)
+		partInfo = loadHTTPInfo(partInfoFile) if os.path.isfile(partFile) else {}
+		validator = partInfo.get('etag') or partInfo.get('lastModified')
+		resuming = partInfo.get('url') == url and validator
+		if resuming:
+			headers['Range'] = 'bytes=%d-' % os.path.getsize(partFile)
+			headers['If-Range'] = validator
+
+		with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+			if response.status_code == 304:
+				print("  Skipping %s (not modified)" % url)
+				return
+
+			contentRange = response.headers.get('Content-Range','')
+			rangeMatches = resuming and contentRange.startswith('bytes %d-' % os.path.getsize(partFile))
+			if resuming and (response.status_code == 416 or (response.status_code == 206 and not rangeMatches)):
+				print("  Unable to resume %s (%d response) so starting again" % (url,response.status_code))
+				removeHTTPPartFiles(partFile,partInfoFile)
+				continue
+			response.raise_for_status()
+
+			sha256 = hashlib.sha256()
+			if response.status_code == 206 and rangeMatches:
+				print("  Resuming %s from byte %d" % (url,os.path.getsize(partFile)))
+				updateHashFromFile(sha256,partFile,chunkSize)
+				mode = 'ab'
+			elif response.status_code == 200:
+				mode = 'wb'
+			else:
+				raise RuntimeError("Unexpected response (%d) when downloading %s" % (response.status_code,url))
+
+			validators = getHTTPValidators(response)
+			saveHTTPInfo(partInfoFile,dict(url=url,**validators))
 
+			with open(partFile,mode) as f:
+				for block in response.iter_content(chunk_size=chunkSize):
+					f.write(block)
+					sha256.update(block)
+		break
+
+	afterHash = sha256.hexdigest()
 	if fileAlreadyExists:
 		timestamp = os.path.getmtime(outFile)
-		beforeHash = pubrunner.calcSHA256(outFile)
-		os.unlink(outFile)
+		beforeHash = info['sha256'] if 'sha256' in info else pubrunner.calcSHA256(outFile)
 
-	wget.download(url,outFile,bar=None)
-	if fileAlreadyExists:
-		afterHash = pubrunner.calcSHA256(outFile)
-		if beforeHash == afterHash: # File hasn't changed so move the modified date back
-			os.utime(outFile,(timestamp,timestamp))
+	os.replace(partFile,outFile)
+	os.unlink(partInfoFile)
+	saveHTTPInfo(infoFile,dict(url=url,sha256=afterHash,**validators))
+
+	if fileAlreadyExists and beforeHash == afterHash: # File hasn't changed so move the modified date back
+		os.utime(outFile,(timestamp,timestamp))
 
 def downloadZenodo(recordNumber,outputDirectory):
 	print("downloadZenodo(recordNumber=%s, outputDirectory=%s)" % (str(recordNumber), outputDirectory))
@@ -258,12 +515,136 @@ def downloadZenodo(recordNumber,outputDirectory):
 
 def gunzip(source,dest,deleteSource=False):
 	timestamp = os.path.getmtime(source)
-	with gzip.open(source, 'rb') as f_in, open(dest, 'wb') as f_out:
-		shutil.copyfileobj(f_in, f_out)
+	tempDest = dest + '.tmp'
+	with gzip.open(source, 'rb') as f_in, open(tempDest, 'wb') as f_out:
+		shutil.copyfileobj(f_in, f_out, 1024*1024)
+	os.replace(tempDest,dest)
 	os.utime(dest,(timestamp,timestamp))
 
 	if deleteSource:
 		os.unlink(source)
+
+def isTarArchive(filename):
+	return filename.endswith('.tar.gz') or filename.endswith('.tgz')
+
+def getUncompressedTarName(filename):
+	return filename[:-3] if filename.endswith('.tar.gz') else filename[:-4] + '.tar'
+
+# Extracts the files from a tar archive (streaming through it once) but only the ones that match the suffix filter
+def untar(source,destDir,fileSuffixFilter=None):
+	destDir = os.path.abspath(destDir)
+	extractedCount = 0
+	with tarfile.open(source, "r|gz") as tar:
+		for member in tar:
+			if not member.isfile():
+				continue
+			if not fileSuffixFilter is None and not member.name.endswith(fileSuffixFilter):
+				continue
+
+			dest = os.path.abspath(os.path.join(destDir,member.name))
+			if not dest.startswith(destDir + os.sep):
+				raise RuntimeError("Archive member (%s) in %s would be extracted outside of %s" % (member.name,source,destDir))
+
+			dirName = os.path.dirname(dest)
+			if not os.path.isdir(dirName):
+				os.makedirs(dirName, exist_ok=True)
+
+			tempDest = dest + '.tmp'
+			with tar.extractfile(member) as f_in, open(tempDest, 'wb') as f_out:
+				shutil.copyfileobj(f_in, f_out, 1024*1024)
+			os.replace(tempDest,dest)
+			os.utime(dest,(member.mtime,member.mtime))
+			extractedCount += 1
+
+	return extractedCount
+
+# Run in a separate process to extract one archive. Returns the archive and the number of files written
+def extractArchive(task):
+	archive,destDir,fileSuffixFilter,keepCompressed = task
+	if isTarArchive(archive) and keepCompressed:
+		# Just remove the gzip layer so that members can be read directly from the tar (using its index)
+		tarName = getUncompressedTarName(archive)
+		gunzip(archive,tarName,deleteSource=True)
+		index = buildArchiveIndex(tarName,fileSuffixFilter)
+		extractedCount = len(index['members'])
+	elif isTarArchive(archive):
+		extractedCount = untar(archive,destDir,fileSuffixFilter)
+
+		# The tar archive itself doesn't match the filter so would have been removed anyway
+		if not fileSuffixFilter is None:
+			os.unlink(archive)
+	else:
+		unzippedName = archive[:-3]
+		if fileSuffixFilter is None or unzippedName.endswith(fileSuffixFilter):
+			gunzip(archive, unzippedName)
+			extractedCount = 1
+		else:
+			extractedCount = 0
+		os.unlink(archive)
+
+	return archive,extractedCount
+
+# Extracts the .gz and .tar.gz archives in a resource directory using a pool of processes. Archives
+# are skipped if they have already been extracted (the unzipped file is at least as new for a .gz file,
+# and the extraction manifest has the same timestamp for a tar archive). With keepCompressed, .gz files
+# are left as they are and tar archives are only decompressed to a single indexed .tar file
+def extractArchives(resourceDir,fileSuffixFilter=None,processes=None,keepCompressed=False):
+	manifestFile = resourceDir.rstrip('/') + '.extracted.json'
+	manifest = {}
+	if os.path.isfile(manifestFile):
+		with open(manifestFile) as f:
+			manifest = json.load(f)
+
+	tasks,timestamps = [],{}
+	for filename in sorted(os.listdir(resourceDir)):
+		archive = os.path.join(resourceDir,filename)
+		if keepCompressed and isTarArchive(filename):
+			tarName = getUncompressedTarName(archive)
+			if os.path.isfile(tarName) and os.path.getmtime(tarName) >= os.path.getmtime(archive) and hasArchiveIndex(tarName):
+				print("  Skipping %s (already decompressed)" % filename)
+				os.unlink(archive)
+				continue
+		elif keepCompressed and filename.endswith('.gz'):
+			if not fileSuffixFilter is None and not archive[:-3].endswith(fileSuffixFilter):
+				os.unlink(archive)
+			continue
+		elif isTarArchive(filename):
+			timestamps[archive] = os.path.getmtime(archive)
+			if manifest.get(filename) == timestamps[archive]:
+				print("  Skipping %s (already extracted)" % filename)
+				if not fileSuffixFilter is None:
+					os.unlink(archive)
+				continue
+		elif filename.endswith('.gz'):
+			unzippedName = archive[:-3]
+			if os.path.isfile(unzippedName) and os.path.getmtime(unzippedName) >= os.path.getmtime(archive):
+				print("  Skipping %s (already extracted)" % filename)
+				os.unlink(archive)
+				continue
+		else:
+			continue
+		tasks.append((archive,resourceDir,fileSuffixFilter,keepCompressed))
+
+	if len(tasks) == 0:
+		return
+
+	processes = min(processes if processes else multiprocessing.cpu_count(), len(tasks))
+	pool = multiprocessing.Pool(processes)
+	try:
+		for archive,extractedCount in pool.imap_unordered(extractArchive,tasks):
+			print("  Extracted %d files from %s" % (extractedCount,os.path.basename(archive)))
+			if archive in timestamps:
+				manifest[os.path.basename(archive)] = timestamps[archive]
+				tempManifestFile = manifestFile + '.tmp'
+				with open(tempManifestFile,'w') as f:
+					json.dump(manifest,f,indent=2,sort_keys=True)
+				os.replace(tempManifestFile,manifestFile)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
 	
 # https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
 def chunks(l, n):
@@ -272,9 +653,41 @@ def chunks(l, n):
 		yield l[i:i + n]
 
 
-def generatePubmedHashes(inDir,outDir):
+def generatePubmedHashes(inDir,outDir,batchSize=20,processes=4):
+	inAndOut,manifestFiles = planPubmedHashes(inDir,outDir)
+	print("  %d Pubmed files need hashing" % len(inAndOut))
+
+	if len(inAndOut) > 0:
+		for _,outFile in inAndOut:
+			if not os.path.isdir(os.path.dirname(outFile)):
+				os.makedirs(os.path.dirname(outFile))
+
+		if pubrunner.executor.useBuiltinExecutor():
+			pubrunner.executor.runPubmedHashes(inAndOut)
+		else:
+			runPubmedHashesWithSnakemake(inAndOut,outDir,batchSize,processes)
+
+	# Only recorded once all the hashing has succeeded
+	saveHashManifest(outDir,manifestFiles)
+
+def runPubmedHashesWithSnakemake(inAndOut,outDir,batchSize,processes):
+	# Each batch becomes one Snakemake job that hashes its files with multiple processes
+	batchDir = outDir.rstrip('/') + '.BATCHES'
+	if os.path.isdir(batchDir):
+		shutil.rmtree(batchDir)
+	os.makedirs(batchDir)
+	for i,batch in enumerate(chunks(inAndOut,batchSize)):
+		with open(os.path.join(batchDir,'batch.%08d.json' % i),'w') as f:
+			json.dump(batch,f)
+
+	globalSettings = pubrunner.getGlobalSettings()
+	if not "cluster" in globalSettings:
+		# Keep the processes for one batch within what can be run locally
+		cores,memory,jobMemory = getLocalResources(globalSettings)
+		processes = min(processes,cores) if memory is None else min(processes,cores,memory // jobMemory)
+
 	snakeFile = os.path.join(pubrunner.__path__[0],'Snakefiles','PubmedHashes.py')
-	parameters = {'INDIR':inDir,'OUTDIR':outDir}
+	parameters = {'BATCHDIR':batchDir,'HASHPROCESSES':str(max(1,processes))}
 	pubrunner.launchSnakemake(snakeFile,parameters=parameters)
 	
 def getResourceInfo(resource):
@@ -344,6 +757,8 @@ def getResource(resource):
 		else:
 			fileSuffixFilter = None
 
+		ftpConnections = resourceInfo['ftpConnections'] if 'ftpConnections' in resourceInfo else 4
+
 		if not os.path.isdir(thisResourceDir):
 			print("  Creating directory...")
 			os.makedirs(thisResourceDir)
@@ -351,21 +766,14 @@ def getResource(resource):
 		print("  Starting download...")
 		for url in urls:
 			assert isinstance(url,six.string_types), 'Each URL for the dir resource must be a string'
-			download(url,thisResourceDir,fileSuffixFilter)
-
-		if 'unzip' in resourceInfo and resourceInfo['unzip'] == True:
-			print("  Unzipping archives...")
-			for filename in os.listdir(thisResourceDir):
-				print("FOUND", filename)
-				if filename.endswith('.tar.gz') or filename.endswith('.tgz'):
-					tar = tarfile.open(os.path.join(thisResourceDir,filename), "r:gz")
-					tar.extractall(thisResourceDir)
-					tar.close()
-				elif filename.endswith('.gz'):
-					unzippedName = filename[:-3]
-					gunzip(os.path.join(thisResourceDir,filename), os.path.join(thisResourceDir,unzippedName), deleteSource=True)
-
-		if not fileSuffixFilter is None:
+			download(url,thisResourceDir,fileSuffixFilter,ftpConnections)
+
+		keepCompressed = 'keepCompressed' in resourceInfo and resourceInfo['keepCompressed'] == True
+		if keepCompressed or ('unzip' in resourceInfo and resourceInfo['unzip'] == True):
+			print("  Unzipping archives..." if not keepCompressed else "  Indexing archives...")
+			unzipProcesses = resourceInfo['unzipProcesses'] if 'unzipProcesses' in resourceInfo else None
+			extractArchives(thisResourceDir,fileSuffixFilter,unzipProcesses,keepCompressed)
+		elif not fileSuffixFilter is None:
 			print("  Removing files not matching filter (%s)..." % fileSuffixFilter)
 			for root, subdirs, files in os.walk(thisResourceDir):
 				for f in files:
@@ -379,7 +787,9 @@ def getResource(resource):
 			if not os.path.isdir(hashDir):
 				os.makedirs(hashDir)
 
-			generatePubmedHashes(thisResourceDir,hashDir)
+			hashBatchSize = resourceInfo['hashBatchSize'] if 'hashBatchSize' in resourceInfo else 20
+			hashProcesses = resourceInfo['hashProcesses'] if 'hashProcesses' in resourceInfo else 4
+			generatePubmedHashes(thisResourceDir,hashDir,hashBatchSize,hashProcesses)
 
 		#generateFileListing(thisResourceDir)
 
@@ -0,0 +1,117 @@
+import os
+import re
+import sys
+import mmap
+import array
+import struct
+import bisect
+
+# Binary PMID list layout (all integers little-endian):
+#   magic (8 bytes), format version (uint32), PMID count (uint32)
+#   then the PMIDs as a sorted uint32 array
+# PMID lists from older versions are text files with one PMID per line, which can still be read
+pmidListMagic = b'PRPMIDS\x00'
+pmidListVersion = 1
+pmidListHeader = struct.Struct('<8sII')
+
+def writePMIDList(filename,pmids):
+	pmids = array.array('I', pmids)
+	if sys.byteorder != 'little':
+		pmids.byteswap()
+
+	tempName = filename + '.tmp'
+	with open(tempName,'wb') as f:
+		f.write(pmidListHeader.pack(pmidListMagic,pmidListVersion,len(pmids)))
+		pmids.tofile(f)
+	os.replace(tempName,filename)
+
+def isBinaryPMIDList(filename):
+	with open(filename,'rb') as f:
+		return f.read(len(pmidListMagic)) == pmidListMagic
+
+def readPMIDListHeader(f):
+	magic,version,count = pmidListHeader.unpack(f.read(pmidListHeader.size))
+	assert magic == pmidListMagic, "Not a binary PMID list"
+	assert version == pmidListVersion, "Unsupported PMID list version (%d)" % version
+	return count
+
+# Loads the sorted PMIDs from a PMID list (in either format) into an array
+def loadPMIDList(filename):
+	if isBinaryPMIDList(filename):
+		with open(filename,'rb') as f:
+			count = readPMIDListHeader(f)
+			pmids = array.array('I')
+			pmids.fromfile(f,count)
+		if sys.byteorder != 'little':
+			pmids.byteswap()
+		return pmids
+	else:
+		with open(filename) as f:
+			return array.array('I', sorted( int(line) for line in f if line.strip() ))
+
+# Document IDs given as text must be all ASCII digits to be a PMID (str.isdigit also accepts others, e.g. '²')
+pmidPattern = re.compile('[0-9]+')
+
+# The set of PMIDs from a PMID list for filtering documents. A binary list is memory-mapped so nothing
+# is built per PMID, and membership is checked with a binary search of the sorted PMIDs. Document IDs
+# can be given as text or integers
+class PMIDFilter:
+	def __init__(self,filename):
+		self.mm = None
+		if isBinaryPMIDList(filename) and sys.byteorder == 'little':
+			with open(filename,'rb') as f:
+				count = readPMIDListHeader(f)
+				if count > 0:
+					self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			self.pmids = memoryview(self.mm)[pmidListHeader.size:].cast('I') if self.mm else array.array('I')
+		else:
+			self.pmids = loadPMIDList(filename)
+
+		self.minPmid = self.pmids[0] if len(self.pmids) > 0 else None
+		self.maxPmid = self.pmids[-1] if len(self.pmids) > 0 else None
+
+	def __len__(self):
+		return len(self.pmids)
+
+	def __contains__(self,pmid):
+		if isinstance(pmid,str):
+			if pmidPattern.fullmatch(pmid) is None:
+				return False
+			pmid = int(pmid)
+		elif not isinstance(pmid,int):
+			# e.g. a document without an ID
+			return False
+
+		if self.minPmid is None or pmid < self.minPmid or pmid > self.maxPmid:
+			return False
+		i = bisect.bisect_left(self.pmids,pmid)
+		return self.pmids[i] == pmid
+
+	def close(self):
+		if self.mm is not None:
+			self.pmids.release()
+			self.mm.close()
+			self.mm = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+# Opens an ID filter file for convertFiles. The PMID lists from gatherPMIDs (binary, or text with one PMID
+# per line from older versions) become a PMIDFilter. Any other text file is a set of the IDs on its lines
+# (e.g. PMC IDs). Either way, document IDs are checked with 'in'
+def openIDFilter(filename):
+	if isBinaryPMIDList(filename):
+		return PMIDFilter(filename)
+
+	with open(filename) as f:
+		ids = set([ line.strip() for line in f ])
+	if all( pmidPattern.fullmatch(id) for id in ids if id != '' ):
+		return PMIDFilter(filename)
+	return ids
+
+def closeIDFilter(idFilter):
+	if isinstance(idFilter,PMIDFilter):
+		idFilter.close()
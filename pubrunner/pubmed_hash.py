@@ -2,8 +2,32 @@ import pubrunner
 import argparse
 import hashlib
 import json
+import mmap
+import struct
+import sys
+import array
+import os
+import multiprocessing
+from pubrunner.archive import openInput,isPlainFile
+from pubrunner.scancache import getCacheFile,saveCacheFile
+from pubrunner.convert import findRawElement,findPubmedArticles,findPubmedArticlesInStream,getFragmentParser,getMedlinePMID,getMedlinePubDate,getMedlineTitle,getMedlineAbstract,getMedlineJournals
 from collections import defaultdict
 
+# The fields of each Pubmed citation that are hashed
+hashFields = ['year','title','abstract','journal','journalISO']
+
+# Binary hash file layout (all integers little-endian):
+#   magic (8 bytes), format version (uint32), header length (uint32)
+#   header: JSON with the hashed fields and a list of Pubmed files (with their PMID count)
+#   padding to a multiple of 16 bytes
+#   then for each Pubmed file: a sorted uint32 PMID column followed by one 16-byte digest
+#   column per field. A field that was missing from the citation is stored as all zeros.
+hashFileMagic = b'PRHASHES'
+hashFileVersion = 1
+hashFilePrefix = struct.Struct('<8sII')
+DIGESTSIZE = 16
+emptyDigest = bytes(DIGESTSIZE)
+
 def md5(text):
 	if text is None:
 		return ''
@@ -16,43 +40,364 @@ def md5(text):
 	m.update(text.encode('utf8'))
 	return m.hexdigest()
 
-def pubmed_hash(pubmedXMLFiles,outHashJSON):
+# Same as md5 but gives the raw digest (which is all zeros for a missing value)
+def md5digest(text):
+	hexDigest = md5(text)
+	return bytes.fromhex(hexDigest) if hexDigest else emptyDigest
+
+def hexToDigest(hexDigest):
+	return bytes.fromhex(hexDigest) if hexDigest else emptyDigest
+
+def digestToHex(digest):
+	return '' if digest == emptyDigest else digest.hex()
+
+def pad(length):
+	return (DIGESTSIZE - length % DIGESTSIZE) % DIGESTSIZE
+
+def writeBinaryHashFile(outHashFile,fields,hashesByFile):
+	header = {'fields':fields, 'files':[]}
+	for pubmedXMLFile,hashes in hashesByFile.items():
+		header['files'].append({'pubmedXMLFile':pubmedXMLFile, 'count':len(hashes)})
+	headerBytes = json.dumps(header).encode('utf8')
+
+	tempFile = outHashFile + '.tmp'
+	with open(tempFile,'wb') as f:
+		prefix = hashFilePrefix.pack(hashFileMagic,hashFileVersion,len(headerBytes))
+		f.write(prefix)
+		f.write(headerBytes)
+		f.write(b'\x00' * pad(len(prefix)+len(headerBytes)))
+
+		for pubmedXMLFile,hashes in hashesByFile.items():
+			pmids = array.array('I', sorted(hashes.keys()))
+			if sys.byteorder != 'little':
+				pmids.byteswap()
+			pmids.tofile(f)
+			f.write(b'\x00' * pad(len(pmids)*pmids.itemsize))
+
+			for field in fields:
+				f.write(b"".join( hashes[pmid][field] for pmid in sorted(hashes.keys()) ))
+	os.replace(tempFile,outHashFile)
+
+# A binary hash file opened with memory mapping. The PMID and digest columns for each Pubmed
+# file are slices of the mapped file so only the parts that are used get read from disk
+class BinaryHashFile:
+	def __init__(self,filename):
+		self.f = open(filename,'rb')
+		self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic,version,headerLength = hashFilePrefix.unpack_from(self.data,0)
+		if magic != hashFileMagic:
+			raise RuntimeError("%s is not a binary Pubmed hash file" % filename)
+		if version != hashFileVersion:
+			raise RuntimeError("%s uses version %d of the Pubmed hash format but only version %d is supported" % (filename,version,hashFileVersion))
+
+		header = json.loads(self.data[hashFilePrefix.size:hashFilePrefix.size+headerLength].decode('utf8'))
+		self.fields = header['fields']
+
+		# Work out where each column starts
+		self.files = []
+		offset = hashFilePrefix.size + headerLength
+		offset += pad(offset)
+		for fileInfo in header['files']:
+			count = fileInfo['count']
+			pmidOffset = offset
+			offset += 4*count
+			offset += pad(offset)
+			digestOffsets = {}
+			for field in self.fields:
+				digestOffsets[field] = offset
+				offset += DIGESTSIZE*count
+			self.files.append((fileInfo['pubmedXMLFile'],count,pmidOffset,digestOffsets))
+
+	def pubmedXMLFiles(self):
+		return [ pubmedXMLFile for pubmedXMLFile,_,_,_ in self.files ]
+
+	def _getFile(self,pubmedXMLFile):
+		for fileInfo in self.files:
+			if fileInfo[0] == pubmedXMLFile:
+				return fileInfo
+		raise RuntimeError("%s is not in the hash file" % pubmedXMLFile)
+
+	# Sorted array of the PMIDs for a Pubmed file
+	def pmids(self,pubmedXMLFile):
+		_,count,pmidOffset,_ = self._getFile(pubmedXMLFile)
+		pmids = array.array('I')
+		pmids.frombytes(self.data[pmidOffset:pmidOffset+4*count])
+		if sys.byteorder != 'little':
+			pmids.byteswap()
+		return pmids
+
+	# The digest column for a field (DIGESTSIZE bytes per PMID, in the same order as the PMIDs)
+	def digests(self,pubmedXMLFile,field):
+		_,count,_,digestOffsets = self._getFile(pubmedXMLFile)
+		if not field in digestOffsets:
+			raise RuntimeError("The selected hash (%s) has not been found in the hash files." % field)
+		offset = digestOffsets[field]
+		return memoryview(self.data)[offset:offset+DIGESTSIZE*count]
+
+	# The same structure as the JSON hash files
+	def toJSON(self):
+		allHashes = {}
+		for pubmedXMLFile in self.pubmedXMLFiles():
+			pmids = self.pmids(pubmedXMLFile)
+			columns = { field:self.digests(pubmedXMLFile,field) for field in self.fields }
+			allHashes[pubmedXMLFile] = { str(pmid):{ field:digestToHex(bytes(columns[field][i*DIGESTSIZE:(i+1)*DIGESTSIZE])) for field in self.fields } for i,pmid in enumerate(pmids) }
+			for column in columns.values():
+				column.release()
+		return allHashes
+
+	def close(self):
+		self.data.close()
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*args):
+		self.close()
+
+def isBinaryHashFile(filename):
+	with open(filename,'rb') as f:
+		return f.read(len(hashFileMagic)) == hashFileMagic
+
+# Loads either format of hash file as {pubmedXMLFile: (pmids, {field: digest column})} with the
+# PMIDs sorted and DIGESTSIZE bytes per PMID in each digest column
+def loadHashColumns(filename):
+	hashColumns = {}
+	if isBinaryHashFile(filename):
+		with BinaryHashFile(filename) as hashFile:
+			for pubmedXMLFile in hashFile.pubmedXMLFiles():
+				pmids = hashFile.pmids(pubmedXMLFile)
+				columns = {}
+				for field in hashFile.fields:
+					column = hashFile.digests(pubmedXMLFile,field)
+					columns[field] = bytes(column)
+					column.release()
+				hashColumns[pubmedXMLFile] = (pmids,columns)
+	else:
+		with open(filename) as f:
+			allHashes = json.load(f)
+		for pubmedXMLFile,hashes in allHashes.items():
+			sortedPmids = sorted(hashes.keys(), key=int)
+			fields = sorted(set( field for pmidHashes in hashes.values() for field in pmidHashes ))
+			pmids = array.array('I', [ int(pmid) for pmid in sortedPmids ])
+			columns = { field:b"".join( hexToDigest(hashes[pmid].get(field,'')) for pmid in sortedPmids ) for field in fields }
+			hashColumns[pubmedXMLFile] = (pmids,columns)
+	return hashColumns
+
+def exportHashFileAsJSON(hashFile,outHashJSON):
+	with BinaryHashFile(hashFile) as f:
+		allHashes = f.toJSON()
+	with open(outHashJSON,'w') as f:
+		json.dump(allHashes,f,indent=2,sort_keys=True)
+
+# Gets the hashes for a Pubmed citation without building the whole document. The hashed fields are
+# extracted with the same functions that processMedlineArticle uses (so they match the converted
+# documents) but the authors, chemicals and MeSH headings are skipped
+def hashMedlineArticle(elem):
+	pmid = getMedlinePMID(elem)
+	pubYear,_,_ = getMedlinePubDate(elem,pmid)
+	journal,journalISO = getMedlineJournals(elem)
+
+	hashes = {}
+	hashes['year'] = md5digest(pubYear)
+	hashes['title'] = md5digest(getMedlineTitle(elem))
+	hashes['abstract'] = md5digest(getMedlineAbstract(elem))
+	hashes['journal'] = md5digest(journal)
+	hashes['journalISO'] = md5digest(journalISO)
+	return int(pmid),hashes
+
+# Cuts a PubmedArticle down to the PMID, Article (without its authors) and History elements so that
+# the rest of it (MeSH headings, chemicals, references, etc) doesn't need to be parsed. The citation's
+# PMID is the one before its Article (as CommentsCorrections later on have PMIDs too)
+def trimMedlineArticle(data,start,end):
+	article = findRawElement(data,b'Article',start,end)
+	pmid = None if article is None else findRawElement(data,b'PMID',start,article[0])
+	if pmid is None:
+		return data[start:end]
+
+	parts = [ b'<PubmedArticle><MedlineCitation>', data[pmid[0]:pmid[1]] ]
+	authorList = findRawElement(data,b'AuthorList',article[0],article[1])
+	if authorList is None:
+		parts.append(data[article[0]:article[1]])
+	else:
+		parts += [ data[article[0]:authorList[0]], data[authorList[1]:article[1]] ]
+	parts.append(b'</MedlineCitation>')
+
+	history = findRawElement(data,b'History',article[1],end)
+	if history:
+		parts += [ b'<PubmedData>', data[history[0]:history[1]], b'</PubmedData>' ]
+	parts.append(b'</PubmedArticle>')
+	return b''.join(parts)
+
+# Hashes PubmedArticle elements given as a block of raw data with the start and end offsets of the element in it
+def hashMedlineArticles(articles,parser):
+	parseFragment = getFragmentParser(parser)
+	for data,start,end in articles:
+		yield hashMedlineArticle(parseFragment(trimMedlineArticle(data,start,end)))
+
+# Hashes each citation in a Pubmed file, which can be plain XML, gzipped XML or a file inside an indexed tar archive
+def hashMedlineFile(pubmedFile,parser='etree'):
+	if isPlainFile(pubmedFile):
+		with open(pubmedFile,'rb') as f:
+			if os.fstat(f.fileno()).st_size == 0:
+				return
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+				articles = ( (mm,start,end) for start,end in findPubmedArticles(mm) )
+				for pmidAndHashes in hashMedlineArticles(articles,parser):
+					yield pmidAndHashes
+	else:
+		with openInput(pubmedFile) as f:
+			for pmidAndHashes in hashMedlineArticles(findPubmedArticlesInStream(f),parser):
+				yield pmidAndHashes
+
+def pubmed_hash(pubmedXMLFiles,outHashFile,outFormat='binary',parser='etree'):
+	assert outFormat in ['binary','json'], "outFormat must be binary or json"
 	if not isinstance(pubmedXMLFiles,list):
 		pubmedXMLFiles = [pubmedXMLFiles]
 
 	allHashes = defaultdict(dict)
 	docCount = 0
 	for f in pubmedXMLFiles:
-		for doc in pubrunner.processMedlineFile(f):
-			pmid = doc['pmid']
-
-			hashes = {}
-			hashes['year'] = md5(doc['pubYear'])
-			hashes['title'] = md5(doc['title'])
-			hashes['abstract'] = md5(doc['abstract'])
-			hashes['journal'] = md5(doc['journal'])
-			hashes['journalISO'] = md5(doc['journalISO'])
-
+		allHashes[f] = {}
+		for pmid,hashes in hashMedlineFile(f,parser):
 			allHashes[f][pmid] = hashes
 			docCount += 1
 
-	with open(outHashJSON,'w') as f:
-		json.dump(allHashes,f,indent=2,sort_keys=True)
+	if outFormat == 'binary':
+		writeBinaryHashFile(outHashFile,hashFields,allHashes)
+	else:
+		jsonHashes = { f:{ str(pmid):{ field:digestToHex(digest) for field,digest in hashes.items() } for pmid,hashes in fileHashes.items() } for f,fileHashes in allHashes.items() }
+		with open(outHashFile,'w') as f:
+			json.dump(jsonHashes,f,indent=2,sort_keys=True)
 
-	print("Hashes for %d documents across %d Pubmed XML files written to %s" % (docCount,len(pubmedXMLFiles),outHashJSON))
+	print("Hashes for %d documents across %d Pubmed XML files written to %s" % (docCount,len(pubmedXMLFiles),outHashFile))
 
-def main():
-	parser = argparse.ArgumentParser(description='Calculate MD5 hashes for the different sections of a Pubmed file. Used to evaluate the Pubmed updates')
-	parser.add_argument('--pubmedXMLFiles',required=True,type=str,help='Comma-delimited Pubmed XML files to calculate hashes for')
-	parser.add_argument('--outHashJSON',required=True,type=str,help='Output file (in JSON format) containing hashes associated with each PMID')
-	args = parser.parse_args()
+def hashPubmedFile(inAndOut):
+	pubmedXMLFile,outHashFile = inAndOut
+	pubmed_hash(pubmedXMLFile,outHashFile)
+	return outHashFile
+
+# Hashes each Pubmed file into its own hash file using a pool of processes
+def hashPubmedFiles(pubmedXMLFiles,outHashFiles,processes=1):
+	assert len(pubmedXMLFiles) == len(outHashFiles), "Must have one output hash file for each Pubmed file"
+	inAndOut = list(zip(pubmedXMLFiles,outHashFiles))
+
+	processes = max(1,min(processes,len(inAndOut)))
+	if processes == 1:
+		for pair in inAndOut:
+			hashPubmedFile(pair)
+	else:
+		# Spawned rather than forked, as this can run inside a Snakemake job process that has other threads
+		with multiprocessing.get_context('spawn').Pool(processes) as pool:
+			for _ in pool.imap_unordered(hashPubmedFile,inAndOut):
+				pass
+
+# The hash manifest is the index of a hash directory. For each Pubmed file (relative to the resource
+# directory) it records the size, mtime and SHA256 digest of the file when it was hashed, along with
+# its hash file (relative to the hash directory). The digest of the whole manifest changes whenever
+# any hash file is added, regenerated or dropped. It is kept with PubRunner's other caches
+hashManifestVersion = 1
+
+def getHashManifestFile(hashDir):
+	return getCacheFile(hashDir,'manifest')
+
+def loadHashManifest(hashDir):
+	manifestFile = getHashManifestFile(hashDir)
+	if not os.path.isfile(manifestFile):
+		return None
+	try:
+		with open(manifestFile) as f:
+			manifest = json.load(f)
+	except ValueError:
+		return None
+	if manifest.get('version') != hashManifestVersion:
+		return None
+	return manifest
+
+# Only depends on the content of the Pubmed files (where known) so that a new timestamp alone doesn't change it
+def calcManifestDigest(files):
+	contents = {}
+	for relativePath,entry in files.items():
+		content = entry['sha256'] if entry['sha256'] is not None else [entry['size'],entry['mtime']]
+		contents[relativePath] = [content,entry['hashFile']]
+	return hashlib.sha256(json.dumps(contents,sort_keys=True).encode('utf8')).hexdigest()
 
-	pubmedXMLFiles = args.pubmedXMLFiles.split(',')
-	pubmed_hash(pubmedXMLFiles,args.outHashJSON)
+# The manifest is only rewritten if something in it has changed
+def saveHashManifest(hashDir,files):
+	manifest = loadHashManifest(hashDir)
+	if manifest is not None and manifest['files'] == files:
+		return
 
+	manifest = {'version':hashManifestVersion, 'digest':calcManifestDigest(files), 'files':files}
+	saveCacheFile(getHashManifestFile(hashDir),manifest,indent=2,sort_keys=True)
 
+# Gets the digest of a hash directory's manifest (or None if it doesn't have one)
+def getHashManifestDigest(hashDir):
+	manifest = loadHashManifest(hashDir)
+	return None if manifest is None else manifest['digest']
 
+# Works out which Pubmed files in inDir need hashing by comparing them with the hash manifest. A file
+# whose size and mtime match its manifest entry is skipped without looking at it or its hash file. A
+# file that has changed is only rehashed if its content digest is different too. Returns the files
+# to hash (paired with their hash file) and the manifest entries to save once they are done
+def planPubmedHashes(inDir,hashDir):
+	from pubrunner.pubrun import findFilesWithStats
+
+	manifest = loadHashManifest(hashDir)
+	previousFiles = {} if manifest is None else manifest['files']
+
+	inputFiles,stats = findFilesWithStats(inDir)
+
+	toHash = []
+	files = {}
+	for f in inputFiles:
+		if not (f.endswith('.xml') or f.endswith('.xml.gz')):
+			continue
+
+		size,mtime = stats[f]
+		relativePath = os.path.relpath(f,inDir)
+		hashFile = f.replace(inDir,hashDir) + '.hashes'
+		entry = {'size':size, 'mtime':mtime, 'sha256':None, 'hashFile':os.path.relpath(hashFile,hashDir)}
+
+		# The hash file is checked too as it could have been removed since the manifest was written
+		previous = previousFiles.get(relativePath)
+		if previous is not None and previous['size'] == size and previous['mtime'] == mtime and os.path.isfile(hashFile):
+			files[relativePath] = previous
+			continue
+
+		if previous is None and manifest is None and os.path.isfile(hashFile) and os.path.getmtime(hashFile) >= mtime:
+			# A hash file from before there was a manifest, which is trusted as it is newer than the Pubmed file
+			files[relativePath] = entry
+			continue
+
+		if isPlainFile(f):
+			entry['sha256'] = pubrunner.calcSHA256(f)
+		if previous is not None and entry['sha256'] is not None and previous['sha256'] == entry['sha256'] and os.path.isfile(hashFile):
+			# Only the timestamp has changed (e.g. the same file was downloaded again)
+			files[relativePath] = entry
+			continue
+
+		toHash.append((f,hashFile))
+		files[relativePath] = entry
+
+	return toHash,files
+
+def main():
+	parser = argparse.ArgumentParser(description='Calculate MD5 hashes for the different sections of a Pubmed file. Used to evaluate the Pubmed updates')
+	parser.add_argument('--pubmedXMLFiles',type=str,help='Comma-delimited Pubmed XML files to calculate hashes for')
+	parser.add_argument('--outHashFile','--outHashJSON',required=True,type=str,help='Output file containing hashes associated with each PMID')
+	parser.add_argument('--outFormat',type=str,default='binary',help='Format of the output file (binary/json)')
+	parser.add_argument('--parser',type=str,default='etree',help='XML parser to use (etree/lxml)')
+	parser.add_argument('--exportJSON',type=str,help='Binary hash file to export as JSON (for debugging) instead of calculating hashes')
+	args = parser.parse_args()
+
+	if args.exportJSON:
+		exportHashFileAsJSON(args.exportJSON,args.outHashFile)
+	else:
+		assert args.pubmedXMLFiles, "Must provide --pubmedXMLFiles"
+		pubmedXMLFiles = args.pubmedXMLFiles.split(',')
+		pubmed_hash(pubmedXMLFiles,args.outHashFile,args.outFormat,args.parser)
 
 if __name__ == '__main__':
 	main()
-
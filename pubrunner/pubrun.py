@@ -1,4 +1,7 @@
 import pubrunner
+import pubrunner.archive
+import pubrunner.scancache
+import pubrunner.executor
 import os
 import shutil
 import yaml
@@ -10,7 +13,7 @@ import datetime
 import csv
 import atexit
 import codecs
-from collections import defaultdict
+from collections import defaultdict,OrderedDict
 from Bio import Entrez
 import sys
 
@@ -119,6 +122,7 @@ def prepareConversionAndHashingRuns(toolSettings,mode,workingDirectory):
 
 				outDir = nameToUse
 				outFormat = projectSettings["format"]
+				assert outFormat in pubrunner.acceptedOutFormats, "Unknown format (%s) for resource %s. Options are: %s" % (outFormat, resName, "/".join(pubrunner.acceptedOutFormats))
 
 				removePMCOADuplicates = False
 				if "removePMCOADuplicates" in projectSettings and projectSettings["removePMCOADuplicates"] == True:
@@ -223,17 +227,30 @@ def chunks(l, n):
 	for i in range(0, len(l), n):
 		yield l[i:i + n]
 
+# Finds all the files in a directory (using the scan cache) along with their size and timestamp. Tar
+# archives that were kept (with an index) are replaced by the files inside them
+def findFilesWithStats(dirName):
+	allFiles,stats = pubrunner.scancache.findFilesWithStats(dirName)
+
+	archives = [ f for f in allFiles if f.endswith('.tar') and pubrunner.archive.hasArchiveIndex(f) ]
+	if len(archives) > 0:
+		archivesSet = set(archives)
+		allFiles = [ f for f in allFiles if not f in archivesSet ]
+		for archive in archives:
+			members = pubrunner.archive.listArchiveMembers(archive)
+			allFiles += members
+			stats.update( (member,(pubrunner.archive.getsize(member),pubrunner.archive.getmtime(member))) for member in members )
+		allFiles = pubrunner.scancache.sortFiles(allFiles)
+
+	return allFiles,stats
+
+def findFilesWithTimestamps(dirName):
+	allFiles,stats = findFilesWithStats(dirName)
+	timestamps = { path:mtime for path,(size,mtime) in stats.items() }
+	return allFiles,timestamps
+
 def findFiles(dirName):
-	allFiles = []
-	for root, dirs, files in os.walk(dirName):
-		allFiles += [ os.path.join(root,f) for f in files ]
-	
-	# We're going to extract the last set of digits from each filename and sort by that
-	nums = [ re.findall('[0-9]+',f) for f in allFiles ]
-	nums = [ 0 if num == [] else int(num[-1]) for num in nums ]
-	sortedByNum = sorted(list(zip(nums,allFiles)))
-	sortedFilepaths = [ filepath for num,filepath in sortedByNum ]
-	
+	sortedFilepaths,_ = findFilesWithTimestamps(dirName)
 	return sortedFilepaths
 
 class OutputFileNamer:
@@ -266,39 +283,55 @@ def assignFilesForConversion(files, previousAssignmentFile, outDir, outPattern,
 		filesWithUpdates = sorted(filesWithUpdates)
 		files = [ f for lastupdate,f in filesWithUpdates ]
 
-	assignedChunks = {}
+	# Works chunk by chunk (instead of file by file) so that the set operations and slicing do most of the work
+	filesSet = set(files)
+	previouslyAssigned = set()
+	keptChunks = OrderedDict()
+	dirtyOutputFiles = set()
 	for outputFile,chunk in previousAssignmentFile.items():
 		assert isinstance(chunk,list)
-		for f in chunk:
-			assert not f in assignedChunks
-			assignedChunks[f] = outputFile
+		assignedCount = len(previouslyAssigned)
+		previouslyAssigned.update(chunk)
+		assert len(previouslyAssigned) == assignedCount + len(chunk), "Input file assigned to multiple chunks"
 
-	# We'll check if any previous input files have disappeared, and set that chunk to dirty (so it is reprocessed)
-	filesSet = set(files)
-	missingFiles = [ f for f in assignedChunks.keys() if not f in filesSet ]
-	dirtyOutputFiles = set( [ assignedChunks[f] for f in missingFiles ] )
-	for f in missingFiles:
-		del assignedChunks[f]
+		# We'll check if any previous input files have disappeared, and set that chunk to dirty (so it is reprocessed)
+		if filesSet.issuperset(chunk):
+			kept = list(chunk)
+		else:
+			kept = list(filter(filesSet.__contains__, chunk))
+			dirtyOutputFiles.add(outputFile)
+
+		if len(kept) > 0:
+			keptChunks[outputFile] = kept
 
-	if len(assignedChunks) > 0:
+	if len(keptChunks) > 0:
 		# We're just take the last chunk alphabetically
-		currentChunk = sorted(assignedChunks.values())[-1]
-		currentChunkSize = len( [ f for f in assignedChunks.values() if f == currentChunk ] )
+		currentChunk = max(keptChunks.keys())
 	else:
 		currentChunk = None
-		currentChunkSize = 0
+
+	newFilesSet = filesSet.difference(previouslyAssigned)
+	newFiles = list(filter(newFilesSet.__contains__, files)) if len(newFilesSet) > 0 else []
 
 	outputFileNamer = OutputFileNamer(outDir,outPattern)
 
-	for f in files:
-		if not f in assignedChunks:
-			if currentChunk is None or currentChunkSize >= maxChunkSize:
-				currentChunk = outputFileNamer.next()
-				currentChunkSize = 0
-			
-			assignedChunks[f] = currentChunk
-			dirtyOutputFiles.add(currentChunk)
-			currentChunkSize += 1
+	# Top up the current chunk and then start new ones. The new chunk names are only checked against
+	# output files that exist, so a name can be reused for a chunk that still has files
+	currentChunkSize = len(keptChunks[currentChunk]) if currentChunk is not None else 0
+	start = 0
+	while start < len(newFiles):
+		if currentChunk is None or currentChunkSize >= maxChunkSize:
+			currentChunk = outputFileNamer.next()
+			currentChunkSize = 0
+			if not currentChunk in keptChunks:
+				keptChunks[currentChunk] = []
+
+		space = maxChunkSize - currentChunkSize
+		added = newFiles[start:start+space]
+		keptChunks[currentChunk] += added
+		dirtyOutputFiles.add(currentChunk)
+		currentChunkSize += len(added)
+		start += len(added)
 
 	# Remove any dirty files to force them to be recalculated
 	for dirtyOutputFile in dirtyOutputFiles:
@@ -307,8 +340,7 @@ def assignFilesForConversion(files, previousAssignmentFile, outDir, outPattern,
 			print("Removing:", dirtyOutputFile)
 
 	outputFilesWithChunks = defaultdict(list)
-	for f,outputFile in assignedChunks.items():
-		outputFilesWithChunks[outputFile].append(f)
+	outputFilesWithChunks.update(keptChunks)
 
 	return outputFilesWithChunks
 
@@ -398,14 +430,14 @@ def pubrun(directory,doTest,doGetResources,forceresource_dir=None,forceresource_
 				with open(chunksFile,'r') as f:
 					previousChunks = json.load(f)
 
-			allInputFiles = findFiles(inDir)
+			allInputFiles,inputTimestamps = findFilesWithTimestamps(inDir)
 			#timestamps = { f:os.path.getmtime(f) for f in allInputFiles }
-			timestamps = [ os.path.getmtime(f) for f in allInputFiles ]
+			timestamps = [ inputTimestamps[f] for f in allInputFiles ]
 			allInputFiles = sorted(list(zip(timestamps,allInputFiles)))
 			timestampMap = { f:timestamp for timestamp,f in allInputFiles }
 			allInputFiles = [ f for timestamp,f in allInputFiles ]
 
-			outPattern = os.path.basename(inDir).replace('_UNCONVERTED','') + ".%08d." + outFormat
+			outPattern = os.path.basename(inDir).replace('_UNCONVERTED','') + ".%08d." + pubrunner.outputWriters[outFormat].extension
 			newChunks = assignFilesForConversion(allInputFiles, previousChunks, outDir, outPattern, chunkSize)
 
 			with open(chunksFile,'w') as f:
@@ -433,9 +465,10 @@ def pubrun(directory,doTest,doGetResources,forceresource_dir=None,forceresource_
 				if os.path.isdir(pmidChunkDir):
 					shutil.rmtree(pmidChunkDir)
 				os.makedirs(pmidChunkDir)
+				_,pmidTimestamps = findFilesWithTimestamps(pmidDir)
 				for outputfile,inputfiles in newChunks.items():
 					pmidfiles = [ os.path.join(pmidDir, os.path.basename(f) + '.pmids') for f in inputfiles ]
-					latestTimestamp = max( os.path.getmtime(pmidfile) for pmidfile in pmidfiles )
+					latestTimestamp = max( pmidTimestamps[pmidfile] for pmidfile in pmidfiles )
 					pmidChunkFile = os.path.join(pmidChunkDir,os.path.basename(outputfile))
 					with open(pmidChunkFile,'w') as f:
 						json.dump(pmidfiles,f)
@@ -443,8 +476,11 @@ def pubrun(directory,doTest,doGetResources,forceresource_dir=None,forceresource_
 
 				parameters['PMIDCHUNKDIR'] = pmidChunkDir
 
-			convertSnakeFile = os.path.join(pubrunner.__path__[0],'Snakefiles','Convert.py')
-			pubrunner.launchSnakemake(convertSnakeFile,parameters=parameters)
+			if pubrunner.executor.useBuiltinExecutor():
+				pubrunner.executor.runConversions(chunkDir,outDir,inFormat,outFormat,parameters.get('PMIDCHUNKDIR'))
+			else:
+				convertSnakeFile = os.path.join(pubrunner.__path__[0],'Snakefiles','Convert.py')
+				pubrunner.launchSnakemake(convertSnakeFile,parameters=parameters)
 
 	else:
 		print("\nNot getting resources (--nogetresource)")
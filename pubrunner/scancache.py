@@ -0,0 +1,166 @@
+import pubrunner
+import os
+import re
+import json
+import time
+import hashlib
+
+# Persistent cache of directory listings (with the size and mtime of each file) so that large
+# resources (e.g. PMCOA) don't need every directory listed and every filename parsed on each run. A
+# cached listing is reused while the directory's own mtime is unchanged, which holds as long as files
+# are only added, removed or renamed in it. Files can still be modified in place (e.g. in a local
+# resource) without changing the directory's mtime, so the size and mtime of each file are always checked.
+
+scanCacheVersion = 1
+
+# The caches (and other state that PubRunner keeps about a directory) are stored in PubRunner's own
+# resource storage rather than next to the directory, which may be the user's own (maybe read-only)
+# data. Set cacheDir to keep them somewhere else
+cacheDir = None
+
+def getCacheDir():
+	if cacheDir is not None:
+		return cacheDir
+	globalSettings = pubrunner.getGlobalSettings()
+	return os.path.join(os.path.expanduser(globalSettings["storage"]["resources"]),'.cache')
+
+# The file for one kind of cached information about a directory. It is named after the real path of the
+# directory so that it is found again whichever symlink the directory is reached through
+def getCacheFile(dirName,kind):
+	realPath = os.path.realpath(dirName).rstrip('/')
+	pathDigest = hashlib.sha1(realPath.encode('utf8')).hexdigest()[:16]
+	return os.path.join(getCacheDir(), '%s.%s.%s.json' % (os.path.basename(realPath),pathDigest,kind))
+
+# Writes a cache file as JSON. Failing to write it isn't an error as it only means the work is done again next time
+def saveCacheFile(cacheFile,data,**jsonOptions):
+	tempFile = cacheFile + '.tmp'
+	try:
+		if not os.path.isdir(os.path.dirname(cacheFile)):
+			os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+		with open(tempFile,'w') as f:
+			json.dump(data,f,**jsonOptions)
+		os.replace(tempFile,cacheFile)
+		return True
+	except OSError as e:
+		print("Unable to save %s (%s)" % (cacheFile,e))
+		return False
+
+# A directory modified this close to when it was scanned may have changed again within the same mtime tick, so it is rescanned next time
+scanCacheRacyWindow = 2
+
+def getScanCacheFile(dirName):
+	return getCacheFile(dirName,'scancache')
+
+def getSortNumber(path):
+	nums = re.findall('[0-9]+',path)
+	return None if nums == [] else int(nums[-1])
+
+def loadScanCache(cacheFile):
+	if not os.path.isfile(cacheFile):
+		return {}
+	try:
+		with open(cacheFile) as f:
+			cache = json.load(f)
+	except (OSError,ValueError):
+		return {}
+	if cache.get('version') != scanCacheVersion:
+		return {}
+	return cache['dirs']
+
+def saveScanCache(cacheFile,dirs):
+	saveCacheFile(cacheFile,{'version':scanCacheVersion, 'dirs':dirs})
+
+# Gets the current size and mtime of the files in a cached listing, or None if one has gone (so the directory is listed again)
+def revalidateFiles(dirPath,files):
+	revalidated = []
+	for name,_,_,num in files:
+		try:
+			stat = os.stat(os.path.join(dirPath,name))
+		except FileNotFoundError:
+			return None
+		revalidated.append([name, stat.st_size, stat.st_mtime, num])
+	return revalidated
+
+def scanDirectoryEntries(dirPath):
+	files,subdirs = [],[]
+	with os.scandir(dirPath) as it:
+		for entry in it:
+			# Same as os.walk: symlinks to directories are not followed
+			if entry.is_dir():
+				if not entry.is_symlink():
+					subdirs.append(entry.name)
+			else:
+				stat = entry.stat()
+				files.append([entry.name, stat.st_size, stat.st_mtime, getSortNumber(entry.name)])
+	return files,subdirs
+
+# Gets every file below dirName with its size and mtime, reusing the cached listing for directories that haven't changed
+def scanFiles(dirName,useCache=True):
+	cacheFile = getScanCacheFile(dirName)
+	cachedDirs = loadScanCache(cacheFile) if useCache else {}
+
+	newDirs = {}
+	changed = False
+	filesWithStats = []
+	toScan = [('',dirName)]
+	while len(toScan) > 0:
+		relPath,dirPath = toScan.pop()
+
+		dirStat = os.stat(dirPath)
+		cached = cachedDirs.get(relPath)
+		files = None
+		if cached is not None and cached['mtime'] == dirStat.st_mtime_ns and cached['mtime'] < (cached['scanned'] - scanCacheRacyWindow) * 1e9:
+			files = revalidateFiles(dirPath,cached['files'])
+
+		if files is not None:
+			entry = cached
+			if files != cached['files']:
+				entry = dict(cached, files=files)
+				changed = True
+		else:
+			scanned = time.time()
+			files,subdirs = scanDirectoryEntries(dirPath)
+			entry = {'mtime':dirStat.st_mtime_ns, 'scanned':scanned, 'files':files, 'subdirs':subdirs}
+			changed = True
+		newDirs[relPath] = entry
+
+		for name,size,mtime,num in entry['files']:
+			filesWithStats.append((num,os.path.join(dirPath,name),size,mtime))
+		for name in entry['subdirs']:
+			toScan.append((os.path.join(relPath,name),os.path.join(dirPath,name)))
+
+	if useCache and (changed or len(newDirs) != len(cachedDirs)):
+		saveScanCache(cacheFile,newDirs)
+
+	return filesWithStats
+
+# Sorts by the last set of digits in each path (and then by the path)
+def sortFiles(paths):
+	sortable = []
+	for path in paths:
+		num = getSortNumber(path)
+		sortable.append((0 if num is None else num,path))
+	return [ path for num,path in sorted(sortable) ]
+
+# Same listing (and order) as findFiles along with the size and mtime of each file
+def findFilesWithStats(dirName,useCache=True):
+	filesWithStats = scanFiles(dirName,useCache)
+
+	# We're going to extract the last set of digits from each filename and sort by that (falling back
+	# to the rest of the path if the filename has no digits)
+	sortable = []
+	stats = {}
+	for num,path,size,mtime in filesWithStats:
+		if num is None:
+			num = getSortNumber(path)
+		sortable.append((0 if num is None else num,path))
+		stats[path] = (size,mtime)
+
+	sortedFilepaths = [ path for num,path in sorted(sortable) ]
+	return sortedFilepaths,stats
+
+# Same listing (and order) as findFiles along with the mtime of each file
+def findFilesWithTimestamps(dirName,useCache=True):
+	sortedFilepaths,stats = findFilesWithStats(dirName,useCache)
+	timestamps = { path:mtime for path,(size,mtime) in stats.items() }
+	return sortedFilepaths,timestamps
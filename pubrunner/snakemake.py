@@ -3,9 +3,25 @@ import pubrunner
 import os
 import shlex
 import subprocess
+import multiprocessing
+
+# Gets the number of cores and memory (in MB) that local jobs can use, and the memory to reserve for each job
+# from the 'local' section of the global settings. By default all cores are used and memory isn't limited
+def getLocalResources(globalSettings):
+	localSettings = globalSettings["local"] if "local" in globalSettings and globalSettings["local"] else {}
+
+	cores = int(localSettings["cores"]) if "cores" in localSettings else multiprocessing.cpu_count()
+	memory = int(localSettings["memory"]) if "memory" in localSettings else None
+	jobMemory = int(localSettings["jobMemory"]) if "jobMemory" in localSettings else 1000
+
+	assert cores > 0, "The number of local cores must be at least one"
+	assert memory is None or jobMemory <= memory, "The local memory per job (%d MB) cannot be more than the total local memory (%d MB)" % (jobMemory,memory)
+
+	return cores,memory,jobMemory
 
 def launchSnakemake(snakeFilePath,useCluster=True,parameters={}):
 	globalSettings = pubrunner.getGlobalSettings()
+	cores,memory,jobMemory = getLocalResources(globalSettings)
 	
 	clusterFlags = ""
 	if useCluster and "cluster" in globalSettings:
@@ -24,10 +40,19 @@ def launchSnakemake(snakeFilePath,useCluster=True,parameters={}):
 		else:
 			raise RuntimeError("Cluster must either have drmaa = true or provide options (e.g. using qsub)")
 
-	makecommand = "snakemake %s --cores 1 --nolock -s %s" % (clusterFlags,snakeFilePath)
+	# The local cores and memory only limit local runs. Cluster jobs are limited by the cluster instead
+	resourceFlags = ""
+	if clusterFlags == "":
+		resourceFlags = "--cores %d" % cores
+		if memory is not None:
+			resourceFlags += " --resources mem_mb=%d" % memory
+
+	makecommand = "snakemake %s %s --nolock -s %s" % (clusterFlags,resourceFlags,snakeFilePath)
 
+	# The Snakefiles use these for the resources of each job
 	env = os.environ.copy()
 	env.update(parameters)
+	env["JOBMEMORY"] = str(jobMemory)
 
 	retval = subprocess.call(shlex.split(makecommand),env=env)
 	if retval != 0:
@@ -0,0 +1,9 @@
+import pytest
+import pubrunner
+
+# Keep the tests from using the caches in the home directory and resource storage
+@pytest.fixture(autouse=True)
+def pubrunnerCaches(tmp_path_factory,monkeypatch):
+	cacheDir = tmp_path_factory.mktemp('cache')
+	monkeypatch.setattr(pubrunner.getresource,'sha256CachePath',str(cacheDir / 'sha256cache'))
+	monkeypatch.setattr(pubrunner.scancache,'cacheDir',str(cacheDir))
@@ -0,0 +1,137 @@
+import os
+import io
+import gzip
+import shutil
+import tarfile
+import pytest
+import pubrunner.archive
+import pubrunner.convert
+import pubrunner.getresource
+import importlib
+
+# pubrunner.pubrun is also the name of a function exported by pubrunner, so get the module directly
+pubrunModule = importlib.import_module('pubrunner.pubrun')
+
+dataDir = os.path.join(os.path.dirname(__file__),'data')
+pubmedFile = os.path.join(dataDir,'pubmed.xml')
+pmcFile = os.path.join(dataDir,'pmc.nxml')
+
+def readFile(filename):
+	with open(filename,'rb') as f:
+		return f.read()
+
+# Creates an uncompressed tar archive in its own resource directory (as extractArchives leaves it with keepCompressed)
+def createTar(tmpdir,members,timestamp=1500000000):
+	resourceDir = str(tmpdir.join('resource'))
+	if not os.path.isdir(resourceDir):
+		os.makedirs(resourceDir)
+	tarPath = os.path.join(resourceDir,'articles.tar')
+	with tarfile.open(tarPath,'w') as tar:
+		for name,content in members.items():
+			info = tarfile.TarInfo(name)
+			info.size = len(content)
+			info.mtime = timestamp
+			tar.addfile(info,io.BytesIO(content))
+	os.utime(tarPath,(timestamp,timestamp))
+	return resourceDir,tarPath
+
+def test_gzipInput(tmpdir):
+	gzipFile = str(tmpdir.join('pubmed.xml.gz'))
+	with open(pubmedFile,'rb') as f_in, gzip.open(gzipFile,'wb') as f_out:
+		shutil.copyfileobj(f_in,f_out)
+
+	assert not pubrunner.archive.isPlainFile(gzipFile)
+	with pubrunner.archive.openInput(gzipFile) as f:
+		assert f.read() == readFile(pubmedFile)
+	assert list(pubrunner.convert.processMedlineFile(gzipFile)) == list(pubrunner.convert.processMedlineFile(pubmedFile))
+
+def test_tarMember(tmpdir):
+	resourceDir,tarPath = createTar(tmpdir,{'PMC001/article.nxml':readFile(pmcFile), 'pubmed.xml':readFile(pubmedFile), 'README.txt':b'Not an article'})
+	pubrunner.archive.buildArchiveIndex(tarPath,'.nxml')
+
+	# Only members matching the filter are listed
+	member = pubrunner.archive.joinMemberPath(tarPath,'PMC001/article.nxml')
+	assert pubrunner.archive.listArchiveMembers(tarPath) == [member]
+	assert pubrunner.archive.isArchiveMember(member) and not pubrunner.archive.isPlainFile(member)
+	assert pubrunner.archive.getsize(member) == os.path.getsize(pmcFile)
+	assert pubrunner.archive.getmtime(member) == 1500000000
+
+	with pubrunner.archive.openInput(member) as f:
+		assert f.read() == readFile(pmcFile)
+	with pubrunner.archive.openInput(member,binary=False) as f:
+		assert f.read() == readFile(pmcFile).decode('utf8')
+	assert list(pubrunner.convert.processPMCFile(member)) == list(pubrunner.convert.processPMCFile(pmcFile))
+
+	# The index is kept outside the resource directory
+	assert os.path.isfile(pubrunner.archive.getIndexFile(tarPath))
+	assert os.listdir(resourceDir) == ['articles.tar']
+
+	# Listing the resource gives the members instead of the archive
+	assert pubrunModule.findFiles(resourceDir) == [member]
+
+def test_reuseIndex(tmpdir,monkeypatch):
+	_,tarPath = createTar(tmpdir,{'a.nxml':b'<article/>'})
+	pubrunner.archive.buildArchiveIndex(tarPath,'.nxml')
+	pubrunner.archive.loadedIndexes.clear()
+
+	def failBuild(tarPath,fileSuffixFilter=None):
+		raise AssertionError("The archive should not be indexed again")
+	monkeypatch.setattr(pubrunner.archive,'buildArchiveIndex',failBuild)
+
+	index = pubrunner.archive.loadArchiveIndex(tarPath)
+	assert index['lookup']['a.nxml'][1] == len(b'<article/>')
+	assert pubrunner.archive.loadArchiveIndex(tarPath) is index
+
+def test_alternatingArchives(tmpdir,monkeypatch):
+	members = []
+	for i in range(3):
+		_,tarPath = createTar(tmpdir.mkdir('archive%d' % i),{'a.nxml':b'<article>%d</article>' % i})
+		pubrunner.archive.buildArchiveIndex(tarPath)
+		members.append(pubrunner.archive.joinMemberPath(tarPath,'a.nxml'))
+	pubrunner.archive.loadedIndexes.clear()
+
+	# Each index is only read once while switching between the archives
+	loads = []
+	jsonLoad = pubrunner.archive.json.load
+	monkeypatch.setattr(pubrunner.archive.json,'load',lambda f : loads.append(f.name) or jsonLoad(f))
+	for _ in range(5):
+		for i,member in enumerate(members):
+			with pubrunner.archive.openInput(member) as f:
+				assert f.read() == b'<article>%d</article>' % i
+			assert pubrunner.archive.getmtime(member) == 1500000000
+	assert len(loads) == 3
+
+	# Only the most recently used ones are kept
+	monkeypatch.setattr(pubrunner.archive,'maxLoadedIndexes',2)
+	pubrunner.archive.loadedIndexes.clear()
+	for member in members:
+		pubrunner.archive.getmtime(member)
+	assert [ key[0] for key in pubrunner.archive.loadedIndexes ] == [ pubrunner.archive.getIndexFile(pubrunner.archive.splitMemberPath(member)[0]) for member in members[1:] ]
+
+def test_invalidateIndex(tmpdir):
+	_,tarPath = createTar(tmpdir,{'a.nxml':b'<article/>', 'a.txt':b'text'})
+	pubrunner.archive.buildArchiveIndex(tarPath,'.nxml')
+	member = pubrunner.archive.joinMemberPath(tarPath,'a.nxml')
+	with pubrunner.archive.openInput(member) as f:
+		assert f.read() == b'<article/>'
+
+	# A changed archive is indexed again, keeping the filter
+	_,tarPath = createTar(tmpdir,{'b.txt':b'text', 'a.nxml':b'<article>updated</article>', 'b.nxml':b'<article/>'},timestamp=1600000000)
+	assert pubrunner.archive.listArchiveMembers(tarPath) == [member,pubrunner.archive.joinMemberPath(tarPath,'b.nxml')]
+	with pubrunner.archive.openInput(member) as f:
+		assert f.read() == b'<article>updated</article>'
+	assert pubrunner.archive.getmtime(member) == 1600000000
+
+def test_extractArchives_keepCompressed(tmpdir):
+	resourceDir,tarPath = createTar(tmpdir,{'a.nxml':b'<article/>', 'a.txt':b'text'})
+	with open(tarPath,'rb') as f_in, gzip.open(tarPath + '.gz','wb') as f_out:
+		shutil.copyfileobj(f_in,f_out)
+	os.unlink(tarPath)
+	with gzip.open(os.path.join(resourceDir,'b.nxml.gz'),'wb') as f:
+		f.write(b'<article/>')
+
+	pubrunner.getresource.extractArchives(resourceDir,'.nxml',processes=1,keepCompressed=True)
+
+	# The tar archive is only decompressed (and indexed) and the gzipped file is left as it is
+	assert sorted(os.listdir(resourceDir)) == ['articles.tar','b.nxml.gz']
+	assert pubrunModule.findFiles(resourceDir) == [pubrunner.archive.joinMemberPath(tarPath,'a.nxml'),os.path.join(resourceDir,'b.nxml.gz')]
@@ -0,0 +1,354 @@
+import sys
+import re
+import random
+import unicodedata
+import os
+import io
+import pytest
+import xml.etree.cElementTree as etree
+import pubrunner.convert
+
+dataDir = os.path.join(os.path.dirname(__file__),'data')
+pubmedFile = os.path.join(dataDir,'pubmed.xml')
+pmcFile = os.path.join(dataDir,'pmc.nxml')
+
+# The original per-character implementation of cleanupText that the table-driven one must match exactly
+def cleanupText_reference(text):
+	text = text.replace(u'\u2028',' ').replace(u'\u2029',' ')
+	text = "".join(ch for ch in text if unicodedata.category(ch)[0]!="C")
+	text = "".join(ch if unicodedata.category(ch)[0]!="Z" else " " for ch in text)
+
+	text = re.sub(r',(\s*,)*',',',text)
+	text = re.sub(r'(,\s*)*\.','.',text)
+	return text.strip()
+
+cleanupCorpus = [
+	u'',
+	u'   ',
+	u'A normal sentence.',
+	u'Commas , , , and more,,, commas , .',
+	u'Trailing commas ,\t,\n.',
+	u'No-break\xa0space and thin\u2009space',
+	u'Line\u2028and paragraph\u2029separators',
+	u'Zero\u200bwidth space and soft\xadhyphen',
+	u'Control\x00\x01\x1f\x7f\x85characters',
+	u'Private use \ue000 and unassigned \U0010fffe code points',
+	u'Accents: caf\xe9, na\xefve, \xc5ngstr\xf6m.',
+	u'Greek \u03b1-\u03b2 and math \u2211 \u2264 \U0001d400',
+	u'Emoji \U0001f600 with joiner \u200d and variation \ufe0f',
+	u'\u3000Ideographic space\u3000.',
+	u'Mixed\xa0,\u2028,\u3000, .',
+]
+
+def test_cleanupText_corpus():
+	for text in cleanupCorpus:
+		assert pubrunner.convert.cleanupText(text) == cleanupText_reference(text)
+
+def test_cleanupText_allCodepoints():
+	allCodepoints = u"".join( chr(c) for c in range(sys.maxunicode+1) if not 0xD800 <= c <= 0xDFFF )
+	assert pubrunner.convert.cleanupText(allCodepoints) == cleanupText_reference(allCodepoints)
+
+def test_cleanupText_random():
+	random.seed(42)
+	characters = u'ab ,.\t\n\xa0\u2028\u2029\u200b\x00\x7f\xe9\ue000\u3000'
+	for _ in range(2000):
+		text = u"".join( random.choice(characters) for _ in range(random.randint(0,60)) )
+		assert pubrunner.convert.cleanupText(text) == cleanupText_reference(text)
+
+# The original recursive text extraction that the streaming one must match exactly
+def extractTextFromElem_reference(elem):
+	childText = []
+	for child in elem:
+		childText = childText + extractTextFromElem_reference(child)
+
+	head = elem.text if elem.text else ""
+	tail = elem.tail if elem.tail else ""
+	if elem.tag in pubrunner.convert.ignoreList:
+		return [tail.strip()]
+	elif elem.tag in pubrunner.convert.separationList:
+		return [0] + [head] + childText + [tail]
+	else:
+		return [head] + childText + [tail]
+
+def extractTextFromElemList_reference(elemList):
+	textList = []
+	for e in elemList:
+		textList = textList + extractTextFromElem_reference(e) + [0]
+
+	mergedList = []
+	current = ""
+	for t in textList:
+		if t == 0:
+			if len(current) > 0:
+				mergedList.append(current)
+				current = ""
+		else:
+			current = (current + " " + t).strip()
+	if len(current) > 0:
+		mergedList.append(current)
+
+	return [ pubrunner.convert.cleanupText(text.replace('\n', ' ')) for text in mergedList ]
+
+extractionCorpus = [
+	'<abstract><p>Simple paragraph.</p></abstract>',
+	'<abstract>Lead text <p>First <b>bold <i>nested</i> text</b> tail of b.</p> between <p>Second.</p> tail</abstract>',
+	'<body><sec><title>Intro</title><p>Some text<xref>[1]</xref> after the reference.</p></sec><sec><title>Methods</title><p>More<table><tr><td>hidden</td></tr></table>  shown tail</p></sec></body>',
+	'<body><p>  Leading and trailing whitespace  </p>\n<p>\nNew\nlines\n</p></body>',
+	'<body><p>Math <inline-formula><tex-math>x^2</tex-math></inline-formula> and a <ext-link>link</ext-link>.</p><list><list-item><p>One</p></list-item><list-item>Two</list-item></list></body>',
+	'<body><p></p><p><b></b></p><sec><title/></sec><break/>Only a tail</body>',
+	'<back><ack><p>Thanks</p></ack><ref-list><ref>A reference</ref></ref-list>After the references</back>',
+]
+
+def test_extractText_corpus():
+	for xml in extractionCorpus:
+		elem = etree.fromstring(xml)
+		assert pubrunner.convert.extractTextFromElemList(elem) == extractTextFromElemList_reference([elem])
+		assert pubrunner.convert.extractTextFromElemList([elem,elem]) == extractTextFromElemList_reference([elem,elem])
+	assert pubrunner.convert.extractTextFromElemList([]) == extractTextFromElemList_reference([])
+
+# Builds a random XML tree with a mix of normal, separating and ignored elements, and text and tails
+def randomElement(depth):
+	tag = random.choice(['b','i','span','p','sec','title','xref','table','list-item','break'])
+	elem = etree.Element(tag)
+	words = ['', ' ', 'word', ' two words ', '\n', 'x\ny', '\xa0end']
+	elem.text = random.choice(words + [None])
+	elem.tail = random.choice(words + [None])
+	if depth > 0:
+		for _ in range(random.randint(0,3)):
+			elem.append(randomElement(depth-1))
+	return elem
+
+def test_extractText_random():
+	random.seed(42)
+	for _ in range(500):
+		elems = [ randomElement(4) for _ in range(random.randint(1,3)) ]
+		assert pubrunner.convert.extractTextFromElemList(elems) == extractTextFromElemList_reference(elems)
+
+def test_lxmlParser_pubmed():
+	pytest.importorskip('lxml')
+	etreeDocs = list(pubrunner.convert.processMedlineFile(pubmedFile,'etree'))
+	lxmlDocs = list(pubrunner.convert.processMedlineFile(pubmedFile,'lxml'))
+
+	assert [ doc['pmid'] for doc in etreeDocs ] == ['1001','1002','1003','1004','1005']
+	assert etreeDocs[0]['title'] == ['A study of BRCA1  expression in tumours.']
+	assert lxmlDocs == etreeDocs
+
+def test_lxmlParser_pmc():
+	pytest.importorskip('lxml')
+	etreeDocs = list(pubrunner.convert.processPMCFile(pmcFile,'etree'))
+	lxmlDocs = list(pubrunner.convert.processPMCFile(pmcFile,'lxml'))
+
+	# The main article and its sub-article
+	assert [ doc['doi'] for doc in etreeDocs ] == ['10.1000/example.1','10.1000/example.1.reply']
+	assert etreeDocs[0]['textSources']['abstract'] == ['Background', 'Yeast genes are regulated < expected.', 'Results', 'We found changes.']
+	assert lxmlDocs == etreeDocs
+
+def test_unknownParser():
+	with pytest.raises(RuntimeError):
+		list(pubrunner.convert.processMedlineFile(pubmedFile,'sax'))
+
+def test_findPubmedArticles():
+	with open(pubmedFile,'rb') as f:
+		data = f.read()
+	ranges = list(pubrunner.convert.findPubmedArticles(data))
+
+	assert len(ranges) == 5
+	assert all( data[start:end].startswith(b'<PubmedArticle>') and data[start:end].endswith(b'</PubmedArticle>') for start,end in ranges )
+
+	# The citation's own PMID is used, not the one in its CommentsCorrections
+	assert [ pubrunner.convert.getRawPubmedArticlePMID(data,start,end) for start,end in ranges ] == ['1001','1002','1003','1004','1005']
+
+	# An incomplete citation at the end isn't included
+	assert list(pubrunner.convert.findPubmedArticles(data[:ranges[-1][1]-1])) == ranges[:-1]
+
+def test_findPubmedArticlesInStream():
+	with open(pubmedFile,'rb') as f:
+		data = f.read()
+	articles = [ data[start:end] for start,end in pubrunner.convert.findPubmedArticles(data) ]
+
+	# Including blocks that split the tags and blocks smaller than a citation
+	for blockSize in [7,13,100,1000,len(data)]:
+		streamed = [ blockData[start:end] for blockData,start,end in pubrunner.convert.findPubmedArticlesInStream(io.BytesIO(data),blockSize) ]
+		assert streamed == articles
+
+def test_processMedlineFileInParallel():
+	serialDocs = list(pubrunner.convert.processMedlineFile(pubmedFile))
+	parallelDocs = list(pubrunner.convert.processMedlineFileInParallel(pubmedFile,2,batchSize=2))
+	assert parallelDocs == serialDocs
+
+# Citations that aren't in the PMID filter are skipped before they are converted, with the same
+# result as converting everything and filtering afterwards
+def test_pmidFilterBeforeConversion(monkeypatch):
+	keep = set(['1002','1003','1005'])
+	expected = [ doc for doc in pubrunner.convert.processMedlineFile(pubmedFile) if doc['pmid'] in keep ]
+	assert len(expected) == 3
+
+	converted = []
+	processMedlineArticle = pubrunner.convert.processMedlineArticle
+	def recordingProcessMedlineArticle(elem):
+		converted.append(pubrunner.convert.getMedlinePMID(elem))
+		return processMedlineArticle(elem)
+	monkeypatch.setattr(pubrunner.convert,'processMedlineArticle',recordingProcessMedlineArticle)
+
+	for parser in ['etree','lxml']:
+		del converted[:]
+		assert list(pubrunner.convert.processMedlineFile(pubmedFile,parser,pmidFilter=keep.__contains__)) == expected
+		assert converted == ['1002','1003','1005']
+
+	# The parallel version only gives the workers the citations in the filter
+	with open(pubmedFile,'rb') as f:
+		data = f.read()
+	ranges = pubrunner.convert.findPubmedArticleRanges(pubmedFile,keep.__contains__)
+	assert [ pubrunner.convert.getRawPubmedArticlePMID(data,start,end) for start,end in ranges ] == ['1002','1003','1005']
+	assert list(pubrunner.convert.processMedlineFileInParallel(pubmedFile,2,batchSize=1,pmidFilter=keep.__contains__)) == expected
+
+def test_convertFiles_pmidList(tmpdir):
+	import gzip
+	import json
+	from pubrunner.pmidlist import writePMIDList
+
+	pmidFile = str(tmpdir.join('pubmed.xml.pmids'))
+	writePMIDList(pmidFile,[1001,1004])
+
+	def readJSONL(outFile):
+		with gzip.open(outFile,'rt',encoding='utf-8') as f:
+			return [ json.loads(line) for line in f ]
+
+	allFile = str(tmpdir.join('all.jsonl.gz'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',allFile,'jsonl')
+	expected = [ document for document in readJSONL(allFile) if document['id'] in ['1001','1004'] ]
+	assert len(expected) == 2
+
+	for processes in [1,2]:
+		outFile = str(tmpdir.join('filtered%d.jsonl.gz' % processes))
+		pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'jsonl',[pmidFile],processes=processes)
+		assert readJSONL(outFile) == expected
+
+# Reads the raw infons and passages from a BioC file (with lxml, which bioc itself uses, as it is written with an 'utf8' encoding declaration)
+def readBiocOutput(biocFile):
+	import lxml.etree
+	documents = []
+	for docElem in lxml.etree.parse(biocFile).getroot().findall('./document'):
+		infons = { infon.attrib['key']:(infon.text or '') for infon in docElem.findall('./infon') }
+		passages = [ (passage.find('./infon').text,int(passage.find('./offset').text),passage.find('./text').text) for passage in docElem.findall('./passage') ]
+		documents.append((docElem.find('./id').text,infons,passages))
+	return documents
+
+def test_convertFiles_bioc(tmpdir):
+	idFile = str(tmpdir.join('ids.txt'))
+	with open(idFile,'w') as f:
+		f.write("1001\n1002\n1005\n")
+
+	outFile = str(tmpdir.join('out.bioc'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'bioc',[idFile])
+	documents = readBiocOutput(outFile)
+
+	assert [ docID for docID,_,_ in documents ] == ['1001','1002','1005']
+
+	# A missing day is written as None but no chemicals or MeSH headings are written as empty infons
+	assert documents[0][1] == {'title':'A study of BRCA1  expression in tumours.', 'pmid':'1001', 'year':'1998', 'month':'1', 'day':'None', 'journal':'Journal of Examples', 'journalISO':'J. Ex.', 'authors':'Jane Smith, Example Consortium', 'chemicals':'D019398|BRCA1 Protein', 'meshHeadings':'Qualifier|D001943|N|Breast Neoplasms%Descriptor|Q000235|Y|genetics\tQualifier|D006801|N|Humans'}
+	assert documents[1][1] == {'title':'A title without an abstract.', 'pmid':'1002', 'year':'2005', 'month':'6', 'day':'15', 'journal':'Example Letters', 'journalISO':'Ex. Lett.', 'authors':'Jones', 'chemicals':'', 'meshHeadings':''}
+
+	assert documents[0][2] == [('title',0,'A study of BRCA1  expression in tumours.'), ('abstract',40,'Mutations in BRCA1  (and 2 ) were studied < 5 times.'), ('abstract',92,'Expression was reduced   in most samples  .')]
+	assert documents[1][2] == [('title',0,'A title without an abstract.')]
+	assert documents[2][2] == [('title',0,'Structured results  with a subscript  tail.'), ('abstract',43,'To test the conversion.'), ('abstract',66,'It works   as expected.')]
+
+def test_convertFiles_txt(tmpdir):
+	idFile = str(tmpdir.join('ids.txt'))
+	with open(idFile,'w') as f:
+		f.write("1002\n1005\n")
+
+	outFile = str(tmpdir.join('out.txt'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'txt',[idFile])
+	with open(outFile,encoding='utf-8') as f:
+		assert f.read() == 'A title without an abstract.\n\nStructured results  with a subscript  tail.\n\nTo test the conversion.\n\nIt works   as expected.\n\n'
+
+	# BioC input is streamed through too, and filtered the same way
+	biocFile = str(tmpdir.join('all.bioc'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',biocFile,'bioc')
+	assert len(readBiocOutput(biocFile)) == 5
+
+	outFile = str(tmpdir.join('fromBioc.txt'))
+	pubrunner.convert.convertFiles([biocFile],'bioc',outFile,'txt',[idFile])
+	with open(outFile,encoding='utf-8') as f:
+		assert f.read() == 'A title without an abstract.\n\nStructured results  with a subscript  tail.\n\nTo test the conversion.\n\nIt works   as expected.\n\n'
+
+def test_convertFiles_otherIDs(tmpdir):
+	idFile = str(tmpdir.join('ids.txt'))
+	with open(idFile,'w') as f:
+		f.write("PMC123\n1002\n")
+
+	outFile = str(tmpdir.join('out.txt'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'txt',[idFile])
+	with open(outFile,encoding='utf-8') as f:
+		assert f.read() == 'A title without an abstract.\n\n'
+
+def test_jsonlOutput(tmpdir):
+	import gzip
+	import json
+
+	outFile = str(tmpdir.join('out.jsonl.gz'))
+	pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'jsonl')
+	with gzip.open(outFile,'rt',encoding='utf-8') as f:
+		documents = [ json.loads(line) for line in f ]
+
+	biocDocs = list(pubrunner.convert.pubmedxml2biocDocuments(pubmedFile))
+	assert len(documents) == len(biocDocs)
+	for document,biocDoc in zip(documents,biocDocs):
+		assert document['id'] == biocDoc.id
+		assert [ (p['offset'],p['infons'],p['text']) for p in document['passages'] ] == [ (p.offset,p.infons,p.text) for p in biocDoc.passages ]
+
+		# The dates are written as numbers (or null) and the other infons as they are
+		infons = dict(biocDoc.infons)
+		for key in ['year','month','day']:
+			assert document['infons'][key] == infons.pop(key)
+		assert { key:value for key,value in document['infons'].items() if not key in ['year','month','day'] } == infons
+
+	assert documents[0]['infons']['day'] is None
+	assert documents[0]['infons']['year'] == 1998
+
+def test_parquetOutput(tmpdir):
+	pyarrow = pytest.importorskip('pyarrow')
+	import pyarrow.parquet
+
+	outFile = str(tmpdir.join('out.parquet'))
+	writer = pubrunner.convert.ParquetOutputWriter(outFile,batchSize=4)
+	biocDocs = list(pubrunner.convert.pubmedxml2biocDocuments(pubmedFile))
+	for biocDoc in biocDocs:
+		writer.write_document(biocDoc)
+	writer.close()
+
+	# One row per passage, written in row groups once there are enough passages for a batch
+	expected = [ (doc.id,int(doc.id),None,doc.infons['year'],doc.infons['journal'],doc.infons['meshHeadings'],p.infons['section'],None,p.offset,p.text) for doc in biocDocs for p in doc.passages ]
+	parquetFile = pyarrow.parquet.ParquetFile(outFile)
+	assert parquetFile.metadata.num_rows == len(expected) == 11
+	assert [ parquetFile.metadata.row_group(i).num_rows for i in range(parquetFile.num_row_groups) ] == [4,4,3]
+
+	table = parquetFile.read().to_pydict()
+	rows = list(zip(*[ table[name] for name in ['id','pmid','pmcid','year','journal','meshHeadings','section','subsection','offset','text'] ]))
+	assert rows == expected
+
+def test_registerOutputWriter(tmpdir):
+	class IDOutputWriter:
+		extension = 'ids'
+
+		def __init__(self,outFile):
+			self.handle = open(outFile,'w')
+
+		def write_document(self,biocDoc):
+			self.handle.write(biocDoc.id + "\n")
+
+		def close(self):
+			self.handle.close()
+
+	pubrunner.registerOutputWriter('ids',IDOutputWriter)
+	try:
+		assert 'ids' in pubrunner.acceptedOutFormats
+
+		outFile = str(tmpdir.join('out.ids'))
+		pubrunner.convert.convertFiles([pubmedFile],'pubmedxml',outFile,'ids')
+		with open(outFile) as f:
+			assert f.read() == "1001\n1002\n1003\n1004\n1005\n"
+	finally:
+		del pubrunner.outputWriters['ids']
+		pubrunner.acceptedOutFormats.remove('ids')
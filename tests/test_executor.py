@@ -0,0 +1,107 @@
+import pubrunner
+import pubrunner.executor
+import os
+import json
+import time
+import pytest
+
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'data')
+pubmedFile = os.path.join(dataDir,'pubmed.xml')
+
+@pytest.fixture
+def localSettings(monkeypatch):
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {'local':{'cores':2}})
+
+def writeOutput(outFile,text):
+	with open(outFile,'w') as f:
+		f.write(text)
+
+def writePartialAndFail(outFile):
+	writeOutput(outFile,'partial')
+	raise RuntimeError("Job failed")
+
+def writePartialAndWait(outFile):
+	writeOutput(outFile,'partial')
+	time.sleep(60)
+
+# Fails once the other job has started writing, as if the run was interrupted while that job was running
+def failAfterOtherJobStarts(otherTempFile):
+	for _ in range(1000):
+		if os.path.isfile(otherTempFile):
+			break
+		time.sleep(0.01)
+	raise RuntimeError("Job failed")
+
+def createOldInput(tmpdir):
+	inFile = str(tmpdir.join('input.txt'))
+	writeOutput(inFile,'input')
+	os.utime(inFile,(1500000000,1500000000))
+	return inFile
+
+def createJob(func,outFile,*args):
+	return (func,(pubrunner.executor.getTempOutputFile(outFile),)+args,[outFile])
+
+def test_runJobs(tmpdir,localSettings):
+	inFile = createOldInput(tmpdir)
+	outFiles = [ str(tmpdir.join('out%d.txt' % i)) for i in range(3) ]
+	assert all( pubrunner.executor.isOutdated([inFile],outFile) for outFile in outFiles )
+
+	jobs = [ createJob(writeOutput,outFile,'output %d' % i) for i,outFile in enumerate(outFiles) ]
+	pubrunner.executor.runJobs('test',jobs)
+
+	for i,outFile in enumerate(outFiles):
+		with open(outFile) as f:
+			assert f.read() == 'output %d' % i
+		assert not pubrunner.executor.isOutdated([inFile],outFile)
+	assert sorted(os.listdir(str(tmpdir))) == ['input.txt','out0.txt','out1.txt','out2.txt']
+
+def test_failedJob(tmpdir,monkeypatch):
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {'local':{'cores':1}})
+	inFile = createOldInput(tmpdir)
+	newOutFile = str(tmpdir.join('new.txt'))
+	oldOutFile = str(tmpdir.join('old.txt'))
+	writeOutput(oldOutFile,'previous')
+	os.utime(oldOutFile,(1400000000,1400000000))
+
+	for outFile in [newOutFile,oldOutFile]:
+		with pytest.raises(RuntimeError):
+			pubrunner.executor.runJobs('test',[createJob(writePartialAndFail,outFile)])
+
+	# The failed jobs are still outdated and left no partial output behind
+	assert pubrunner.executor.isOutdated([inFile],newOutFile)
+	assert pubrunner.executor.isOutdated([inFile],oldOutFile)
+	with open(oldOutFile) as f:
+		assert f.read() == 'previous'
+	assert sorted(os.listdir(str(tmpdir))) == ['input.txt','old.txt']
+
+def test_interruptedJobs(tmpdir,localSettings):
+	inFile = createOldInput(tmpdir)
+	waitingOutFile = str(tmpdir.join('waiting.txt'))
+	failingOutFile = str(tmpdir.join('failing.txt'))
+
+	jobs = []
+	jobs.append(createJob(writePartialAndWait,waitingOutFile))
+	jobs.append((failAfterOtherJobStarts,(pubrunner.executor.getTempOutputFile(waitingOutFile),),[failingOutFile]))
+	with pytest.raises(RuntimeError):
+		pubrunner.executor.runJobs('test',jobs)
+
+	assert pubrunner.executor.isOutdated([inFile],waitingOutFile)
+	assert sorted(os.listdir(str(tmpdir))) == ['input.txt']
+
+def test_runConversions(tmpdir,localSettings):
+	chunkDir = tmpdir.mkdir('chunks')
+	outDir = tmpdir.mkdir('out')
+	for i in range(2):
+		chunkDir.join('%08d' % i).write(json.dumps([pubmedFile]))
+
+	pubrunner.executor.runConversions(str(chunkDir),str(outDir),'pubmedxml','txt')
+
+	assert sorted(os.listdir(str(outDir))) == ['00000000','00000001']
+	for name in os.listdir(str(outDir)):
+		with open(str(outDir.join(name))) as f:
+			assert len(f.read()) > 0
+
+	# Complete outputs aren't redone
+	timestamps = { name:os.path.getmtime(str(outDir.join(name))) for name in os.listdir(str(outDir)) }
+	pubrunner.executor.runConversions(str(chunkDir),str(outDir),'pubmedxml','txt')
+	assert timestamps == { name:os.path.getmtime(str(outDir.join(name))) for name in os.listdir(str(outDir)) }
@@ -0,0 +1,113 @@
+import os
+import pubrunner
+from pubrunner.pubmed_hash import hashFields,writeBinaryHashFile,md5digest,saveHashManifest
+from pubrunner.pmidlist import loadPMIDList,writePMIDList,PMIDFilter,openIDFilter,closeIDFilter
+
+# Writes a hash file for a fake Pubmed file where each PMID's hashes come from the given version text
+def writeHashFile(hashDir,pubmedXMLFile,pmidsWithVersions):
+	hashes = { pmid:{ field:md5digest("%s %s %d" % (version,field,pmid)) for field in hashFields } for pmid,version in pmidsWithVersions.items() }
+	hashFile = os.path.join(hashDir,pubmedXMLFile + '.hashes')
+	writeBinaryHashFile(hashFile,hashFields,{pubmedXMLFile:hashes})
+
+	stat = os.stat(hashFile)
+	return pubmedXMLFile,{'size':stat.st_size, 'mtime':stat.st_mtime, 'sha256':pubrunner.calcSHA256(hashFile,useCache=False), 'hashFile':os.path.basename(hashFile)}
+
+def createHashes(hashDir,updatedTitle='v1'):
+	if not os.path.isdir(hashDir):
+		os.makedirs(hashDir)
+	manifest = dict([
+		writeHashFile(hashDir,'pubmed01.xml',{1:'v1', 2:'v1', 3:'v1'}),
+		writeHashFile(hashDir,'pubmed02.xml',{3:updatedTitle, 4:'v1'}),
+	])
+	saveHashManifest(hashDir,manifest)
+
+def readPMIDs(pmidDir,pubmedXMLFile):
+	return list(loadPMIDList(os.path.join(pmidDir,pubmedXMLFile + '.pmids')))
+
+def test_gatherPMIDs(tmpdir):
+	hashDir,pmidDir = str(tmpdir.join('hashes')),str(tmpdir.join('pmids'))
+	createHashes(hashDir)
+
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir) is not None
+
+	# PMID 3 is the same in both files, so it comes from the older one
+	assert readPMIDs(pmidDir,'pubmed01.xml') == [1,2,3]
+	assert readPMIDs(pmidDir,'pubmed02.xml') == [4]
+
+def test_skipWhenUnchanged(tmpdir):
+	hashDir,pmidDir = str(tmpdir.join('hashes')),str(tmpdir.join('pmids'))
+	createHashes(hashDir)
+
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir) is not None
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir) is None
+
+	# A different choice of hashes or exclusions means the lists need to be regenerated
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir,whichHashes=['title']) is not None
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir,whichHashes=['title']) is None
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir,whichHashes=['title'],pmidExclusions={2}) is not None
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir,whichHashes=['title'],pmidExclusions={2}) is None
+	assert readPMIDs(pmidDir,'pubmed01.xml') == [1,3]
+
+def test_rerunWhenHashesChange(tmpdir):
+	hashDir,pmidDir = str(tmpdir.join('hashes')),str(tmpdir.join('pmids'))
+	createHashes(hashDir)
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir) is not None
+
+	# PMID 3 is updated in the newer file so it should now come from that one
+	createHashes(hashDir,updatedTitle='v2')
+	assert pubrunner.gatherPMIDs(hashDir,pmidDir) is not None
+	assert readPMIDs(pmidDir,'pubmed01.xml') == [1,2]
+	assert readPMIDs(pmidDir,'pubmed02.xml') == [3,4]
+
+def test_pmidFilter(tmpdir):
+	hashDir,pmidDir = str(tmpdir.join('hashes')),str(tmpdir.join('pmids'))
+	createHashes(hashDir)
+	pubrunner.gatherPMIDs(hashDir,pmidDir)
+
+	with PMIDFilter(os.path.join(pmidDir,'pubmed01.xml.pmids')) as idFilter:
+		assert len(idFilter) == 3
+		assert [ pmid for pmid in ['0','1','2','3','4','abc',''] if pmid in idFilter ] == ['1','2','3']
+		# Only ASCII digits are PMIDs (int() would fail on '²' and accept ' 2' or '٢')
+		assert [ pmid for pmid in ['²','٢',' 2','2 ','+2','-1'] if pmid in idFilter ] == []
+		assert 2 in idFilter and not 4 in idFilter
+		# Documents without an ID (or with another type of ID) don't match
+		assert not None in idFilter and not 2.0 in idFilter and not b'2' in idFilter
+
+	# PMID lists from older versions are text files
+	textFile = str(tmpdir.join('old.pmids'))
+	with open(textFile,'w') as f:
+		f.write("5\n7\n")
+	with PMIDFilter(textFile) as idFilter:
+		assert [ pmid for pmid in ['5','6','7'] if pmid in idFilter ] == ['5','7']
+
+def test_pmidFilterLarge(tmpdir):
+	pmids = list(range(1000,200000,7)) + [30000000]
+	pmidFile = str(tmpdir.join('large.pmids'))
+	writePMIDList(pmidFile,pmids)
+
+	expected = set(pmids)
+	with PMIDFilter(pmidFile) as idFilter:
+		assert len(idFilter) == len(pmids)
+		assert all( (pmid in idFilter) == (pmid in expected) for pmid in range(0,210000) )
+		assert '30000000' in idFilter and not '30000001' in idFilter
+
+def test_openIDFilter(tmpdir):
+	binaryFile = str(tmpdir.join('binary.pmids'))
+	writePMIDList(binaryFile,[5,7])
+	textFile = str(tmpdir.join('text.pmids'))
+	with open(textFile,'w') as f:
+		f.write("5\n7\n\n")
+	otherFile = str(tmpdir.join('other.ids'))
+	with open(otherFile,'w') as f:
+		f.write("PMC123\n7\n")
+
+	for filename in [binaryFile,textFile]:
+		idFilter = openIDFilter(filename)
+		assert isinstance(idFilter,PMIDFilter)
+		assert [ id for id in ['5','6','7',7,None] if id in idFilter ] == ['5','7',7]
+		closeIDFilter(idFilter)
+
+	# Other ID files are filtered by the text of the IDs, as before there were PMID lists
+	idFilter = openIDFilter(otherFile)
+	assert [ id for id in ['PMC123','PMC124','5','7',None] if id in idFilter ] == ['PMC123','7']
+	closeIDFilter(idFilter)
@@ -0,0 +1,379 @@
+import pubrunner
+import pubrunner.getresource
+import os
+import hashlib
+import threading
+import email.utils
+import json
+import io
+import gzip
+import tarfile
+import ftputil
+import ftputil.error
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# A stand-in for a remote HTTP server that supports conditional and range requests
+class FileHandler(BaseHTTPRequestHandler):
+	content = b''
+	lastModified = 0
+	requests = []
+	# Reports the wrong start for a range (as a broken server or proxy might)
+	wrongContentRange = False
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		etag = '"%s"' % hashlib.md5(self.content).hexdigest()
+		lastModified = email.utils.formatdate(self.lastModified, usegmt=True)
+		FileHandler.requests.append((self.path,dict(self.headers)))
+
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.end_headers()
+			return
+
+		start = 0
+		rangeHeader = self.headers.get('Range')
+		if rangeHeader and self.headers.get('If-Range') == etag:
+			start = int(rangeHeader[len('bytes='):].rstrip('-'))
+
+		if start > 0 and start >= len(self.content):
+			self.send_response(416)
+			self.send_header('Content-Range', 'bytes */%d' % len(self.content))
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		body = self.content[start:]
+		self.send_response(206 if start > 0 else 200)
+		if start > 0:
+			reportedStart = 0 if self.wrongContentRange else start
+			self.send_header('Content-Range', 'bytes %d-%d/%d' % (reportedStart,len(self.content)-1,len(self.content)))
+		self.send_header('Content-Length', str(len(body)))
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', lastModified)
+		self.end_headers()
+		self.wfile.write(body)
+
+def startServer(content):
+	FileHandler.content = content
+	FileHandler.lastModified = 1500000000
+	FileHandler.requests = []
+	FileHandler.wrongContentRange = False
+	server = HTTPServer(('127.0.0.1', 0), FileHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	url = 'http://127.0.0.1:%d/data.xml' % server.server_address[1]
+	return server,url
+
+def test_download(tmpdir):
+	server,url = startServer(b'<xml>' + os.urandom(100000) + b'</xml>')
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		pubrunner.download(url,outDir)
+		with open(outFile,'rb') as f:
+			assert f.read() == FileHandler.content
+
+		infoFile,_,_ = pubrunner.getresource.getHTTPStateFiles(outFile)
+		with open(infoFile) as f:
+			assert json.load(f)['sha256'] == hashlib.sha256(FileHandler.content).hexdigest()
+	finally:
+		server.shutdown()
+
+def test_notModified(tmpdir):
+	server,url = startServer(b'<xml>unchanged</xml>')
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		pubrunner.download(url,outDir)
+		os.utime(outFile,(1000,1000))
+
+		pubrunner.download(url,outDir)
+		assert FileHandler.requests[-1][1]['If-None-Match'] == '"%s"' % hashlib.md5(FileHandler.content).hexdigest()
+		assert os.path.getmtime(outFile) == 1000
+	finally:
+		server.shutdown()
+
+def test_changed(tmpdir):
+	server,url = startServer(b'<xml>first</xml>')
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		pubrunner.download(url,outDir)
+		FileHandler.content = b'<xml>second</xml>'
+		pubrunner.download(url,outDir)
+
+		with open(outFile,'rb') as f:
+			assert f.read() == b'<xml>second</xml>'
+	finally:
+		server.shutdown()
+
+# Leaves a partial download behind, as if the previous attempt was interrupted
+def createPartialDownload(url,outFile,content,partContent):
+	_,partFile,partInfoFile = pubrunner.getresource.getHTTPStateFiles(outFile)
+	with open(partFile,'wb') as f:
+		f.write(partContent)
+	etag = '"%s"' % hashlib.md5(content).hexdigest()
+	pubrunner.getresource.saveHTTPInfo(partInfoFile,{'url':url,'etag':etag,'lastModified':None})
+	return partFile,partInfoFile
+
+def test_resume(tmpdir):
+	content = os.urandom(300000)
+	server,url = startServer(content)
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		partFile,_ = createPartialDownload(url,outFile,content,content[:120000])
+
+		pubrunner.download(url,outDir)
+
+		assert FileHandler.requests[-1][1]['Range'] == 'bytes=120000-'
+		with open(outFile,'rb') as f:
+			assert f.read() == content
+		assert not os.path.isfile(partFile)
+
+		infoFile,_,_ = pubrunner.getresource.getHTTPStateFiles(outFile)
+		with open(infoFile) as f:
+			assert json.load(f)['sha256'] == hashlib.sha256(content).hexdigest()
+	finally:
+		server.shutdown()
+
+def test_resumeComplete(tmpdir):
+	content = os.urandom(50000)
+	server,url = startServer(content)
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		# The partial file already has everything, so the server can't give a range and the download starts again
+		partFile,partInfoFile = createPartialDownload(url,outFile,content,content)
+		pubrunner.download(url,outDir)
+
+		assert [ 'Range' in headers for _,headers in FileHandler.requests ] == [True,False]
+		with open(outFile,'rb') as f:
+			assert f.read() == content
+		assert not os.path.isfile(partFile) and not os.path.isfile(partInfoFile)
+	finally:
+		server.shutdown()
+
+def test_resumeWrongRange(tmpdir):
+	content = os.urandom(50000)
+	server,url = startServer(content)
+	try:
+		outDir = str(tmpdir.mkdir('resource'))
+		outFile = os.path.join(outDir,'data.xml')
+
+		partFile,partInfoFile = createPartialDownload(url,outFile,content,content[:1000])
+		FileHandler.wrongContentRange = True
+		pubrunner.download(url,outDir)
+
+		assert [ 'Range' in headers for _,headers in FileHandler.requests ] == [True,False]
+		with open(outFile,'rb') as f:
+			assert f.read() == content
+		assert not os.path.isfile(partFile) and not os.path.isfile(partInfoFile)
+	finally:
+		server.shutdown()
+
+# A stand-in for ftputil.FTPHost that serves a local directory. Downloads of the paths in failures raise
+# FTPOSError (as for a dropped connection) that many times before they work
+class FakeFTPHost:
+	root = None
+	failures = {}
+	downloads = []
+	opened = 0
+
+	def __init__(self,hostname,user,password):
+		FakeFTPHost.opened += 1
+		self.closed = False
+		self.path = FakeFTPPath(self)
+
+	def local(self,path):
+		return os.path.join(FakeFTPHost.root,path.lstrip('/'))
+
+	def listdir(self,path):
+		return sorted(os.listdir(self.local(path)))
+
+	def download(self,path,target):
+		if FakeFTPHost.failures.get(path,0) > 0:
+			FakeFTPHost.failures[path] -= 1
+			# The connection drops partway through
+			with open(target,'wb') as f_out:
+				f_out.write(b'partial')
+			raise ftputil.error.FTPOSError("Connection reset")
+		FakeFTPHost.downloads.append(path)
+		with open(self.local(path),'rb') as f_in, open(target,'wb') as f_out:
+			f_out.write(f_in.read())
+
+	def close(self):
+		self.closed = True
+
+class FakeFTPPath:
+	def __init__(self,host):
+		self.host = host
+
+	def isdir(self,path):
+		return os.path.isdir(self.host.local(path))
+
+	def isfile(self,path):
+		return os.path.isfile(self.host.local(path))
+
+	def getmtime(self,path):
+		return os.path.getmtime(self.host.local(path))
+
+	def join(self,*paths):
+		return "/".join(paths)
+
+	def basename(self,path):
+		return path.split('/')[-1]
+
+@pytest.fixture
+def fakeFTP(tmpdir,monkeypatch):
+	remoteDir = str(tmpdir.mkdir('remote'))
+	for name in ['pubmed/baseline/pubmed001.xml.gz','pubmed/baseline/pubmed002.xml.gz','pubmed/baseline/README.txt','pubmed/updatefiles/pubmed003.xml.gz']:
+		remoteFile = os.path.join(remoteDir,name)
+		if not os.path.isdir(os.path.dirname(remoteFile)):
+			os.makedirs(os.path.dirname(remoteFile))
+		with open(remoteFile,'wb') as f:
+			f.write(name.encode('utf8') * 1000)
+		os.utime(remoteFile,(1500000000,1500000000))
+
+	FakeFTPHost.root = remoteDir
+	FakeFTPHost.failures = {}
+	FakeFTPHost.downloads = []
+	FakeFTPHost.opened = 0
+	monkeypatch.setattr(ftputil,'FTPHost',FakeFTPHost)
+	monkeypatch.setattr(pubrunner.getresource.time,'sleep',lambda seconds: None)
+	return remoteDir
+
+def test_downloadFTP(tmpdir,fakeFTP):
+	outDir = str(tmpdir.mkdir('resource'))
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com',fileSuffixFilter='.xml',connections=3)
+
+	# The directory tree is mirrored (except files that don't match the filter) with the remote timestamps
+	assert sorted(FakeFTPHost.downloads) == ['pubmed/baseline/pubmed001.xml.gz','pubmed/baseline/pubmed002.xml.gz','pubmed/updatefiles/pubmed003.xml.gz']
+	for name in ['baseline/pubmed001.xml.gz','baseline/pubmed002.xml.gz','updatefiles/pubmed003.xml.gz']:
+		with open(os.path.join(outDir,name),'rb') as f:
+			assert f.read() == ('pubmed/' + name).encode('utf8') * 1000
+		assert os.path.getmtime(os.path.join(outDir,name)) == 1500000000
+	assert not os.path.exists(os.path.join(outDir,'baseline','README.txt'))
+	assert not any( f.endswith('.part') for _,_,files in os.walk(outDir) for f in files )
+	assert FakeFTPHost.opened <= 3
+
+def test_downloadFTP_singleFile(tmpdir,fakeFTP):
+	outDir = str(tmpdir.mkdir('resource'))
+	pubrunner.getresource.downloadFTP('pubmed/updatefiles/pubmed003.xml.gz',outDir,'ftp.example.com')
+	assert FakeFTPHost.downloads == ['pubmed/updatefiles/pubmed003.xml.gz']
+	assert os.listdir(outDir) == ['pubmed003.xml.gz']
+
+def test_downloadFTP_retry(tmpdir,fakeFTP):
+	outDir = str(tmpdir.mkdir('resource'))
+	FakeFTPHost.failures = {'pubmed/baseline/pubmed002.xml.gz':2}
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com',connections=2)
+
+	assert FakeFTPHost.failures['pubmed/baseline/pubmed002.xml.gz'] == 0
+	with open(os.path.join(outDir,'baseline','pubmed002.xml.gz'),'rb') as f:
+		assert f.read() == b'pubmed/baseline/pubmed002.xml.gz' * 1000
+
+def test_downloadFTP_failure(tmpdir,fakeFTP):
+	outDir = str(tmpdir.mkdir('resource'))
+	FakeFTPHost.failures = {'pubmed/baseline/pubmed002.xml.gz':5}
+
+	# The error from the download that failed is raised once everything else has stopped
+	with pytest.raises(RuntimeError, match='Unable to download pubmed/baseline/pubmed002.xml.gz'):
+		pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com',tries=3,connections=2)
+	assert not os.path.exists(os.path.join(outDir,'baseline','pubmed002.xml.gz'))
+
+	# The partial download isn't left in the resource (where it would be treated as an input)
+	assert not any( f.endswith('.part') for _,_,files in os.walk(outDir) for f in files )
+	assert os.path.isfile(os.path.join(outDir + '.ftpinfo','baseline','pubmed002.xml.gz.part'))
+
+def test_downloadFTP_skipUnchanged(tmpdir,fakeFTP):
+	outDir = str(tmpdir.mkdir('resource'))
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com')
+	assert len(FakeFTPHost.downloads) == 4
+
+	FakeFTPHost.downloads = []
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com')
+	assert FakeFTPHost.downloads == []
+
+	# Only a file that is newer on the server is downloaded again
+	os.utime(os.path.join(fakeFTP,'pubmed','updatefiles','pubmed003.xml.gz'),(1600000000,1600000000))
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com')
+	assert FakeFTPHost.downloads == ['pubmed/updatefiles/pubmed003.xml.gz']
+	assert os.path.getmtime(os.path.join(outDir,'updatefiles','pubmed003.xml.gz')) == 1600000000
+
+	# A gzipped file that has since been unzipped isn't downloaded again
+	FakeFTPHost.downloads = []
+	os.rename(os.path.join(outDir,'baseline','pubmed001.xml.gz'),os.path.join(outDir,'baseline','pubmed001.xml'))
+	pubrunner.getresource.downloadFTP('pubmed',outDir,'ftp.example.com')
+	assert FakeFTPHost.downloads == []
+
+def createTarArchive(archive,members,timestamp):
+	with tarfile.open(archive,'w:gz') as tar:
+		for name,content in members.items():
+			info = tarfile.TarInfo(name)
+			info.size = len(content)
+			info.mtime = timestamp
+			tar.addfile(info,io.BytesIO(content))
+	os.utime(archive,(timestamp,timestamp))
+
+def createGzipFile(filename,content,timestamp):
+	with gzip.open(filename,'wb') as f:
+		f.write(content)
+	os.utime(filename,(timestamp,timestamp))
+
+def test_extractArchives(tmpdir):
+	resourceDir = str(tmpdir.mkdir('resource'))
+	archive = os.path.join(resourceDir,'articles.tar.gz')
+	createTarArchive(archive,{'a.xml':b'<a/>', 'notes.txt':b'notes', 'sub/c.xml':b'<c/>'},1500000000)
+	createGzipFile(os.path.join(resourceDir,'x.xml.gz'),b'<x/>',1500000000)
+	createGzipFile(os.path.join(resourceDir,'y.txt.gz'),b'y',1500000000)
+
+	pubrunner.getresource.extractArchives(resourceDir,'.xml',processes=2)
+
+	# Only files matching the filter are extracted and the archives are removed
+	extracted = sorted( os.path.relpath(os.path.join(root,f),resourceDir) for root,_,files in os.walk(resourceDir) for f in files )
+	assert extracted == ['a.xml','sub/c.xml','x.xml']
+	with open(os.path.join(resourceDir,'sub','c.xml'),'rb') as f:
+		assert f.read() == b'<c/>'
+	assert os.path.getmtime(os.path.join(resourceDir,'x.xml')) == 1500000000
+
+def test_extractArchives_skipUnchanged(tmpdir):
+	resourceDir = str(tmpdir.mkdir('resource'))
+	archive = os.path.join(resourceDir,'articles.tar.gz')
+	gzipFile = os.path.join(resourceDir,'x.xml.gz')
+	createTarArchive(archive,{'a.xml':b'<a/>'},1500000000)
+	createGzipFile(gzipFile,b'<x/>',1500000000)
+	pubrunner.getresource.extractArchives(resourceDir)
+
+	# The same archives downloaded again aren't extracted again
+	for name in ['a.xml','x.xml']:
+		with open(os.path.join(resourceDir,name),'wb') as f:
+			f.write(b'<local/>')
+		os.utime(os.path.join(resourceDir,name),(1600000000,1600000000))
+	createTarArchive(archive,{'a.xml':b'<a/>'},1500000000)
+	createGzipFile(gzipFile,b'<x/>',1500000000)
+	pubrunner.getresource.extractArchives(resourceDir)
+
+	for name in ['a.xml','x.xml']:
+		with open(os.path.join(resourceDir,name),'rb') as f:
+			assert f.read() == b'<local/>'
+	assert not os.path.isfile(gzipFile)
+
+	# But updated archives are
+	createTarArchive(archive,{'a.xml':b'<a2/>'},1700000000)
+	createGzipFile(gzipFile,b'<x2/>',1700000000)
+	pubrunner.getresource.extractArchives(resourceDir)
+
+	with open(os.path.join(resourceDir,'a.xml'),'rb') as f:
+		assert f.read() == b'<a2/>'
+	with open(os.path.join(resourceDir,'x.xml'),'rb') as f:
+		assert f.read() == b'<x2/>'
@@ -0,0 +1,165 @@
+import pubrunner
+import pubrunner.getresource
+import os
+import json
+import gzip
+import shutil
+import tarfile
+import functools
+import importlib
+import pytest
+import pubrunner.convert
+from pubrunner.pubmed_hash import md5digest,hashMedlineFile,loadHashColumns,loadHashManifest,saveHashManifest,planPubmedHashes
+from pubrunner.archive import buildArchiveIndex,joinMemberPath
+
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'data')
+pubmedFile = os.path.join(dataDir,'pubmed.xml')
+
+# pubrunner.pubmed_hash is the function of the same name
+pubmedHashModule = importlib.import_module('pubrunner.pubmed_hash')
+
+def createPubmedFiles(inDir,count):
+	os.makedirs(inDir)
+	for i in range(count):
+		shutil.copyfile(pubmedFile,os.path.join(inDir,'pubmed%02d.xml' % (i+1)))
+
+# The hashes from the fully converted documents, which the hash-only extraction must match
+def hashFromConvertedDocuments(pubmedFile):
+	allHashes = {}
+	for doc in pubrunner.processMedlineFile(pubmedFile):
+		hashes = {}
+		hashes['year'] = md5digest(doc['pubYear'])
+		hashes['title'] = md5digest(doc['title'])
+		hashes['abstract'] = md5digest(doc['abstract'])
+		hashes['journal'] = md5digest(doc['journal'])
+		hashes['journalISO'] = md5digest(doc['journalISO'])
+		allHashes[int(doc['pmid'])] = hashes
+	return allHashes
+
+def test_hashMedlineFile(tmpdir,monkeypatch):
+	expected = hashFromConvertedDocuments(pubmedFile)
+	assert len(expected) == 5
+
+	gzipFile = str(tmpdir.join('pubmed.xml.gz'))
+	with open(pubmedFile,'rb') as inF, gzip.open(gzipFile,'wb') as outF:
+		shutil.copyfileobj(inF,outF)
+	tarPath = str(tmpdir.join('pubmed.tar'))
+	with tarfile.open(tarPath,'w') as tar:
+		tar.add(pubmedFile,arcname='baseline/pubmed.xml')
+	buildArchiveIndex(tarPath)
+	memberPath = joinMemberPath(tarPath,'baseline/pubmed.xml')
+
+	for parser in ['etree','lxml']:
+		assert dict(hashMedlineFile(pubmedFile,parser)) == expected
+		assert dict(hashMedlineFile(gzipFile,parser)) == expected
+		assert dict(hashMedlineFile(memberPath,parser)) == expected
+
+	# Compressed files are read in blocks, so check with blocks that split the citations too
+	monkeypatch.setattr(pubmedHashModule,'findPubmedArticlesInStream',functools.partial(pubrunner.convert.findPubmedArticlesInStream,blockSize=100))
+	assert list(hashMedlineFile(gzipFile)) == list(hashMedlineFile(pubmedFile))
+	assert list(hashMedlineFile(memberPath)) == list(hashMedlineFile(pubmedFile))
+
+# Plans the hashing and does it, as generatePubmedHashes does with the built-in executor
+def planAndHash(inDir,hashDir):
+	toHash,files = planPubmedHashes(inDir,hashDir)
+	for pubmedXMLFile,hashFile in toHash:
+		if not os.path.isdir(os.path.dirname(hashFile)):
+			os.makedirs(os.path.dirname(hashFile))
+	pubrunner.hashPubmedFiles([ inFile for inFile,hashFile in toHash ],[ hashFile for inFile,hashFile in toHash ])
+	saveHashManifest(hashDir,files)
+	return sorted( os.path.relpath(pubmedXMLFile,inDir) for pubmedXMLFile,hashFile in toHash )
+
+def test_planPubmedHashes(tmpdir):
+	inDir,hashDir = str(tmpdir.join('PUBMED')),str(tmpdir.join('PUBMED.hashes'))
+	createPubmedFiles(inDir,3)
+	assert planAndHash(inDir,hashDir) == ['pubmed01.xml','pubmed02.xml','pubmed03.xml']
+	manifest = loadHashManifest(hashDir)
+
+	# Unchanged
+	assert planAndHash(inDir,hashDir) == []
+	assert loadHashManifest(hashDir) == manifest
+
+	# Touched but unchanged (e.g. downloaded again) only updates the manifest
+	touchedFile = os.path.join(inDir,'pubmed01.xml')
+	os.utime(touchedFile,(1500000000,1500000000))
+	assert planAndHash(inDir,hashDir) == []
+	newManifest = loadHashManifest(hashDir)
+	assert newManifest['files']['pubmed01.xml']['mtime'] == 1500000000
+	assert newManifest['digest'] == manifest['digest']
+
+	# Changed
+	with open(os.path.join(inDir,'pubmed02.xml'),'ab') as f:
+		f.write(b'\n')
+	assert planAndHash(inDir,hashDir) == ['pubmed02.xml']
+	assert loadHashManifest(hashDir)['digest'] != manifest['digest']
+
+	# Missing hash file, with the Pubmed file unchanged since the manifest was written
+	os.remove(os.path.join(hashDir,'pubmed03.xml.hashes'))
+	assert planAndHash(inDir,hashDir) == ['pubmed03.xml']
+	assert os.path.isfile(os.path.join(hashDir,'pubmed03.xml.hashes'))
+	assert planAndHash(inDir,hashDir) == []
+
+def readBatches(batchDir):
+	batches = {}
+	for name in sorted(os.listdir(batchDir)):
+		with open(os.path.join(batchDir,name)) as f:
+			batches[name] = json.load(f)
+	return batches
+
+def test_batchPlan(tmpdir,monkeypatch):
+	launched = []
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {'local':{'cores':8,'memory':3000,'jobMemory':1000}})
+	monkeypatch.setattr(pubrunner,'launchSnakemake',lambda snakeFile,parameters : launched.append((snakeFile,parameters)))
+
+	outDir = str(tmpdir.join('PUBMED.hashes'))
+	batchDir = outDir + '.BATCHES'
+	os.makedirs(batchDir)
+	with open(os.path.join(batchDir,'batch.00000000.done'),'w') as f:
+		f.write('')
+
+	inAndOut = [ ['in/pubmed%02d.xml' % i, 'out/pubmed%02d.xml.hashes' % i] for i in range(5) ]
+	pubrunner.getresource.runPubmedHashesWithSnakemake(inAndOut,outDir,2,4)
+
+	# The previous plan (and its done markers) is replaced
+	assert readBatches(batchDir) == {'batch.00000000.json':inAndOut[0:2], 'batch.00000001.json':inAndOut[2:4], 'batch.00000002.json':inAndOut[4:5]}
+
+	assert len(launched) == 1
+	snakeFile,parameters = launched[0]
+	assert snakeFile == os.path.join(pubrunner.__path__[0],'Snakefiles','PubmedHashes.py')
+	# Limited by the local memory for three jobs
+	assert parameters == {'BATCHDIR':batchDir,'HASHPROCESSES':'3'}
+
+@pytest.mark.skipif(shutil.which('snakemake') is None, reason="Snakemake is not installed")
+def test_snakemakeBatches(tmpdir,monkeypatch):
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {'local':{'cores':1,'executor':'snakemake'}})
+	monkeypatch.chdir(str(tmpdir))
+	# The Snakemake jobs import pubrunner
+	packageDir = os.path.dirname(pubrunner.__path__[0])
+	monkeypatch.setenv('PYTHONPATH',os.pathsep.join([packageDir] + [ p for p in os.environ.get('PYTHONPATH','').split(os.pathsep) if p ]))
+
+	inDir,outDir = str(tmpdir.join('PUBMED')),str(tmpdir.join('PUBMED.hashes'))
+	batchDir = outDir + '.BATCHES'
+	createPubmedFiles(inDir,3)
+
+	pubrunner.getresource.generatePubmedHashes(inDir,outDir,batchSize=2,processes=1)
+
+	assert sorted(os.listdir(batchDir)) == ['batch.00000000.done','batch.00000000.json','batch.00000001.done','batch.00000001.json']
+	hashFiles = [ os.path.join(outDir,'pubmed%02d.xml.hashes' % (i+1)) for i in range(3) ]
+	for hashFile in hashFiles:
+		assert [ list(pmids) for pmids,columns in loadHashColumns(hashFile).values() ] == [[1001,1002,1003,1004,1005]]
+	assert sorted(loadHashManifest(outDir)['files'].keys()) == ['pubmed01.xml','pubmed02.xml','pubmed03.xml']
+
+	# Only batches without a done marker are run again
+	os.remove(os.path.join(batchDir,'batch.00000001.done'))
+	timestamps = [ os.path.getmtime(hashFile) for hashFile in hashFiles ]
+	snakeFile = os.path.join(pubrunner.__path__[0],'Snakefiles','PubmedHashes.py')
+	pubrunner.launchSnakemake(snakeFile,parameters={'BATCHDIR':batchDir,'HASHPROCESSES':'1'})
+
+	assert os.path.isfile(os.path.join(batchDir,'batch.00000001.done'))
+	newTimestamps = [ os.path.getmtime(hashFile) for hashFile in hashFiles ]
+	assert newTimestamps[:2] == timestamps[:2]
+	assert newTimestamps[2] > timestamps[2]
+
+	# Nothing is planned once the manifest is up to date
+	monkeypatch.setattr(pubrunner,'launchSnakemake',lambda snakeFile,parameters : pytest.fail("Snakemake launched"))
+	pubrunner.getresource.generatePubmedHashes(inDir,outDir,batchSize=2,processes=1)
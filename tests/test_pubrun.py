@@ -0,0 +1,154 @@
+import os
+import random
+import importlib
+from collections import defaultdict
+
+# pubrunner.pubrun is also the name of a function exported by pubrunner, so get the module directly
+pubrunModule = importlib.import_module('pubrunner.pubrun')
+
+# The original per-file chunk planner that the per-chunk one must match exactly
+def assignFilesForConversion_reference(files, previousAssignmentFile, outDir, outPattern, maxChunkSize, pmcidsToLastUpdate=None):
+	if not pmcidsToLastUpdate is None:
+		print("Sorting files by PMC last update metadata")
+		filesWithUpdates = [ (pmcidsToLastUpdate[pubrunModule.getPMCIDFromFilename(f)],f) for f in files ]
+		atleastOneUpdate = any (lastupdate != '' for lastupdate,f in filesWithUpdates )
+		assert atleastOneUpdate, "No update dates associated with PMCIDs. Must have been a problem loading the file"
+		filesWithUpdates = sorted(filesWithUpdates)
+		files = [ f for lastupdate,f in filesWithUpdates ]
+
+	assignedChunks = {}
+	for outputFile,chunk in previousAssignmentFile.items():
+		assert isinstance(chunk,list)
+		for f in chunk:
+			assert not f in assignedChunks
+			assignedChunks[f] = outputFile
+
+	# We'll check if any previous input files have disappeared, and set that chunk to dirty (so it is reprocessed)
+	filesSet = set(files)
+	missingFiles = [ f for f in assignedChunks.keys() if not f in filesSet ]
+	dirtyOutputFiles = set( [ assignedChunks[f] for f in missingFiles ] )
+	for f in missingFiles:
+		del assignedChunks[f]
+
+	if len(assignedChunks) > 0:
+		# We're just take the last chunk alphabetically
+		currentChunk = sorted(assignedChunks.values())[-1]
+		currentChunkSize = len( [ f for f in assignedChunks.values() if f == currentChunk ] )
+	else:
+		currentChunk = None
+		currentChunkSize = 0
+
+	outputFileNamer = pubrunModule.OutputFileNamer(outDir,outPattern)
+
+	for f in files:
+		if not f in assignedChunks:
+			if currentChunk is None or currentChunkSize >= maxChunkSize:
+				currentChunk = outputFileNamer.next()
+				currentChunkSize = 0
+			
+			assignedChunks[f] = currentChunk
+			dirtyOutputFiles.add(currentChunk)
+			currentChunkSize += 1
+
+	# Remove any dirty files to force them to be recalculated
+	for dirtyOutputFile in dirtyOutputFiles:
+		if os.path.isfile(dirtyOutputFile):
+			os.unlink(dirtyOutputFile)
+			print("Removing:", dirtyOutputFile)
+
+	outputFilesWithChunks = defaultdict(list)
+	for f,outputFile in assignedChunks.items():
+		outputFilesWithChunks[outputFile].append(f)
+
+	return outputFilesWithChunks
+
+outPattern = 'PMCOA.%08d.bioc'
+
+# Runs both planners on the same previous assignment (with the given output files from it existing)
+# and gives the chunks and the output files that are left afterwards from each
+def runBothPlanners(outDir,files,previousChunks,maxChunkSize,pmcidsToLastUpdate=None,existingOutputs=None):
+	if existingOutputs is None:
+		existingOutputs = list(previousChunks.keys())
+
+	results = []
+	for planner in [assignFilesForConversion_reference,pubrunModule.assignFilesForConversion]:
+		for f in os.listdir(outDir):
+			os.unlink(os.path.join(outDir,f))
+		for outputFile in existingOutputs:
+			open(outputFile,'w').close()
+
+		previous = { outputFile:list(chunk) for outputFile,chunk in previousChunks.items() }
+		chunks = planner(list(files),previous,outDir,outPattern,maxChunkSize,pmcidsToLastUpdate)
+		results.append((dict(chunks),sorted(os.listdir(outDir))))
+	return results
+
+def test_assignFiles_noPrevious(tmpdir):
+	outDir = str(tmpdir)
+	files = [ '/data/PMC%03d.nxml' % i for i in range(25) ]
+	(oldChunks,oldOutputs),(newChunks,newOutputs) = runBothPlanners(outDir,files,{},10)
+
+	assert newChunks == oldChunks
+	assert [ len(chunk) for _,chunk in sorted(newChunks.items()) ] == [10,10,5]
+
+def test_assignFiles_previous(tmpdir):
+	outDir = str(tmpdir)
+	chunk0,chunk1,chunk2 = [ os.path.join(outDir,outPattern % i) for i in range(3) ]
+	previousChunks = {chunk0:['/data/a1.nxml','/data/a2.nxml','/data/a3.nxml'], chunk1:['/data/b1.nxml','/data/b2.nxml','/data/b3.nxml'], chunk2:['/data/c1.nxml']}
+
+	# a2 has been removed and there are new files (listed in between the old ones)
+	files = ['/data/a1.nxml','/data/a3.nxml','/data/n1.nxml','/data/b1.nxml','/data/b2.nxml','/data/b3.nxml','/data/c1.nxml','/data/n2.nxml','/data/n3.nxml','/data/n4.nxml']
+	(oldChunks,oldOutputs),(newChunks,newOutputs) = runBothPlanners(outDir,files,previousChunks,3)
+
+	assert newChunks == oldChunks
+	assert newOutputs == oldOutputs
+	assert newChunks[chunk0] == ['/data/a1.nxml','/data/a3.nxml']
+	assert newChunks[chunk2] == ['/data/c1.nxml','/data/n1.nxml','/data/n2.nxml']
+
+	# The chunk with a removed file and the ones with new files are run again
+	assert newOutputs == [os.path.basename(chunk1)]
+
+def test_assignFiles_reuseMissingOutput(tmpdir):
+	outDir = str(tmpdir)
+	chunk0,chunk1 = [ os.path.join(outDir,outPattern % i) for i in range(2) ]
+	previousChunks = {chunk0:['/data/a1.nxml','/data/a2.nxml'], chunk1:['/data/b1.nxml','/data/b2.nxml']}
+	files = ['/data/a1.nxml','/data/a2.nxml','/data/b1.nxml','/data/b2.nxml'] + [ '/data/n%d.nxml' % i for i in range(5) ]
+
+	# The first chunk's output was never created so its name is given out again for new files
+	(oldChunks,oldOutputs),(newChunks,newOutputs) = runBothPlanners(outDir,files,previousChunks,2,existingOutputs=[chunk1])
+
+	assert newChunks == oldChunks
+	assert newOutputs == oldOutputs
+	assert newChunks[chunk0] == ['/data/a1.nxml','/data/a2.nxml','/data/n0.nxml','/data/n1.nxml']
+
+def test_assignFiles_pmcUpdates(tmpdir):
+	outDir = str(tmpdir)
+	random.seed(1)
+	files = [ '/data/PMCOA/PMC%08d.nxml' % i for i in range(50) ]
+	pmcidsToLastUpdate = { 'PMC%08d' % i:'2019-%02d-%02d' % (random.randint(1,12),random.randint(1,28)) for i in range(50) }
+	chunk0 = os.path.join(outDir,outPattern % 0)
+	previousChunks = {chunk0:sorted(files,key=lambda f:pmcidsToLastUpdate[pubrunModule.getPMCIDFromFilename(f)])[:7]}
+
+	(oldChunks,oldOutputs),(newChunks,newOutputs) = runBothPlanners(outDir,files,previousChunks,8,pmcidsToLastUpdate)
+
+	assert newChunks == oldChunks
+	assert newOutputs == oldOutputs
+	assert len(newChunks) == 7
+
+def test_assignFiles_random(tmpdir):
+	outDir = str(tmpdir)
+	random.seed(42)
+	for _ in range(50):
+		maxChunkSize = random.randint(1,6)
+		allFiles = [ '/data/f%03d.nxml' % i for i in range(random.randint(0,40)) ]
+
+		previousChunks = {}
+		previousFiles = random.sample(allFiles,random.randint(0,len(allFiles)))
+		for i in range(0,len(previousFiles),maxChunkSize):
+			previousChunks[os.path.join(outDir,outPattern % (i // maxChunkSize))] = previousFiles[i:i+random.randint(1,maxChunkSize)]
+
+		files = [ f for f in allFiles if random.random() > 0.1 ]
+		existingOutputs = [ outputFile for outputFile in previousChunks if random.random() > 0.2 ]
+		(oldChunks,oldOutputs),(newChunks,newOutputs) = runBothPlanners(outDir,files,previousChunks,maxChunkSize,existingOutputs=existingOutputs)
+
+		assert newChunks == oldChunks
+		assert newOutputs == oldOutputs
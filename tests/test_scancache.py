@@ -0,0 +1,111 @@
+import pubrunner
+import pubrunner.scancache
+import os
+
+oldTime = 1500000000
+
+def createTree(baseDir):
+	os.makedirs(os.path.join(baseDir,'sub','deeper'))
+	for name in ['file10.txt','file2.txt','other.txt','sub/file3.txt','sub/deeper/file1.txt']:
+		with open(os.path.join(baseDir,name),'w') as f:
+			f.write(name)
+
+# Cached directories are only reused once their mtime is safely in the past
+def makeOld(baseDir):
+	for root,dirs,files in os.walk(baseDir):
+		os.utime(root,(oldTime,oldTime))
+
+def test_cachedMatchesUncached(tmpdir):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	makeOld(dataDir)
+
+	uncached = pubrunner.scancache.findFilesWithStats(dataDir,useCache=False)
+	assert not os.path.isfile(pubrunner.scancache.getScanCacheFile(dataDir))
+
+	first = pubrunner.scancache.findFilesWithStats(dataDir)
+	second = pubrunner.scancache.findFilesWithStats(dataDir)
+	assert first == uncached
+	assert second == uncached
+
+	filepaths,timestamps = pubrunner.scancache.findFilesWithTimestamps(dataDir)
+	uncachedFilepaths,uncachedTimestamps = pubrunner.scancache.findFilesWithTimestamps(dataDir,useCache=False)
+	assert filepaths == uncachedFilepaths
+	assert timestamps == uncachedTimestamps
+	assert timestamps == { path:os.path.getmtime(path) for path in filepaths }
+
+def test_cacheNotInDataDir(tmpdir):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	link = str(tmpdir.join('link'))
+	os.symlink(dataDir,link)
+
+	pubrunner.scancache.findFilesWithStats(link)
+
+	cacheFile = pubrunner.scancache.getScanCacheFile(link)
+	assert cacheFile == pubrunner.scancache.getScanCacheFile(dataDir)
+	assert os.path.dirname(cacheFile) == pubrunner.scancache.cacheDir
+	assert os.path.isfile(cacheFile)
+	assert sorted(os.listdir(str(tmpdir))) == ['data','link']
+
+def test_cacheReused(tmpdir):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	makeOld(dataDir)
+	filepaths,stats = pubrunner.scancache.findFilesWithStats(dataDir)
+
+	# An unchanged directory mtime means the cached listing is used without listing the directory again
+	with open(os.path.join(dataDir,'sub','file4.txt'),'w') as f:
+		f.write('file4')
+	os.utime(os.path.join(dataDir,'sub'),(oldTime,oldTime))
+	assert pubrunner.scancache.findFilesWithStats(dataDir) == (filepaths,stats)
+
+def test_fileModifiedInPlace(tmpdir):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	makeOld(dataDir)
+	pubrunner.scancache.findFilesWithStats(dataDir)
+
+	# Rewriting a file doesn't change the mtime of its directory
+	editedFile = os.path.join(dataDir,'sub','file3.txt')
+	with open(editedFile,'w') as f:
+		f.write('edited in place')
+	os.utime(editedFile,(1600000000,1600000000))
+	os.utime(os.path.join(dataDir,'sub'),(oldTime,oldTime))
+
+	filepaths,stats = pubrunner.scancache.findFilesWithStats(dataDir)
+	assert stats[editedFile] == (len('edited in place'),1600000000)
+	assert (filepaths,stats) == pubrunner.scancache.findFilesWithStats(dataDir,useCache=False)
+	filepaths,timestamps = pubrunner.scancache.findFilesWithTimestamps(dataDir)
+	assert timestamps[editedFile] == 1600000000
+
+	# Also when the file has gone without the directory changing
+	os.remove(editedFile)
+	os.utime(os.path.join(dataDir,'sub'),(oldTime,oldTime))
+	assert pubrunner.scancache.findFilesWithStats(dataDir) == pubrunner.scancache.findFilesWithStats(dataDir,useCache=False)
+
+def test_changedDirectoryRescanned(tmpdir):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	makeOld(dataDir)
+	pubrunner.scancache.findFilesWithStats(dataDir)
+
+	with open(os.path.join(dataDir,'sub','file4.txt'),'w') as f:
+		f.write('file4')
+	os.remove(os.path.join(dataDir,'sub','deeper','file1.txt'))
+	os.replace(os.path.join(dataDir,'file2.txt'),os.path.join(dataDir,'file5.txt'))
+
+	filepaths,stats = pubrunner.scancache.findFilesWithStats(dataDir)
+	assert (filepaths,stats) == pubrunner.scancache.findFilesWithStats(dataDir,useCache=False)
+	assert [ os.path.relpath(path,dataDir) for path in filepaths ] == ['other.txt','sub/file3.txt','sub/file4.txt','file5.txt','file10.txt']
+
+def test_unwritableCache(tmpdir,monkeypatch):
+	dataDir = str(tmpdir.join('data'))
+	createTree(dataDir)
+	notADir = str(tmpdir.join('notadir'))
+	with open(notADir,'w') as f:
+		f.write('')
+	monkeypatch.setattr(pubrunner.scancache,'cacheDir',os.path.join(notADir,'cache'))
+
+	filepaths,stats = pubrunner.scancache.findFilesWithStats(dataDir)
+	assert (filepaths,stats) == pubrunner.scancache.findFilesWithStats(dataDir,useCache=False)
@@ -0,0 +1,55 @@
+import pubrunner
+import pubrunner.snakemake
+import pytest
+
+def runLaunchSnakemake(monkeypatch,globalSettings,useCluster=True):
+	calls = []
+	def fakeCall(command,env):
+		calls.append((command,env))
+		return 0
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : globalSettings)
+	monkeypatch.setattr(pubrunner.snakemake.subprocess,'call',fakeCall)
+
+	pubrunner.snakemake.launchSnakemake('Example.py',useCluster=useCluster,parameters={'INDIR':'in'})
+
+	assert len(calls) == 1
+	return calls[0]
+
+def test_local(monkeypatch):
+	command,env = runLaunchSnakemake(monkeypatch,{'local':{'cores':3,'memory':4000,'jobMemory':500}})
+	assert command == ['snakemake','--cores','3','--resources','mem_mb=4000','--nolock','-s','Example.py']
+	assert env['INDIR'] == 'in'
+	assert env['JOBMEMORY'] == '500'
+
+def test_localDefaults(monkeypatch):
+	monkeypatch.setattr(pubrunner.snakemake.multiprocessing,'cpu_count',lambda : 8)
+	command,env = runLaunchSnakemake(monkeypatch,{})
+	assert command == ['snakemake','--cores','8','--nolock','-s','Example.py']
+	assert env['JOBMEMORY'] == '1000'
+
+def test_clusterNotUsed(monkeypatch):
+	globalSettings = {'local':{'cores':2}, 'cluster':{'options':'qsub -V'}}
+	command,env = runLaunchSnakemake(monkeypatch,globalSettings,useCluster=False)
+	assert command == ['snakemake','--cores','2','--nolock','-s','Example.py']
+
+def test_clusterOptions(monkeypatch):
+	globalSettings = {'local':{'cores':2,'memory':4000,'jobMemory':500}, 'cluster':{'jobs':10,'options':'qsub -V'}}
+	command,env = runLaunchSnakemake(monkeypatch,globalSettings)
+	assert command == ['snakemake','--jobs','10','--latency-wait','60','--cluster','qsub -V','--nolock','-s','Example.py']
+	assert env['JOBMEMORY'] == '500'
+
+def test_clusterDRMAA(monkeypatch):
+	globalSettings = {'local':{'cores':2,'memory':4000}, 'cluster':{'drmaa':True}}
+	command,env = runLaunchSnakemake(monkeypatch,globalSettings)
+	assert command == ['snakemake','--jobs','1','--latency-wait','60','--drmaa','--nolock','-s','Example.py']
+
+def test_clusterMissingOptions(monkeypatch):
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {'cluster':{'jobs':2}})
+	with pytest.raises(RuntimeError):
+		pubrunner.snakemake.launchSnakemake('Example.py')
+
+def test_failedRun(monkeypatch):
+	monkeypatch.setattr(pubrunner,'getGlobalSettings',lambda : {})
+	monkeypatch.setattr(pubrunner.snakemake.subprocess,'call',lambda command,env : 1)
+	with pytest.raises(RuntimeError, match='Example.py'):
+		pubrunner.snakemake.launchSnakemake('Example.py')